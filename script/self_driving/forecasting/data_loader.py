@@ -6,9 +6,14 @@ query trace producer.
 
 import logging
 import csv
-from typing import Dict
+import json
+import os
+from typing import Dict, Optional
 import numpy as np
 
+# The suffix of the columnar copy of a trace file (converted by modeling/data/columnar_data.py)
+COLUMNAR_SUFFIX = '.columnar'
+
 
 class DataLoader:
     # Hardcoded db_oid column index in the query_trace file
@@ -36,10 +41,16 @@ class DataLoader:
 
     def _load_data(self) -> np.ndarray:
         """
-        Load data from csv
+        Load data from csv (or from its columnar copy if there is an up-to-date one)
         :return: Loaded 2D numpy array of [db_oid, query_id, timestamp]
         """
         logging.info(f"Loading data from {self._query_trace_file}")
+        data = self._load_columnar_data()
+        if data is not None:
+            if len(data) == 0:
+                raise ValueError("Empty trace file")
+            return data
+
         # Load data from the files
         with open(self._query_trace_file, newline='') as csvfile:
             reader = csv.DictReader(csvfile)
@@ -51,6 +62,28 @@ class DataLoader:
 
             return data
 
+    def _load_columnar_data(self) -> Optional[np.ndarray]:
+        """
+        Load data from the columnar copy of the trace file without parsing it
+        :return: Loaded 2D numpy array of [db_oid, query_id, timestamp], or None if there is no up-to-date columnar copy
+        """
+        path = self._query_trace_file
+        if not path.endswith(COLUMNAR_SUFFIX):
+            path = os.path.splitext(path)[0] + COLUMNAR_SUFFIX
+        if not os.path.isdir(path):
+            return None
+
+        with open(os.path.join(path, 'schema.json')) as schema_file:
+            schema = json.load(schema_file)
+        if not self._query_trace_file.endswith(COLUMNAR_SUFFIX):
+            stat = os.stat(self._query_trace_file)
+            if schema['source'][1:] != [stat.st_size, stat.st_mtime_ns]:
+                return None
+
+        columns = [np.load(os.path.join(path, f"c{schema['header'].index(name)}.npy"))
+                   for name in ('db_oid', 'query_id', 'timestamp')]
+        return np.stack(columns, axis=1).astype(np.int64)
+
     def _to_timeseries(self, data: np.ndarray) -> None:
         """
         Convert the 2D array with query id and timestamps into a map of time-series for each query id
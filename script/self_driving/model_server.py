@@ -3,7 +3,32 @@
 This file contains the python ModelServer implementation.
 
 Invoke with:
-    `model_server.py <ZMQ_ENDPOINT>`
+    `model_server.py <ZMQ_ENDPOINT> [BATCH_DEADLINE_MS] [MAX_BATCH_SIZE] [--workers N] [--record FILE]`
+
+With N > 1 workers, a ModelServerBroker connects to the ModelServerManager instead and forwards the commands to N
+ModelServer processes, so that the inference scales with the cores instead of being run by one interpreter.
+
+With --record FILE (or the MODEL_SERVER_RECORD_FILE environment variable), the received messages are appended to FILE
+to be replayed by model_server_benchmark.py.
+
+The INFER requests on the same model (and opunit) that arrive within BATCH_DEADLINE_MS of each other are coalesced
+into one prediction of up to MAX_BATCH_SIZE requests (a deadline of 0 disables the coalescing).
+
+The heavy dependencies (sklearn, LightGBM, torch, pandas) are imported on first use by the model type that needs
+them, so the server connects to the ModelServerManager right away. The time of these lazy imports and model loads is
+logged; run with `python3 -X importtime model_server.py <ZMQ_ENDPOINT>` for a per-module import time breakdown.
+
+The TRAIN commands run as jobs in background threads (see JobScheduler), so the other commands (e.g., PRINT and INFER)
+are executed while the models are trained. The jobs run one at a time in the order of their "priority" (lower first). A
+job is identified by its "job_id" (the save_path by default), and can be queried with STATUS and cancelled with CANCEL.
+The OU training checkpoints after each opunit, and a TRAIN of the same save_path resumes from the checkpoint (e.g.,
+after a ModelServer restart).
+
+On the same host, the ModelServerManager can pass the features of an INFER request through POSIX shared memory
+instead of JSON: "features_shm" describes the feature matrix in a /dev/shm segment ({segment, offset, shape, dtype}),
+which is read in place, and "result_shm" is a slot of the same segment ({segment, offset, capacity}) that the
+predictions are written into. The response then only carries the {shape, dtype} of the predictions (the predictions
+that do not fit into the slot are sent back as JSON).
 
 The server should be stateless but with caching of models.
 The message format that the ModelServer expects should be kept consistent with Messenger class in
@@ -19,31 +44,67 @@ TODO(Ricky):
 """
 
 from __future__ import annotations
+import time
+
+# Record the start time before anything else is imported for the startup time report
+_START_TIME = time.perf_counter()
+
+import argparse
+import collections
+import ctypes
 import enum
+import heapq
+import importlib
+import itertools
+import queue
+import signal
+import subprocess
 import sys
 import atexit
+import threading
 from abc import ABC, abstractmethod
 from enum import Enum, auto, IntEnum
-from typing import Dict, Optional, Tuple, List, Any
+from typing import Callable, Dict, Optional, Tuple, List, Any
 import json
 import logging
 import os
 import pprint
 import pickle
+import zlib
 from pathlib import Path
 
 import numpy as np
 import zmq
 
-from modeling.ou_model_trainer import OUModelTrainer
-from modeling.interference_model_trainer import InterferenceModelTrainer
-from modeling.util import logging_util
+from modeling.util import logging_util, shared_memory_util
 from modeling.type import OpUnit
 from modeling.info import data_info
-from forecasting.forecaster import Forecaster, parse_model_config
 
 logging_util.init_logging('info')
 
+# prctl option to get a signal when the parent process exits (linux/prctl.h)
+_PR_SET_PDEATHSIG = 1
+
+# The time (in seconds) spent on the lazy imports and the model loads
+IMPORT_TIMES: Dict[str, float] = {}
+
+
+def _lazy_import(module_name: str):
+    """
+    Import a module on its first use and record the import time
+    :param module_name: the full name of the module
+    :return: the module
+    """
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    IMPORT_TIMES[module_name] = time.perf_counter() - start
+    logging.info(f"Imported {module_name} in {IMPORT_TIMES[module_name]:.3f}s")
+    return module
+
 
 class ModelType(enum.IntEnum):
     """ModelType
@@ -71,6 +132,9 @@ class Command(Enum):
     QUIT = auto()  # Quit the server
     PRINT = auto()  # Print the message
     INFER = auto()  # Do inference on a trained model
+    PIPELINE_INFER = auto()  # Do inference on the pipelines of OUs with a trained OU model map
+    CANCEL = auto()  # Cancel a training job
+    STATUS = auto()  # Get the status of the training jobs
 
     def __str__(self) -> str:
         return self.name
@@ -85,6 +149,12 @@ class Command(Enum):
             return Command.TRAIN
         elif cmd_str == "INFER":
             return Command.INFER
+        elif cmd_str == "PIPELINE_INFER":
+            return Command.PIPELINE_INFER
+        elif cmd_str == "CANCEL":
+            return Command.CANCEL
+        elif cmd_str == "STATUS":
+            return Command.STATUS
         else:
             raise ValueError("Invalid command")
 
@@ -124,6 +194,191 @@ class Message:
         return pprint.pformat(self.__dict__)
 
 
+class JobState(Enum):
+    """
+    The state of a training job
+    """
+    QUEUED = auto()
+    RUNNING = auto()
+    SUCCEEDED = auto()
+    FAILED = auto()
+    CANCELLED = auto()
+
+
+class JobCancelled(Exception):
+    """
+    Raised in a training job that is cancelled to stop the training
+    """
+    pass
+
+
+class Job:
+    """
+    A training job that is run by the JobScheduler
+    """
+
+    def __init__(self, job_id: str, send_id: int, model_type: ModelType, data: Dict, priority: int) -> None:
+        """
+        :param job_id: the id to query and cancel the job with
+        :param send_id: the callback id of the TRAIN command on the ModelServerManager
+        :param model_type: the type of the model to train
+        :param data: the data of the TRAIN command
+        :param priority: the priority of the job (a lower value starts first)
+        """
+        self.job_id = job_id
+        self.send_id = send_id
+        self.model_type = model_type
+        self.data = data
+        self.priority = priority
+        self.state = JobState.QUEUED
+        # The progress reported by the training (e.g., the opunit that is being trained)
+        self.progress: Dict = {}
+        # The response of the TRAIN command when the job is done
+        self.response: Optional[Dict] = None
+        self._cancel_event = threading.Event()
+
+    def cancel(self) -> None:
+        self._cancel_event.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def report_progress(self, **progress) -> None:
+        """
+        Report the progress of the training, which is also where a cancelled training stops
+        :param progress: the progress information
+        """
+        self.progress = progress
+        if self.is_cancelled():
+            raise JobCancelled(f"Job {self.job_id} is cancelled")
+
+    def get_status(self) -> Dict:
+        return {"state": self.state.name, "type": self.model_type.name, "priority": self.priority,
+                "progress": self.progress}
+
+
+class JobScheduler:
+    """
+    Scheduler that runs the training jobs in background threads
+
+    The jobs run one at a time, in the order of their priority (and then arrival). The job threads share the process
+    globals of the modeling pipelines (e.g., profiling_util.instance and the random number generators) and the model
+    caches of the server, so the trainings are not safe to run at the same time, even for different model types.
+    The scheduler is only used by the thread of the ModelServer loop; the job threads only set their own state and
+    report their completion through a queue.
+    """
+
+    # The maximum number of the finished jobs to keep the status of
+    MAX_FINISHED_JOBS = 100
+
+    def __init__(self, run_job: Callable[[Job], Dict]) -> None:
+        """
+        :param run_job: the function that runs a job and returns the response of its TRAIN command
+        """
+        self._run_job = run_job
+        self._running_job: Optional[Job] = None
+        # Heap of (priority, arrival, job) of the queued jobs
+        self._queue: List[Tuple[int, int, Job]] = []
+        self._arrivals = itertools.count()
+        # All the known jobs in the order of their submission
+        self._jobs: Dict[str, Job] = {}
+        self._finished_jobs = queue.Queue()
+
+    def submit(self, job_id: str, send_id: int, model_type: ModelType, data: Dict, priority: int) -> Optional[Job]:
+        """
+        Queue a training job, and start it if possible
+        :return: the job, or None if a job with the same id is already queued or running
+        """
+        previous_job = self._jobs.get(job_id)
+        if previous_job is not None and previous_job.state in (JobState.QUEUED, JobState.RUNNING):
+            return None
+
+        job = Job(job_id, send_id, model_type, data, priority)
+        self._jobs.pop(job_id, None)
+        self._jobs[job_id] = job
+        heapq.heappush(self._queue, (priority, next(self._arrivals), job))
+        self._dispatch()
+        return job
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Cancel a job. A queued job is cancelled right away, while a running job stops at its next progress report
+        :return: the job, or None if there is no queued or running job with the id
+        """
+        job = self._jobs.get(job_id)
+        if job is None or job.state not in (JobState.QUEUED, JobState.RUNNING):
+            return None
+        job.cancel()
+        if job.state == JobState.QUEUED:
+            job.state = JobState.CANCELLED
+        return job
+
+    def cancel_all(self) -> None:
+        for job_id in list(self._jobs):
+            self.cancel(job_id)
+
+    def get_status(self, job_id: Optional[str] = None) -> Optional[Dict]:
+        """
+        Get the status of a job, or of all the known jobs
+        :return: {job_id: status}, or None if the job is unknown
+        """
+        if job_id is None:
+            return {job.job_id: job.get_status() for job in self._jobs.values()}
+        job = self._jobs.get(job_id)
+        return None if job is None else {job_id: job.get_status()}
+
+    def has_running_jobs(self) -> bool:
+        return self._running_job is not None
+
+    def collect_finished_jobs(self) -> List[Job]:
+        """
+        Collect the jobs whose threads are done, and start the next queued job
+        :return: the finished jobs (with their responses)
+        """
+        jobs = []
+        while True:
+            try:
+                job = self._finished_jobs.get_nowait()
+            except queue.Empty:
+                break
+            self._running_job = None
+            if job.response is not None and job.response["success"]:
+                job.state = JobState.SUCCEEDED
+            else:
+                job.state = JobState.CANCELLED if job.is_cancelled() else JobState.FAILED
+            jobs.append(job)
+
+        if len(jobs) > 0:
+            self._dispatch()
+            self._forget_finished_jobs()
+        return jobs
+
+    def _dispatch(self) -> None:
+        # Start the queued job with the highest priority if no job is running (the cancelled jobs are skipped)
+        while self._running_job is None and len(self._queue) > 0:
+            job = heapq.heappop(self._queue)[2]
+            if job.state != JobState.QUEUED:
+                continue
+            self._running_job = job
+            job.state = JobState.RUNNING
+            logging.info(f"Starting job {job.job_id} ({job.model_type.name})")
+            threading.Thread(target=self._run, args=(job,), daemon=True).start()
+
+    def _run(self, job: Job) -> None:
+        # The routine of a job thread
+        try:
+            job.response = self._run_job(job)
+        finally:
+            self._finished_jobs.put(job)
+
+    def _forget_finished_jobs(self) -> None:
+        # Only keep the status of the latest finished jobs
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job.state in (JobState.SUCCEEDED, JobState.FAILED, JobState.CANCELLED)]
+        for job_id in finished[:max(len(finished) - JobScheduler.MAX_FINISHED_JOBS, 0)]:
+            del self._jobs[job_id]
+
+
 class AbstractModel(ABC):
     """
     Interface for all the models
@@ -134,11 +389,12 @@ class AbstractModel(ABC):
         self.model_cache = dict()
 
     @abstractmethod
-    def train(self, data: Dict) -> Tuple[bool, str]:
+    def train(self, data: Dict, job: Optional[Job] = None) -> Tuple[bool, str]:
         """
         Perform fitting.
         Should be overloaded by a specific model implementation.
         :param data: data used for training
+        :param job: the job that runs the training to report the progress to (None if not run as a job)
         :return: if training succeeds, {True and empty string}, else {False, error message}
         """
         raise NotImplementedError("Should be implemented by child classes")
@@ -148,7 +404,7 @@ class AbstractModel(ABC):
         """
         Do inference on the model, give the data file, and the model_map_path
         :param data: data used for inference
-        :return: {List of predictions, if inference succeeds, error message}
+        :return: {Predictions (a numpy array or JSON-serializable), if inference succeeds, error message}
         """
         raise NotImplementedError("Should be implemented by child classes")
 
@@ -165,17 +421,26 @@ class AbstractModel(ABC):
         if not save_path.exists():
             return None
 
-        # use the path string as the key of the cache
+        # use the path string as the key of the cache, and reload the model if the file has been rewritten (e.g., by
+        # a new training)
         save_path_str = str(save_path)
+        mtime = save_path.stat().st_mtime_ns
 
         # Load from cache
-        if self.model_cache.get(save_path, None) is not None:
-            return self.model_cache[save_path_str]
+        cached = self.model_cache.get(save_path_str, None)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
 
-        # Load into cache
+        # Load into cache. Unpickling imports the libraries that the model is built with
+        loaded_packages = {name.split('.')[0] for name in sys.modules}
+        start = time.perf_counter()
         model = self._load_model_from_disk(save_path)
+        IMPORT_TIMES[save_path_str] = time.perf_counter() - start
+        logging.info(f"Loaded {save_path_str} in {IMPORT_TIMES[save_path_str]:.3f}s")
+        new_packages = {name.split('.')[0] for name in sys.modules} - loaded_packages
+        logging.debug(f"Packages imported by loading {save_path_str}: {sorted(new_packages)}")
 
-        self.model_cache[save_path_str] = model
+        self.model_cache[save_path_str] = (mtime, model)
         return model
 
     @abstractmethod
@@ -202,19 +467,32 @@ class OUModel(AbstractModel):
     def __init__(self) -> None:
         AbstractModel.__init__(self)
 
-    def train(self, data: Dict) -> Tuple[bool, str]:
+    def train(self, data: Dict, job: Optional[Job] = None) -> Tuple[bool, str]:
         """
         Train a model with the given model name and seq_files directory
         :param data: {
             methods: [lr, XXX, ...],
             input_path: PATH_TO_SEQ_FILES_FOLDER, or None
             save_path: PATH_TO_SAVE_MODEL_MAP
+            incremental: (optional) only retrain the opunits whose data changed since the model map at save_path
+                         was trained
+            resume: (optional, True by default) resume an unfinished training of the model map at save_path from
+                    its last trained opunit
+            reduction_budget: (optional) train the models of each opunit with at most this many rows (the identical
+                              feature rows merged and the rest sampled across the feature space)
+            latency_budget: (optional) the maximum prediction time per row (in microseconds) of the selected models
+                            (the slower models are compressed if possible)
         }
+        :param job: the job that runs the training to report the opunit that is being trained to
         :return: if training succeeds, {True and empty string}, else {False, error message}
         """
         ml_models = data["methods"]
         seq_files_dir = data["input_path"]
         save_path = data["save_path"]
+        incremental = data.get("incremental", False)
+        resume = data.get("resume", True)
+        reduction_budget = data.get("reduction_budget")
+        latency_budget = data.get("latency_budget")
 
         # Do path checking up-front
         save_path = Path(save_path)
@@ -236,14 +514,47 @@ class OUModel(AbstractModel):
         expose_all = OUModel.EXPOSE_ALL
         txn_sample_rate = OUModel.TXN_SAMPLE_RATE
 
-        trainer = OUModelTrainer(seq_files_dir, result_path, ml_models,
-                                 test_ratio, trim, expose_all, txn_sample_rate)
+        ou_model_trainer = _lazy_import('modeling.ou_model_trainer')
+        training_state_file = Path(ou_model_trainer.get_training_state_file(save_path))
+        checkpoint_file = Path(ou_model_trainer.get_checkpoint_file(save_path))
+        previous_model_map = None
+        previous_info = None
+        previous_training_state = None
+        if resume:
+            previous_model_map, previous_info, previous_training_state = ou_model_trainer.load_checkpoint(
+                str(checkpoint_file))
+        if previous_model_map is None and incremental and training_state_file.exists() and save_path.exists():
+            # The reused models are updated in place, so train on a private copy rather than on the cached models that
+            # are being served (which a failed or cancelled training would leave half-updated)
+            previous_model_map = self._load_model_from_disk(save_path)
+            with training_state_file.open(mode='rb') as f:
+                previous_training_state = pickle.load(f)
+            # The files of the reused opunits are not parsed again, so the training starts from their data info
+            previous_info = data_info.get_model_map_info(previous_model_map)
+
+        # The trainer parses the data into its own data info, so the concurrent inference is not affected
+        trainer = ou_model_trainer.OUModelTrainer(seq_files_dir, result_path, ml_models,
+                                                  test_ratio, trim, expose_all, txn_sample_rate,
+                                                  reduction_budget=reduction_budget, latency_budget=latency_budget,
+                                                  info=previous_info)
+
+        def report_progress():
+            if job is not None:
+                opunit = trainer.current_opunit
+                job.report_progress(opunit=None if opunit is None else opunit.name,
+                                    trained_opunits=trainer.trained_opunit_num)
+
         # Perform training from OUModelTrainer and input files directory
-        model_map = trainer.train()
+        model_map = trainer.train(previous_model_map, previous_training_state, str(checkpoint_file),
+                                  report_progress)
 
-        # Pickle dump the model
+        # Pickle dump the model and the state for the next incremental training
         with save_path.open(mode='wb') as f:
-            pickle.dump((model_map, data_info.instance), f)
+            pickle.dump((model_map, data_info.get_model_map_info(model_map)), f)
+        with training_state_file.open(mode='wb') as f:
+            pickle.dump(trainer.get_training_state(), f)
+        if checkpoint_file.exists():
+            checkpoint_file.unlink()
 
         return True, ""
 
@@ -251,11 +562,11 @@ class OUModel(AbstractModel):
         """
         Do inference on the model, give the data file, and the model_map_path
         :param data: {
-            features: 2D float arrays [[float]],
+            features: 2D float arrays [[float]] (or a 2D numpy array),
             opunit: Opunit integer for the model
             model_path: model path
         }
-        :return: {List of predictions, if inference succeeds, error message}
+        :return: {Array of predictions, if inference succeeds, error message}
         """
         features = data["features"]
         opunit = data["opunit"]
@@ -277,7 +588,7 @@ class OUModel(AbstractModel):
             logging.error(f"{opunit} is not a valid Opunit name")
             return [], False, "INVALID_OPUNIT"
 
-        features = np.array(features)
+        features = np.asarray(features)
         logging.debug(f"Using model on {opunit}")
 
         model = model_map[opunit]
@@ -286,17 +597,73 @@ class OUModel(AbstractModel):
             return [], False, "MODEL_NOT_FOUND"
 
         y_pred = model.predict(features)
+        return y_pred, True, ""
+
+    def infer_pipelines(self, data: Dict) -> Tuple[Any, bool, str]:
+        """
+        Do inference on whole pipelines and aggregate the OU predictions of each pipeline
+        All the OUs of the same opunit (across the pipelines) are predicted with one model call, and the predictions
+        are adjusted (clipped, and the memory of MEM_ADJUST_OPUNITS corrected by their buffer size) like in the
+        offline interference model training
+        :param data: {
+            pipelines: [[[opunit, [float]], ...], ...] list of the (Opunit name, features) of the OUs of each pipeline
+            model_path: model path
+        }
+        :return: {List of the summed predictions of each pipeline, if inference succeeds, error message}
+        """
+        pipelines = data["pipelines"]
+        model_path = data["model_path"]
+
+        # Load the model map
+        model_map = self._load_model(model_path)
+        if model_map is None:
+            logging.error(
+                f"Model map at {str(model_path)} has not been trained")
+            return [], False, "MODEL_MAP_NOT_TRAINED"
+
+        # Group the OU features by opunit in the layout of ou_prediction_util.predict_grouped_opunits
+        opunit_offsets = np.zeros(len(pipelines) + 1, dtype=np.int64)
+        opunits = []
+        feature_rows = []
+        opunit_features = {}
+        for i, pipeline in enumerate(pipelines):
+            for opunit, features in pipeline:
+                if not isinstance(opunit, str) or opunit not in OpUnit.__members__:
+                    logging.error(f"{opunit} is not a valid Opunit name")
+                    return [], False, "INVALID_OPUNIT"
+                opunit = OpUnit[opunit]
+                if model_map.get(opunit) is None:
+                    logging.error(f"Model for {opunit} doesn't exist")
+                    return [], False, "MODEL_NOT_FOUND"
+                rows = opunit_features.setdefault(opunit.value, [])
+                opunits.append(opunit.value)
+                feature_rows.append(len(rows))
+                rows.append(features)
+            opunit_offsets[i + 1] = len(opunits)
+
+        try:
+            opunit_x = {opunit_id: np.array(rows, dtype=np.float64) for opunit_id, rows in opunit_features.items()}
+        except ValueError as e:
+            logging.error(f"Invalid OU features: {e}")
+            return [], False, "INVALID_FEATURES"
+        logging.debug(f"Predicting {len(opunits)} OUs of {len(pipelines)} pipelines")
+
+        ou_prediction_util = _lazy_import('modeling.training_util.ou_prediction_util')
+        y_pred = ou_prediction_util.predict_grouped_opunits(model_map, opunit_offsets,
+                                                            np.array(opunits, dtype=np.int64),
+                                                            np.array(feature_rows, dtype=np.int64), opunit_x)
         return y_pred.tolist(), True, ""
 
     def _load_model_from_disk(self, save_path: Path) -> Dict:
         """
         Load model from the path on disk (invoked when missing model cache)
         :param save_path: model path on disk
-        :return: OU model map
+        :return: OU model map (each model with the data info of the model map)
         """
         with save_path.open(mode='rb') as f:
-            model, data_info.instance = pickle.load(f)
-        return model
+            model_map, info = pickle.load(f)
+        data_info.set_model_map_info(model_map, info)
+        return model_map
 
 
 class InterferenceModel(AbstractModel):
@@ -317,7 +684,7 @@ class InterferenceModel(AbstractModel):
     def __init__(self) -> None:
         AbstractModel.__init__(self)
 
-    def train(self, data: Dict) -> Tuple[bool, str]:
+    def train(self, data: Dict, job: Optional[Job] = None) -> Tuple[bool, str]:
         """
         Train a model with the given model name and seq_files directory
         :param data: {
@@ -325,6 +692,7 @@ class InterferenceModel(AbstractModel):
             input_path: PATH_TO_SEQ_FILES_FOLDER, or None
             save_path: PATH_TO_SAVE_MODEL_MAP
         }
+        :param job: the job that runs the training to report the stage of the training to
         :return: if training succeeds, {True and empty string}, else {False, error message}
         """
         ml_models = data["methods"]
@@ -358,13 +726,23 @@ class InterferenceModel(AbstractModel):
         network_sample_rate = InterferenceModel.NETWORK_SAMPLE_RATE
 
         with open(ou_model_path, 'rb') as pickle_file:
-            model_map, data_info.instance = pickle.load(pickle_file)
-        trainer = InterferenceModelTrainer(input_path, result_path, ml_models, test_ratio, impact_model_ratio,
-                                           model_map, warmup_period, use_query_predict_cache, add_noise,
-                                           predict_ou_only, ee_sample_rate, txn_sample_rate, network_sample_rate)
+            model_map, info = pickle.load(pickle_file)
+        # The OU models predict with their own data info, and the interference training locates the data with it
+        data_info.set_model_map_info(model_map, info)
+        interference_model_trainer = _lazy_import('modeling.interference_model_trainer')
+        if job is not None:
+            job.report_progress(stage="predicting the OU data")
+        trainer = interference_model_trainer.InterferenceModelTrainer(input_path, result_path, ml_models, test_ratio,
+                                                                      impact_model_ratio, model_map, warmup_period,
+                                                                      use_query_predict_cache, add_noise,
+                                                                      predict_ou_only, ee_sample_rate,
+                                                                      txn_sample_rate, network_sample_rate,
+                                                                      ou_model_file=ou_model_path)
 
         # Perform training
         trainer.predict_ou_data()
+        if job is not None:
+            job.report_progress(stage="training")
         # We only need the directly model for the model server. The other models are for experimental purposes
         _, _, direct_model = trainer.train()
 
@@ -378,10 +756,10 @@ class InterferenceModel(AbstractModel):
         """
         Do inference on the model, give the data file, and the model_path
         :param data: {
-            features: 2D float arrays [[float]],
+            features: 2D float arrays [[float]] (or a 2D numpy array),
             model_path: model path
         }
-        :return: {List of predictions, if inference succeeds, error message}
+        :return: {Array of predictions, if inference succeeds, error message}
         """
         features = data["features"]
         model_path = data["model_path"]
@@ -393,10 +771,10 @@ class InterferenceModel(AbstractModel):
                 f"Model map at {str(model_path)} has not been trained")
             return [], False, "MODEL_MAP_NOT_TRAINED"
 
-        features = np.array(features)
+        features = np.asarray(features)
 
         y_pred = model.predict(features)
-        return y_pred.tolist(), True, ""
+        return y_pred, True, ""
 
     def _load_model_from_disk(self, save_path: Path):
         """
@@ -432,7 +810,7 @@ class ForecastModel(AbstractModel):
         # Number of data points for testing set
         self.EVAL_DATA_SIZE = self.SEQ_LEN + 2 * self.HORIZON_LEN
 
-    def train(self, data: Dict) -> Tuple[bool, str]:
+    def train(self, data: Dict, job: Optional[Job] = None) -> Tuple[bool, str]:
         """
         Train a model with the given model name and seq_files directory
         :param data: {
@@ -442,6 +820,7 @@ class ForecastModel(AbstractModel):
             save_path: PATH_TO_SAVE_MODEL_MAP
             interval_micro_sec: Interval duration for aggregation in microseconds
         }
+        :param job: the job that runs the training to report the stage of the training to
         :return: if training succeeds, {True and empty string}, else {False, error message}
         """
         input_path = data["input_path"]
@@ -451,8 +830,11 @@ class ForecastModel(AbstractModel):
         interval = data["interval_micro_sec"]
         self._update_parameters(interval)
 
+        # torch is only imported when a forecast command arrives
+        forecaster_module = _lazy_import('forecasting.forecaster')
+
         # Parse models arguments
-        models_kwargs = parse_model_config(model_names, models_config)
+        models_kwargs = forecaster_module.parse_model_config(model_names, models_config)
 
         # Do path checking up-front
         save_path = Path(save_path)
@@ -463,7 +845,7 @@ class ForecastModel(AbstractModel):
         except PermissionError as e:
             return False, "FAIL_PERMISSION_ERROR"
 
-        forecaster = Forecaster(
+        forecaster = forecaster_module.Forecaster(
             trace_file=input_path,
             interval_us=interval,
             test_mode=False,
@@ -471,6 +853,8 @@ class ForecastModel(AbstractModel):
             eval_size=self.EVAL_DATA_SIZE,
             horizon_len=self.HORIZON_LEN)
 
+        if job is not None:
+            job.report_progress(stage="training")
         models = forecaster.train(models_kwargs)
 
         # Pickle dump the model
@@ -498,6 +882,8 @@ class ForecastModel(AbstractModel):
         model_path = data["model_path"]
         self._update_parameters(interval)
 
+        forecaster_module = _lazy_import('forecasting.forecaster')
+
         # Load the trained models
         models = self._load_model(model_path)
         if models is None:
@@ -505,7 +891,7 @@ class ForecastModel(AbstractModel):
                 f"Models at {str(model_path)} has not been trained")
             return [], False, "MODELS_NOT_TRAINED"
 
-        forecaster = Forecaster(
+        forecaster = forecaster_module.Forecaster(
             trace_file=input_path,
             test_mode=True,
             interval_us=interval,
@@ -535,25 +921,70 @@ class ForecastModel(AbstractModel):
         return model
 
 
+class MessageRecorder:
+    """
+    Recorder of the received messages to replay them with model_server_benchmark.py
+    Each line of the record file is a JSON object {time: the receive time (seconds since the epoch), payload: the
+    message}. The file is appended to, so the messages of a restarted ModelServer are added to the same recording
+    """
+
+    def __init__(self, record_file: str) -> None:
+        """
+        :param record_file: the file to append the messages to
+        """
+        self.file = open(record_file, 'a', buffering=1)
+        atexit.register(self.file.close)
+        logging.info(f"Recording the received messages to {record_file}")
+
+    def record(self, payload: str) -> None:
+        self.file.write(json.dumps({"time": time.time(), "payload": payload}) + "\n")
+
+
 class ModelServer:
     """
     ModelServer(MS) class that runs in a loop to handle commands from the ModelServerManager from C++
     """
 
-    def __init__(self, end_point: str):
+    # INFER request coalescing parameters
+    BATCH_DEADLINE_MS = 2
+    MAX_BATCH_SIZE = 64
+
+    # The model types whose INFER requests are 2D feature arrays that can be concatenated
+    BATCHABLE_MODEL_TYPES = {ModelType.OPERATING_UNIT, ModelType.INTERFERENCE}
+
+    # How often (in milliseconds) the loop checks for the finished training jobs while waiting for messages
+    JOB_POLL_INTERVAL_MS = 100
+
+    def __init__(self, end_point: str, batch_deadline_ms: float = BATCH_DEADLINE_MS,
+                 max_batch_size: int = MAX_BATCH_SIZE, identity: str = 'model', record_file: Optional[str] = None):
         """
         Initialize the ModelServer by connecting to the ZMQ IPC endpoint
         :param end_point:  IPC endpoint
+        :param batch_deadline_ms: how long an INFER request waits for other requests on the same model to be
+                                  predicted together (0 to predict every request on its own)
+        :param max_batch_size: the maximum number of INFER requests predicted together
+        :param identity: the ZMQ identity of the socket ("model" for the ModelServerManager, or the worker name for
+                         a ModelServerBroker)
+        :param record_file: the file to record the received messages to (None to not record them)
         """
+        self.batch_deadline_ms = batch_deadline_ms
+        self.max_batch_size = max_batch_size
+
+        # The parsed messages that were received while coalescing INFER requests but are not part of the batch
+        self._pending = collections.deque()
+
         # Establish ZMQ connection
         self.context = zmq.Context()
         self.socket = self.context.socket(zmq.DEALER)
-        self.socket.set_string(zmq.IDENTITY, 'model')
+        self.socket.set_string(zmq.IDENTITY, identity)
         logging.debug(
             f"Python model trying to connect to manager at {end_point}")
         self.socket.connect(f"ipc://{end_point}")
         logging.info(f"Python model connected at {end_point}")
 
+        # Recorder of the received messages
+        self.recorder = None if record_file is None else MessageRecorder(record_file)
+
         # If the ModelServer is closing
         self._closing = False
 
@@ -566,12 +997,16 @@ class ModelServer:
         # Notify the ModelServerManager that I am connected
         self._send_msg(0, 0, ModelServer._make_response(
             Callback.CONNECTED, "", True, ""))
+        logging.info(f"Python model server started in {time.perf_counter() - _START_TIME:.3f}s")
 
         # Model trainers/inferers
         self.model_managers = {ModelType.FORECAST: ForecastModel(),
                                ModelType.OPERATING_UNIT: OUModel(),
                                ModelType.INTERFERENCE: InterferenceModel()}
 
+        # Training jobs that run in the background
+        self.scheduler = JobScheduler(lambda job: self._train(job.data, job))
+
     def cleanup_zmq(self):
         """
         Close the socket when the script exits
@@ -626,19 +1061,222 @@ class ModelServer:
         msg = Message.from_json(tokens[2])
         return msg_id, recv_id, msg
 
-    def _infer(self, data: Dict) -> Tuple[List, bool, str]:
+    def _infer(self, data: Dict) -> Tuple[Any, bool, str]:
         """
         Do inference on the model
         :param data: {
             type: model type
             model_path: model path
+            features_shm: (optional) the descriptor of the features in shared memory
             ...
         }
-        :return: {List of predictions, if inference succeeds, error message}
+        :return: {Predictions, if inference succeeds, error message}
         """
         model_type = data["type"]
+        if "features_shm" in data:
+            try:
+                data = dict(data, features=ModelServer._get_features(data))
+            except (KeyError, TypeError, ValueError, OSError) as e:
+                logging.error(f"Failed to map the features in shared memory: {e}")
+                return [], False, "INVALID_SHARED_MEMORY"
         return self.model_managers[ModelType[model_type]].infer(data)
 
+    @staticmethod
+    def _get_features(data: Dict) -> np.ndarray:
+        """
+        Get the features of an INFER request
+        :param data: the INFER request with either "features" or "features_shm"
+        :return: the 2D feature array (backed by the shared memory for "features_shm")
+        """
+        if "features_shm" in data:
+            return shared_memory_util.get_array(data["features_shm"])
+        return np.asarray(data["features"])
+
+    @staticmethod
+    def _make_infer_response(data: Dict, result: Any, success: bool, err: str = "") -> Dict:
+        """
+        Construct the response to an INFER request
+        The predictions are written into the "result_shm" slot of the request if it has one (and they fit), and only
+        their shape is sent back. Otherwise they are sent back as JSON
+        :param data: the INFER request
+        :param result: the predictions
+        :param success: True if the inference succeeds
+        :param err: Error message
+        :return: the response
+        """
+        if success and isinstance(result, np.ndarray):
+            slot = data.get("result_shm") if isinstance(data, dict) else None
+            if slot is not None:
+                try:
+                    descriptor = shared_memory_util.write_array(slot, result)
+                except (KeyError, TypeError, ValueError, OSError) as e:
+                    logging.error(f"Failed to write the predictions into shared memory: {e}")
+                    return ModelServer._make_response(Callback.NOOP, [], False, "INVALID_SHARED_MEMORY")
+                if descriptor is not None:
+                    return ModelServer._make_response(Callback.NOOP, descriptor, True)
+            result = result.tolist()
+        return ModelServer._make_response(Callback.NOOP, result, success, err)
+
+    @staticmethod
+    def _get_batch_key(msg: Message) -> Optional[Tuple]:
+        """
+        Get the key of the INFER requests that can be predicted together
+        :param msg: the message
+        :return: (model type, model path, opunit), or None if the message cannot be coalesced
+        """
+        if msg.cmd != Command.INFER or not isinstance(msg.data, dict):
+            return None
+        try:
+            model_type = ModelType[msg.data["type"]]
+            if model_type not in ModelServer.BATCHABLE_MODEL_TYPES:
+                return None
+            if "features_shm" not in msg.data and not isinstance(msg.data["features"], list):
+                return None
+            return model_type, msg.data["model_path"], msg.data.get("opunit")
+        except (KeyError, TypeError):
+            return None
+
+    def _collect_batch(self, send_id: int, msg: Message) -> List[Tuple[int, Message]]:
+        """
+        Collect the INFER requests with the same batch key as msg until the deadline or the batch size is reached
+        The requests that are already received are taken first, and the other messages received meanwhile are kept
+        to be executed afterwards in order
+        :param send_id: the sender id of msg
+        :param msg: the first INFER request of the batch
+        :return: the list of (send_id, message) in the batch
+        """
+        key = self._get_batch_key(msg)
+        batch = [(send_id, msg)]
+        if key is None or self.batch_deadline_ms <= 0 or self.max_batch_size <= 1:
+            return batch
+
+        remaining = collections.deque()
+        while len(self._pending) > 0:
+            pending = self._pending.popleft()
+            if len(batch) < self.max_batch_size and self._get_batch_key(pending[1]) == key:
+                batch.append(pending)
+            else:
+                remaining.append(pending)
+        self._pending = remaining
+
+        deadline = time.perf_counter() + self.batch_deadline_ms / 1000
+        while len(batch) < self.max_batch_size:
+            timeout_ms = (deadline - time.perf_counter()) * 1000
+            if timeout_ms <= 0 or not self.socket.poll(max(int(timeout_ms), 1)):
+                break
+            try:
+                payload = self._recv()
+            except UnicodeError as e:
+                logging.warning(f"Failed to decode : {e.reason}")
+                continue
+            received = self._parse_msg(payload)
+            if received[2] is None:
+                continue
+            if self._get_batch_key(received[2]) == key:
+                batch.append((received[0], received[2]))
+            else:
+                self._pending.append((received[0], received[2]))
+        return batch
+
+    def _infer_batch(self, batch: List[Tuple[int, Message]]) -> List[Dict]:
+        """
+        Predict the INFER requests of a batch with one inference on the concatenated features
+        The results are split back per request. If the combined inference fails (e.g., one request has invalid
+        features), every request is executed on its own so that it gets its own result or error
+        :param batch: the list of (send_id, message) with the same batch key
+        :return: the response of each request
+        """
+        if len(batch) > 1:
+            try:
+                features = [self._get_features(msg.data) for _, msg in batch]
+                row_nums = [len(f) for f in features]
+                data = {key: value for key, value in batch[0][1].data.items() if key != "features_shm"}
+                data["features"] = np.concatenate(features)
+                result, ok, err = self._infer(data)
+            except Exception as e:
+                logging.debug(f"Failed to infer a batch of {len(batch)} requests: {e}")
+                ok = False
+            if ok and len(result) == sum(row_nums):
+                logging.debug(f"Inferred a batch of {len(batch)} requests with {len(result)} rows")
+                offsets = np.cumsum([0] + row_nums)
+                return [self._make_infer_response(msg.data, result[offsets[i]:offsets[i + 1]], True)
+                        for i, (_, msg) in enumerate(batch)]
+
+        return [self._execute_cmd(msg.cmd, msg.data)[0] for _, msg in batch]
+
+    def _train(self, data: Dict, job: Optional[Job] = None) -> Dict:
+        """
+        Train a model
+        :param data: {
+            type: model type
+            ...
+        }
+        :param job: the job that runs the training (None if not run as a job)
+        :return: the response to the TRAIN command
+        """
+        try:
+            model_type = data["type"]
+            ok, res = self.model_managers[ModelType[model_type]].train(data, job)
+            if ok:
+                response = self._make_response(Callback.NOOP, res, True)
+            else:
+                response = self._make_response(Callback.NOOP, "", False, res)
+        except JobCancelled as e:
+            logging.info(f"Training stopped. {e}")
+            response = self._make_response(
+                Callback.NOOP, "", False, "JOB_CANCELLED")
+        except ValueError as e:
+            logging.error(f"Model Not found : {e}")
+            response = self._make_response(
+                Callback.NOOP, "", False, "FAIL_MODEL_NOT_FOUND")
+        except KeyError as e:
+            logging.error(f"Data format wrong for TRAIN: {e}")
+            response = self._make_response(
+                Callback.NOOP, "", False, "FAIL_DATA_FORMAT_ERROR")
+        except Exception as e:
+            logging.error(f"Training failed. {e}")
+            response = self._make_response(
+                Callback.NOOP, "", False, "FAIL_TRAINING_FAILED")
+
+        return response
+
+    def _submit_train_job(self, send_id: int, data: Dict) -> None:
+        """
+        Queue a TRAIN command as a background job. The command is answered when the job is done
+        :param send_id: the callback id of the TRAIN command
+        :param data: {
+            type: model type
+            save_path: path to save the model at
+            job_id: (optional) the id of the job, the save_path by default
+            priority: (optional) the priority of the job among the training jobs (a lower value starts first, 0 by
+                      default)
+            ...
+        }
+        """
+        try:
+            model_type = ModelType[data["type"]]
+            job_id = str(data.get("job_id", data["save_path"]))
+            priority = int(data.get("priority", 0))
+        except (KeyError, TypeError, ValueError) as e:
+            logging.error(f"Data format wrong for TRAIN: {e}")
+            self._send_msg(0, send_id, self._make_response(Callback.NOOP, "", False, "FAIL_DATA_FORMAT_ERROR"))
+            return
+
+        if self.scheduler.submit(job_id, send_id, model_type, data, priority) is None:
+            logging.error(f"Job {job_id} is already queued or running")
+            self._send_msg(0, send_id, self._make_response(Callback.NOOP, "", False, "JOB_ALREADY_EXISTS"))
+
+    def _send_finished_jobs(self) -> None:
+        """
+        Answer the TRAIN commands of the finished jobs
+        """
+        for job in self.scheduler.collect_finished_jobs():
+            logging.info(f"Job {job.job_id} finished: {job.state.name}")
+            response = job.response
+            if response is None:
+                response = self._make_response(Callback.NOOP, "", False, "FAIL_TRAINING_FAILED")
+            self._send_msg(0, job.send_id, response)
+
     def _recv(self) -> str:
         """
         Receive from the ZMQ socket. This is a blocking call.
@@ -650,7 +1288,10 @@ class ModelServer:
         payload = self.socket.recv()
         logging.debug(f"Python recv: {str(identity)}, {str(payload)}")
 
-        return payload.decode("ascii")
+        payload = payload.decode("ascii")
+        if self.recorder is not None:
+            self.recorder.record(payload)
+        return payload
 
     def _execute_cmd(self, cmd: Command, data: Dict) -> Tuple[Dict, bool]:
         """
@@ -668,32 +1309,37 @@ class ModelServer:
             response = self._make_response(Callback.NOOP, f"MODEL_REPLY_{msg}", True)
             return response, True
         elif cmd == Command.QUIT:
+            # The OU trainings resume from their checkpoints when they are submitted again
+            self.scheduler.cancel_all()
             # Will not send any message so empty {} is ok
             return self._make_response(Callback.NOOP, "", True), False
+        elif cmd == Command.CANCEL:
+            job_id = data.get("job_id") if isinstance(data, dict) else None
+            job = self.scheduler.cancel(str(job_id))
+            if job is None:
+                return self._make_response(Callback.NOOP, "", False, "JOB_NOT_FOUND"), True
+            logging.info(f"Cancelled job {job.job_id}")
+            if job.state == JobState.CANCELLED:
+                # The queued job will not run, so its TRAIN command is answered now
+                self._send_msg(0, job.send_id, self._make_response(Callback.NOOP, "", False, "JOB_CANCELLED"))
+            return self._make_response(Callback.NOOP, job.state.name, True), True
+        elif cmd == Command.STATUS:
+            job_id = data.get("job_id") if isinstance(data, dict) else None
+            status = self.scheduler.get_status(None if job_id is None else str(job_id))
+            if status is None:
+                return self._make_response(Callback.NOOP, {}, False, "JOB_NOT_FOUND"), True
+            return self._make_response(Callback.NOOP, status, True), True
         elif cmd == Command.TRAIN:
-            try:
-                model_type = data["type"]
-                ok, res = self.model_managers[ModelType[model_type]].train(data)
-                if ok:
-                    response = self._make_response(Callback.NOOP, res, True)
-                else:
-                    response = self._make_response(Callback.NOOP, "", False, res)
-            except ValueError as e:
-                logging.error(f"Model Not found : {e}")
-                response = self._make_response(
-                    Callback.NOOP, "", False, "FAIL_MODEL_NOT_FOUND")
-            except KeyError as e:
-                logging.error(f"Data format wrong for TRAIN: {e}")
-                response = self._make_response(
-                    Callback.NOOP, "", False, "FAIL_DATA_FORMAT_ERROR")
-            except Exception as e:
-                logging.error(f"Training failed. {e}")
-                response = self._make_response(
-                    Callback.NOOP, "", False, "FAIL_TRAINING_FAILED")
-
-            return response, True
+            return self._train(data), True
         elif cmd == Command.INFER:
             result, ok, err = self._infer(data)
+            return self._make_infer_response(data, result, ok, err), True
+        elif cmd == Command.PIPELINE_INFER:
+            try:
+                result, ok, err = self.model_managers[ModelType.OPERATING_UNIT].infer_pipelines(data)
+            except (KeyError, TypeError, ValueError) as e:
+                logging.error(f"Data format wrong for PIPELINE_INFER: {e}")
+                result, ok, err = [], False, "FAIL_DATA_FORMAT_ERROR"
             response = self._make_response(Callback.NOOP, result, ok, err)
             return response, True
 
@@ -704,23 +1350,38 @@ class ModelServer:
         """
 
         while (1):
-            try:
-                payload = self._recv()
-            except UnicodeError as e:
-                logging.warning(f"Failed to decode : {e.reason}")
-                continue
-            except KeyboardInterrupt:
-                if self._closing:
-                    logging.warning("Forced shutting down now.")
-                    os._exit(-1)
-                else:
-                    logging.info("Received KeyboardInterrupt. Ctrl+C again to force shutting down.")
-                    self._closing = True
+            self._send_finished_jobs()
+            if len(self._pending) > 0:
+                send_id, msg = self._pending.popleft()
+            else:
+                try:
+                    # Wake up periodically to answer the finished training jobs
+                    if self.scheduler.has_running_jobs() and not self.socket.poll(ModelServer.JOB_POLL_INTERVAL_MS):
+                        continue
+                    payload = self._recv()
+                except UnicodeError as e:
+                    logging.warning(f"Failed to decode : {e.reason}")
                     continue
-
-            send_id, recv_id, msg = self._parse_msg(payload)
+                except KeyboardInterrupt:
+                    if self._closing:
+                        logging.warning("Forced shutting down now.")
+                        os._exit(-1)
+                    else:
+                        logging.info("Received KeyboardInterrupt. Ctrl+C again to force shutting down.")
+                        self._closing = True
+                        continue
+
+                send_id, recv_id, msg = self._parse_msg(payload)
             if msg is None:
                 continue
+            elif msg.cmd == Command.INFER:
+                # Coalesce the concurrent INFER requests on the same model
+                batch = self._collect_batch(send_id, msg)
+                for (batch_send_id, _), result in zip(batch, self._infer_batch(batch)):
+                    self._send_msg(0, batch_send_id, result)
+            elif msg.cmd == Command.TRAIN:
+                # The training runs in the background while the other commands are executed
+                self._submit_train_job(send_id, msg.data if isinstance(msg.data, dict) else {})
             else:
                 result, cont = self._execute_cmd(msg.cmd, msg.data)
                 if not cont:
@@ -732,9 +1393,294 @@ class ModelServer:
                 self._send_msg(0, send_id, result)
 
 
+class ModelServerBroker:
+    """
+    Broker that spreads the commands of the ModelServerManager over several ModelServer worker processes
+
+    The broker connects to the ModelServerManager in place of a ModelServer (as the "model" DEALER), and the workers
+    connect to its back-end ROUTER socket, each with its own model cache and interpreter. The commands on a model are
+    sent to the worker that the hash of the model path maps to, so that a model is only loaded (and its INFER requests
+    are only coalesced) by one worker, unless that worker has more than MAX_LOAD_IMBALANCE outstanding commands more
+    than the least loaded worker. The TRAIN jobs are remembered by job id so that CANCEL and STATUS reach the worker
+    that runs them.
+    """
+
+    # How many more outstanding commands the worker of a model may have than the least loaded worker
+    MAX_LOAD_IMBALANCE = 8
+
+    # How often (in milliseconds) the broker checks if the workers are alive
+    WORKER_CHECK_INTERVAL_MS = 1000
+
+    def __init__(self, end_point: str, worker_num: int, batch_deadline_ms: float = ModelServer.BATCH_DEADLINE_MS,
+                 max_batch_size: int = ModelServer.MAX_BATCH_SIZE, record_file: Optional[str] = None) -> None:
+        """
+        Start the workers and connect to the ModelServerManager
+        :param end_point: IPC endpoint of the ModelServerManager (the workers connect to "<end_point>-workers")
+        :param worker_num: the number of worker processes
+        :param batch_deadline_ms: the INFER coalescing deadline of each worker
+        :param max_batch_size: the maximum number of INFER requests predicted together by each worker
+        :param record_file: the file to record the received messages to (None to not record them)
+        """
+        self.worker_args = [str(batch_deadline_ms), str(max_batch_size)]
+        self.back_end_point = f"{end_point}-workers"
+
+        self.context = zmq.Context()
+        self.back_socket = self.context.socket(zmq.ROUTER)
+        self.back_socket.bind(f"ipc://{self.back_end_point}")
+
+        # The worker processes by name, and the names of the connected workers
+        self.processes: Dict[bytes, subprocess.Popen] = {}
+        self.ready_workers: List[bytes] = []
+        # The number of the commands sent to each worker that are not answered yet
+        self.loads: Dict[bytes, int] = {}
+        # The worker that each TRAIN job is sent to
+        self.job_workers: Dict[str, bytes] = {}
+        # The STATUS commands of all the jobs that are gathered from the workers, by callback id:
+        # [the workers that have not answered, the merged status]
+        self.status_requests: Dict[int, List] = {}
+        # The commands received while no worker is connected (e.g., while the only worker restarts)
+        self.waiting = collections.deque()
+        self.recorder = None if record_file is None else MessageRecorder(record_file)
+
+        for i in range(worker_num):
+            self._start_worker(f"worker-{i}".encode())
+
+        self.front_socket = self.context.socket(zmq.DEALER)
+        self.front_socket.set_string(zmq.IDENTITY, 'model')
+        self.front_socket.connect(f"ipc://{end_point}")
+        logging.info(f"Model server broker connected at {end_point} with {worker_num} workers")
+        self._connected = False
+
+        atexit.register(self.cleanup)
+
+    def _start_worker(self, name: bytes) -> None:
+        """
+        Start a worker process that connects to the back-end socket
+        :param name: the ZMQ identity of the worker
+        """
+        command = [sys.executable, os.path.abspath(__file__), self.back_end_point] + self.worker_args + [
+            "--worker", name.decode()]
+        self.processes[name] = subprocess.Popen(command)
+        self.loads[name] = 0
+
+    def cleanup(self) -> None:
+        """
+        Stop the workers and close the sockets when the script exits
+        """
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.processes = {}
+        self.front_socket.close()
+        self.back_socket.close()
+        self.context.destroy()
+
+    def _recv(self) -> List[bytes]:
+        """
+        Receive a message of the ModelServerManager
+        :return: the frames of the message (the last one is the message payload)
+        """
+        frames = self.front_socket.recv_multipart()
+        if self.recorder is not None:
+            self.recorder.record(frames[-1].decode("ascii"))
+        return frames
+
+    def _reply(self, send_id: int, response: Dict) -> None:
+        """
+        Answer a command of the ModelServerManager from the broker itself
+        :param send_id: the callback id of the command
+        :param response: the response
+        """
+        self.front_socket.send_multipart([b'', f"0-{send_id}-{json.dumps(response)}".encode('utf-8')])
+
+    def _send_to_worker(self, worker: bytes, frames: List[bytes]) -> None:
+        self.back_socket.send_multipart([worker] + frames)
+        self.loads[worker] += 1
+
+    def _pick_worker(self, key: Optional[str] = None) -> bytes:
+        """
+        Pick the worker to send a command to
+        :param key: the model path of the command (None for a command that is not on a model)
+        :return: the worker that the key hashes to if it is not overloaded, or the least loaded worker
+        """
+        least_loaded = min(self.ready_workers, key=lambda worker: self.loads[worker])
+        if key is None:
+            return least_loaded
+        worker = self.ready_workers[zlib.crc32(str(key).encode('utf-8')) % len(self.ready_workers)]
+        if self.loads[worker] - self.loads[least_loaded] > ModelServerBroker.MAX_LOAD_IMBALANCE:
+            return least_loaded
+        return worker
+
+    def _route(self, frames: List[bytes]) -> bool:
+        """
+        Send a command of the ModelServerManager to the workers
+        :param frames: the frames received from the ModelServerManager (the last one is the message payload)
+        :return: False if the command is QUIT
+        """
+        send_id, _, msg = ModelServer._parse_msg(frames[-1].decode("ascii"))
+        if msg is None:
+            return True
+        if msg.cmd == Command.QUIT:
+            for worker in self.ready_workers:
+                self._send_to_worker(worker, frames)
+            return False
+        if len(self.ready_workers) == 0:
+            self.waiting.append(frames)
+            return True
+
+        data = msg.data if isinstance(msg.data, dict) else {}
+        if msg.cmd == Command.TRAIN:
+            # A job that is still known to its worker is sent there again (e.g., to be rejected as a duplicate)
+            job_id = str(data.get("job_id", data.get("save_path")))
+            worker = self.job_workers.get(job_id)
+            if worker not in self.ready_workers:
+                worker = self._pick_worker()
+                self.job_workers[job_id] = worker
+        elif msg.cmd in (Command.CANCEL, Command.STATUS):
+            if msg.cmd == Command.STATUS and data.get("job_id") is None:
+                # Gather the status of the jobs of all the workers
+                self.status_requests[send_id] = [set(self.ready_workers), {}]
+                for worker in self.ready_workers:
+                    self._send_to_worker(worker, frames)
+                return True
+            worker = self.job_workers.get(str(data.get("job_id")))
+            if worker not in self.ready_workers:
+                result = "" if msg.cmd == Command.CANCEL else {}
+                self._reply(send_id, ModelServer._make_response(Callback.NOOP, result, False, "JOB_NOT_FOUND"))
+                return True
+        elif msg.cmd in (Command.INFER, Command.PIPELINE_INFER):
+            worker = self._pick_worker(data.get("model_path"))
+        else:
+            worker = self._pick_worker()
+        self._send_to_worker(worker, frames)
+        return True
+
+    def _handle_worker_message(self, frames: List[bytes]) -> None:
+        """
+        Forward the response of a worker to the ModelServerManager
+        :param frames: the frames received from the worker (the first one is its identity, the last one is the
+                       message payload)
+        """
+        worker, payload = frames[0], frames[-1]
+        if worker not in self.loads:
+            return
+        if worker not in self.ready_workers:
+            # The first message of a worker tells that it is connected
+            self.ready_workers.append(worker)
+            self.ready_workers.sort()
+            logging.info(f"Worker {worker.decode()} connected")
+            if not self._connected:
+                self.front_socket.send_multipart([b'', payload])
+                self._connected = True
+            while len(self.waiting) > 0:
+                self._route(self.waiting.popleft())
+            return
+
+        self.loads[worker] = max(self.loads[worker] - 1, 0)
+        try:
+            recv_id = int(payload.split(b'-', 2)[1])
+        except (IndexError, ValueError):
+            recv_id = None
+        if recv_id in self.status_requests:
+            response = json.loads(payload.split(b'-', 2)[2])
+            if response.get("success"):
+                self.status_requests[recv_id][1].update(response["result"])
+            self._finish_status_request(recv_id, worker)
+            return
+        self.front_socket.send_multipart([b'', payload])
+
+    def _finish_status_request(self, send_id: int, worker: bytes) -> None:
+        """
+        Record the answer of a worker to a gathered STATUS command, and answer it once every worker has answered
+        :param send_id: the callback id of the STATUS command
+        :param worker: the worker that has answered (or stopped)
+        """
+        workers, status = self.status_requests[send_id]
+        workers.discard(worker)
+        if len(workers) == 0:
+            del self.status_requests[send_id]
+            self._reply(send_id, ModelServer._make_response(Callback.NOOP, status, True))
+
+    def _check_workers(self) -> None:
+        """
+        Restart the workers that have exited. Their outstanding commands are not answered
+        """
+        for worker, process in list(self.processes.items()):
+            if process.poll() is None:
+                continue
+            logging.warning(f"Worker {worker.decode()} exited with {process.returncode}. Restarting it")
+            if worker in self.ready_workers:
+                self.ready_workers.remove(worker)
+            for send_id in list(self.status_requests):
+                self._finish_status_request(send_id, worker)
+            self._start_worker(worker)
+
+    def run_loop(self) -> None:
+        """
+        Run in a loop to forward the messages between the ModelServerManager and the workers
+        """
+        poller = zmq.Poller()
+        poller.register(self.front_socket, zmq.POLLIN)
+        poller.register(self.back_socket, zmq.POLLIN)
+        last_check = time.perf_counter()
+        while True:
+            try:
+                events = dict(poller.poll(ModelServerBroker.WORKER_CHECK_INTERVAL_MS))
+            except KeyboardInterrupt:
+                logging.info("Received KeyboardInterrupt. Shutting down.")
+                break
+            if self.back_socket in events:
+                self._handle_worker_message(self.back_socket.recv_multipart())
+            if self.front_socket in events and not self._route(self._recv()):
+                logging.info("Shutting down.")
+                for process in self.processes.values():
+                    try:
+                        process.wait(timeout=10)
+                    except subprocess.TimeoutExpired:
+                        pass
+                break
+            if time.perf_counter() - last_check > ModelServerBroker.WORKER_CHECK_INTERVAL_MS / 1000:
+                self._check_workers()
+                last_check = time.perf_counter()
+
+
+def _exit_with_parent() -> None:
+    """
+    Get SIGTERM when the parent process exits (only on Linux), so that the workers of a ModelServerBroker do not
+    outlive it, like the ModelServerManager does for the ModelServer
+    """
+    try:
+        libc = ctypes.CDLL("libc.so.6", use_errno=True)
+        libc.prctl(_PR_SET_PDEATHSIG, signal.SIGTERM)
+    except (OSError, AttributeError) as e:
+        logging.debug(f"Failed to install the parent death signal: {e}")
+
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: ./model_server.py <ZMQ_ENDPOINT>")
-        exit(-1)
-    ms = ModelServer(sys.argv[1])
+    aparser = argparse.ArgumentParser(description='ModelServer')
+    aparser.add_argument('end_point', help='ZMQ IPC endpoint of the ModelServerManager')
+    aparser.add_argument('batch_deadline_ms', nargs='?', type=float, default=ModelServer.BATCH_DEADLINE_MS,
+                         help='How long an INFER request waits to be coalesced with others (0 to disable)')
+    aparser.add_argument('max_batch_size', nargs='?', type=int, default=ModelServer.MAX_BATCH_SIZE,
+                         help='The maximum number of coalesced INFER requests')
+    aparser.add_argument('--workers', type=int, default=1,
+                         help='The number of ModelServer processes (more than 1 runs a ModelServerBroker)')
+    aparser.add_argument('--worker', default=None, help='Run as the worker of a ModelServerBroker with this name')
+    aparser.add_argument('--record', default=os.environ.get('MODEL_SERVER_RECORD_FILE'),
+                         help='File to record the received messages to for model_server_benchmark.py (also set by '
+                              'the MODEL_SERVER_RECORD_FILE environment variable when started by NoisePage)')
+    args = aparser.parse_args()
+
+    if args.worker is not None:
+        _exit_with_parent()
+        ms = ModelServer(args.end_point, args.batch_deadline_ms, args.max_batch_size, args.worker)
+    elif args.workers > 1:
+        ms = ModelServerBroker(args.end_point, args.workers, args.batch_deadline_ms, args.max_batch_size, args.record)
+    else:
+        ms = ModelServer(args.end_point, args.batch_deadline_ms, args.max_batch_size, record_file=args.record)
     ms.run_loop()
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Load test of the ModelServer outside of NoisePage
+
+A fake ModelServerManager (a ZMQ ROUTER that speaks the "send_id-recv_id-payload" protocol of the Messenger) starts
+model_server.py and sends it either synthetic INFER requests on an OU model map (optionally with a TRAIN command in the
+background), or the messages recorded by `model_server.py --record FILE`, at a given rate and concurrency. The
+throughput and the latency percentiles of each command are reported.
+
+The latency of a request is measured from the time it is scheduled to be sent (not when the concurrency limit lets it
+be sent), so that a slow ModelServer cannot hide its queueing delay by delaying the requests.
+
+Invoke with:
+    `model_server_benchmark.py --ou_model_path <OU_MODEL_MAP> [--requests N] [--rate R] [--concurrency C]`
+    `model_server_benchmark.py --replay <RECORD_FILE> [--speed S] [--concurrency C]`
+"""
+
+import argparse
+import json
+import logging
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import zmq
+
+from modeling.util import io_util, logging_util
+
+# The callback id of the CONNECTED message of the ModelServer (ModelServer.Callback.CONNECTED)
+_CONNECTED = 1
+
+_MODEL_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_server.py')
+
+_REPORT_HEADER = ['requests', 'failures', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+
+
+class FakeModelServerManager:
+    """
+    The ZMQ ROUTER end of the ModelServerManager that drives a ModelServer process
+    """
+
+    # How long to wait for the ModelServer to connect
+    CONNECT_TIMEOUT_S = 60
+    # How often to check whether the ModelServer is still running while waiting for a response
+    PROCESS_CHECK_INTERVAL_MS = 1000
+
+    def __init__(self, end_point, model_server_args):
+        """
+        Bind the socket and start the ModelServer
+
+        :param end_point: the IPC endpoint (a file path)
+        :param model_server_args: the extra command line arguments of model_server.py
+        """
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.ROUTER)
+        self.socket.bind("ipc://{}".format(end_point))
+        self.process = subprocess.Popen([sys.executable, _MODEL_SERVER, end_point] + model_server_args)
+
+        start_time = time.perf_counter()
+        while True:
+            if not self.poll(self.CONNECT_TIMEOUT_S * 1000):
+                raise RuntimeError("The ModelServer did not connect in {}s".format(self.CONNECT_TIMEOUT_S))
+            _, response = self.recv()
+            if response.get("action") == _CONNECTED:
+                break
+        logging.info("ModelServer connected in {:.2f}s".format(time.perf_counter() - start_time))
+
+    def send(self, send_id, message):
+        """Send a message
+
+        :param send_id: the callback id that the response is sent back with
+        :param message: {cmd, data}
+        """
+        payload = "{}-0-{}".format(send_id, json.dumps(message))
+        self.socket.send_multipart([b'model', b'benchmark', b'', payload.encode('utf-8')])
+
+    def poll(self, timeout_ms):
+        """Wait for a response
+
+        :param timeout_ms: the maximum time to wait in milliseconds (None to wait until a response arrives)
+        :return: whether a response can be received
+        """
+        deadline = None if timeout_ms is None else time.perf_counter() + timeout_ms / 1000
+        while True:
+            wait_ms = self.PROCESS_CHECK_INTERVAL_MS
+            if deadline is not None:
+                wait_ms = min(wait_ms, max(int((deadline - time.perf_counter()) * 1000), 0))
+            if self.socket.poll(wait_ms):
+                return True
+            if self.process.poll() is not None:
+                raise RuntimeError("The ModelServer exited with code {}".format(self.process.returncode))
+            if deadline is not None and time.perf_counter() >= deadline:
+                return False
+
+    def recv(self):
+        """Receive a response (blocking)
+
+        :return: (the callback id, the response {action, result, success, err})
+        """
+        payload = self.socket.recv_multipart()[-1].decode('utf-8')
+        _, recv_id, response = payload.split('-', 2)
+        return int(recv_id), json.loads(response)
+
+    def close(self):
+        """Stop the ModelServer
+        """
+        if self.process.poll() is None:
+            self.send(0, {"cmd": "QUIT", "data": {}})
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.socket.close()
+        self.context.destroy()
+
+
+def generate_requests(ou_model_path, request_num, row_nums, seed):
+    """Generate INFER requests with random features on the opunit models of an OU model map
+
+    :param ou_model_path: the OU model map (saved by the ModelServer or ou_model_trainer.py)
+    :param request_num: the number of requests
+    :param row_nums: the (min, max) number of feature rows of each request
+    :param seed: the random seed
+    :return: the list of the request messages {cmd, data}
+    """
+    with open(ou_model_path, 'rb') as f:
+        model_map, _ = pickle.load(f)
+    # The opunits have different numbers of features
+    opunits = [(opunit.name, _get_feature_num(model)) for opunit, model in model_map.items() if model is not None]
+    opunits = [(opunit, feature_num) for opunit, feature_num in opunits if feature_num is not None]
+    if len(opunits) == 0:
+        raise ValueError("No opunit model with a known number of features in {}".format(ou_model_path))
+
+    rng = np.random.default_rng(seed)
+    messages = []
+    for i in range(request_num):
+        opunit, feature_num = opunits[i % len(opunits)]
+        features = rng.uniform(1, 10000, (int(rng.integers(row_nums[0], row_nums[1] + 1)), feature_num)).round()
+        messages.append({"cmd": "INFER", "data": {"type": "OPERATING_UNIT", "model_path": ou_model_path,
+                                                  "opunit": opunit, "features": features.tolist()}})
+    return messages
+
+
+def read_recording(record_file, save_dir):
+    """Read the messages recorded by `model_server.py --record`
+
+    The QUIT commands and the requests whose features are in shared memory (which does not exist anymore) are skipped.
+    The models of the replayed TRAIN commands are saved into save_dir instead of overwriting the recorded save paths.
+
+    :param record_file: the record file
+    :param save_dir: the directory to save the trained models into
+    :return: the list of (the time since the first message in seconds, the message {cmd, data})
+    """
+    messages = []
+    skipped = 0
+    with open(record_file) as f:
+        for line in f:
+            if len(line.strip()) == 0:
+                continue
+            record = json.loads(line)
+            message = json.loads(record["payload"].split('-', 2)[2])
+            data = message.get("data")
+            if message.get("cmd") == "QUIT" or (isinstance(data, dict) and "features_shm" in data):
+                skipped += 1
+                continue
+            if message.get("cmd") == "TRAIN" and isinstance(data, dict) and "save_path" in data:
+                data["save_path"] = os.path.join(save_dir, "{}_{}".format(len(messages),
+                                                                           os.path.basename(data["save_path"])))
+            messages.append((record["time"], message))
+    if skipped > 0:
+        logging.info("Skipped {} recorded messages that cannot be replayed".format(skipped))
+    if len(messages) == 0:
+        return []
+    first_time = min(t for t, _ in messages)
+    return sorted(((t - first_time, message) for t, message in messages), key=lambda x: x[0])
+
+
+def run_load(manager, schedule, concurrency):
+    """Send the requests on schedule and wait for all the responses
+
+    :param manager: the FakeModelServerManager
+    :param schedule: the list of (the time to send at in seconds since the start, the message)
+    :param concurrency: the maximum number of requests waiting for their responses
+    :return: (the list of (command, latency in seconds, success) of each request, the total time in seconds)
+    """
+    results = [None] * len(schedule)
+    scheduled_times = {}
+    next_request = 0
+    start_time = time.perf_counter()
+    while next_request < len(schedule) or len(scheduled_times) > 0:
+        now = time.perf_counter() - start_time
+        if next_request < len(schedule) and len(scheduled_times) < concurrency and schedule[next_request][0] <= now:
+            # The callback ids start at 1 since 0 is the callback id of the ModelServer's own messages
+            manager.send(next_request + 1, schedule[next_request][1])
+            scheduled_times[next_request + 1] = schedule[next_request][0]
+            next_request += 1
+            continue
+
+        if next_request < len(schedule) and len(scheduled_times) < concurrency:
+            timeout_ms = max(int((schedule[next_request][0] - now) * 1000), 1)
+        else:
+            timeout_ms = None
+        if not manager.poll(timeout_ms):
+            continue
+        recv_id, response = manager.recv()
+        if recv_id not in scheduled_times:
+            continue
+        latency = time.perf_counter() - start_time - scheduled_times.pop(recv_id)
+        results[recv_id - 1] = (schedule[recv_id - 1][1]["cmd"], latency, bool(response.get("success")))
+    return results, time.perf_counter() - start_time
+
+
+def summarize(results, duration):
+    """Summarize the latencies of each command
+
+    :param results: the list of (command, latency in seconds, success) of each request
+    :param duration: the total time of the load in seconds
+    :return: dict of command (and "ALL") -> the values of _REPORT_HEADER
+    """
+    commands = {}
+    for cmd, latency, success in results:
+        commands.setdefault(cmd, []).append((latency, success))
+    commands["ALL"] = [(latency, success) for _, latency, success in results]
+
+    report = {}
+    for cmd, values in commands.items():
+        latencies = np.array([latency for latency, _ in values]) * 1000
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        report[cmd] = [len(values), sum(not success for _, success in values), len(values) / duration,
+                       p50, p95, p99, latencies.max()]
+    return report
+
+
+def write_report(report, output_file):
+    """Write the report as JSON (for a .json file) or CSV
+
+    :param report: dict of command -> the values of _REPORT_HEADER
+    :param output_file: the report file
+    """
+    if output_file.endswith('.json'):
+        with open(output_file, 'w') as f:
+            json.dump({cmd: dict(zip(_REPORT_HEADER, values)) for cmd, values in report.items()}, f, indent=2)
+        return
+    io_util.create_csv_file(output_file, ['command'] + _REPORT_HEADER)
+    io_util.write_csv_results(output_file, list(report.keys()), list(report.values()))
+
+
+def _get_feature_num(model):
+    # The number of input features that a trained model is fitted with (None if unknown). The fitted sklearn
+    # transformers and estimators record it in n_features_in_
+    for estimator in (getattr(model, '_xscaler', None), getattr(model, '_base_model', None)):
+        feature_num = getattr(estimator, 'n_features_in_', None)
+        if feature_num is not None:
+            return int(feature_num)
+    return None
+
+
+def _get_schedule(messages, interval):
+    # Send the messages at a fixed interval (all at once for 0)
+    return [(i * interval, message) for i, message in enumerate(messages)]
+
+
+# ==============================================
+# main
+# ==============================================
+if __name__ == '__main__':
+    aparser = argparse.ArgumentParser(description='ModelServer Load Test')
+    aparser.add_argument('--ou_model_path', help='OU model map to send synthetic INFER requests on')
+    aparser.add_argument('--requests', type=int, default=1000, help='The number of synthetic INFER requests')
+    aparser.add_argument('--rows', type=int, nargs=2, default=[1, 4],
+                         help='The min and max number of feature rows of a synthetic INFER request')
+    aparser.add_argument('--rate', type=float, default=0,
+                         help='The synthetic requests per second (0 to send them as fast as the concurrency allows)')
+    aparser.add_argument('--train_input_path', default=None,
+                         help='OU runner data directory to train an OU model map from while the synthetic INFER '
+                              'requests are sent (to measure the inference under training)')
+    aparser.add_argument('--train_methods', nargs='+', default=['lr'], help='The methods of the background TRAIN')
+    aparser.add_argument('--warmup', type=int, default=10,
+                         help='The number of synthetic requests sent (and not measured) before the load')
+    aparser.add_argument('--seed', type=int, default=0, help='The random seed of the synthetic features')
+    aparser.add_argument('--replay', default=None,
+                         help='File recorded by `model_server.py --record` to replay instead of the synthetic load')
+    aparser.add_argument('--speed', type=float, default=1,
+                         help='The replay speed relative to the recording (0 to send the messages as fast as the '
+                              'concurrency allows)')
+    aparser.add_argument('--concurrency', type=int, default=16,
+                         help='The maximum number of requests waiting for their responses')
+    aparser.add_argument('--model_server_args', nargs=argparse.REMAINDER, default=[],
+                         help='The extra arguments of model_server.py (e.g., --workers 4), must be the last option')
+    aparser.add_argument('--output', default=None, help='File to write the report to (.json or .csv)')
+    aparser.add_argument('--log', default='info', help='The logging level')
+    args = aparser.parse_args()
+
+    logging_util.init_logging(args.log)
+    if (args.ou_model_path is None) == (args.replay is None):
+        aparser.error("Either --ou_model_path or --replay is required")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        manager = FakeModelServerManager(os.path.join(tmp_dir, 'model_server.ipc'), args.model_server_args)
+        try:
+            if args.replay is not None:
+                schedule = read_recording(args.replay, tmp_dir)
+                if args.speed > 0:
+                    schedule = [(t / args.speed, message) for t, message in schedule]
+                else:
+                    schedule = _get_schedule([message for _, message in schedule], 0)
+            else:
+                messages = generate_requests(args.ou_model_path, args.warmup + args.requests, args.rows, args.seed)
+                run_load(manager, _get_schedule(messages[:args.warmup], 0), args.concurrency)
+                schedule = _get_schedule(messages[args.warmup:], 0 if args.rate <= 0 else 1 / args.rate)
+                if args.train_input_path is not None:
+                    train = {"cmd": "TRAIN", "data": {"type": "OPERATING_UNIT", "methods": args.train_methods,
+                                                      "input_path": args.train_input_path,
+                                                      "save_path": os.path.join(tmp_dir, 'ou_model_map.pickle')}}
+                    schedule.insert(0, (0, train))
+            if len(schedule) == 0:
+                raise ValueError("No requests to send")
+            results, duration = run_load(manager, schedule, args.concurrency)
+        finally:
+            manager.close()
+
+    report = summarize(results, duration)
+    logging.info("{} requests in {:.3f}s".format(len(results), duration))
+    logging.info("{:<16}".format("command") + "".join("{:>12}".format(name) for name in _REPORT_HEADER))
+    for cmd, values in report.items():
+        logging.info("{:<16}".format(cmd) + "{:>12}{:>12}".format(values[0], values[1]) +
+                     "".join("{:>12.2f}".format(value) for value in values[2:]))
+    if args.output is not None:
+        write_report(report, args.output)
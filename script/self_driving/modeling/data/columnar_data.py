@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from . import data_util
+from ..util import io_util, logging_util
+
+# The columnar copy of a CSV data file is the directory <file name without .csv>.columnar next to it:
+#   schema.json: the column names (the header that DataInfo.parse_csv_header parses), the kind of each column, the
+#                fingerprint of the CSV file that it is converted from, and the number of rows
+#   c<i>.npy: the values of a "numeric" (int64/float64) or "string" column i
+#   c<i>_values.npy, c<i>_offsets.npy: a "ragged" column i of ";"-separated values, where the values of row j are
+#                values[offsets[j]:offsets[j + 1]] (a single value is read as a scalar like in the CSV)
+#   line_offsets.npy: the byte offset of each row in the CSV file to translate the byte ranges of the CSV file
+# The arrays are memory-mapped when they are read, so loading a converted file does not parse anything.
+COLUMNAR_SUFFIX = '.columnar'
+
+# Bump the version when the layout changes so that the old conversions are not used
+_FORMAT_VERSION = 1
+
+_SCHEMA_FILE = 'schema.json'
+
+
+def get_columnar_path(filename):
+    """Get the path of the columnar copy of a CSV data file
+
+    :param filename: the CSV data file
+    :return: the columnar directory (that may not exist)
+    """
+    return os.path.splitext(filename)[0] + COLUMNAR_SUFFIX
+
+
+def convert(filename):
+    """Convert a CSV data file into the columnar format (next to it)
+
+    :param filename: the CSV data file
+    :return: the columnar directory
+    """
+    header = data_util.read_csv_header(filename)
+    df = pd.read_csv(filename, skipinitialspace=True)
+
+    arrays = {'line_offsets': _get_line_offsets(filename)}
+    kinds = []
+    for i in range(len(header)):
+        column = df.iloc[:, i]
+        if pd.api.types.is_numeric_dtype(column.dtype):
+            kinds.append(data_util.NUMERIC)
+            arrays['c{}'.format(i)] = column.to_numpy()
+            continue
+
+        raw_values = column.astype(str).to_numpy()
+        ragged = _to_ragged(raw_values)
+        if ragged is None:
+            kinds.append(data_util.STRING)
+            arrays['c{}'.format(i)] = raw_values.astype(np.str_)
+        else:
+            kinds.append(data_util.RAGGED)
+            arrays['c{}_values'.format(i)], arrays['c{}_offsets'.format(i)] = ragged
+
+    schema = {'version': _FORMAT_VERSION, 'source': list(io_util.get_file_fingerprint(filename)),
+              'header': header, 'kinds': kinds, 'row_num': len(df)}
+
+    # Write into a temporary directory first so that a partially written conversion is never read
+    path = get_columnar_path(filename)
+    tmp_path = "{}.tmp{}".format(path, os.getpid())
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, name + '.npy'), array)
+    with open(os.path.join(tmp_path, _SCHEMA_FILE), 'w') as file:
+        json.dump(schema, file)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp_path, path)
+    logging.info("Converted {} to {}".format(filename, path))
+    return path
+
+
+def get_columnar_file(filename):
+    """Get the ColumnarFile to read a data file from
+
+    :param filename: the CSV data file, or a columnar directory
+    :return: the ColumnarFile if filename is a columnar directory or the CSV file has an up-to-date columnar copy,
+             None otherwise (the CSV file needs to be parsed)
+    """
+    if filename.endswith(COLUMNAR_SUFFIX):
+        return ColumnarFile(filename)
+
+    path = get_columnar_path(filename)
+    if not os.path.isdir(path):
+        return None
+    columnar_file = ColumnarFile(path)
+    if tuple(columnar_file.schema['source']) != io_util.get_file_fingerprint(filename):
+        logging.debug("Ignoring the stale columnar copy {}".format(path))
+        return None
+    return columnar_file
+
+
+def read_csv(filename, **kwargs):
+    """Read a data file into a DataFrame like pd.read_csv, but from its columnar copy if there is one
+
+    :param filename: the CSV data file, or a columnar directory
+    :param kwargs: the arguments of pd.read_csv (only used to parse the CSV file)
+    :return: the DataFrame
+    """
+    columnar_file = get_columnar_file(filename)
+    if columnar_file is None:
+        return pd.read_csv(filename, **kwargs)
+    return columnar_file.to_frame()
+
+
+def read_rows(filename, byte_range=None):
+    """Read the typed rows of a data file one by one
+
+    The numbers are int/float, the ";"-separated values are lists (a single value is a scalar), and the others are
+    strings. The CSV files are parsed in blocks of lines by data_util.parse_csv_lines.
+
+    :param filename: the CSV data file, or a columnar directory
+    :param byte_range: only read the rows in this (begin, end) byte range of the CSV file (None for all the rows)
+    :return: (the column names, generator of the rows)
+    """
+    columnar_file = get_columnar_file(filename)
+    if columnar_file is not None:
+        begin, end = 0, columnar_file.row_num
+        if byte_range is not None:
+            begin, end = columnar_file.get_row_range(byte_range)
+        return columnar_file.header, columnar_file.iterate_rows(begin, end)
+
+    header = data_util.read_csv_header(filename)
+    return header, _iterate_csv_rows(filename, len(header), byte_range)
+
+
+class ColumnarFile:
+    """
+    A data file converted into the columnar format
+    """
+
+    def __init__(self, path):
+        """
+        :param path: the columnar directory
+        """
+        self.path = path
+        with open(os.path.join(path, _SCHEMA_FILE)) as file:
+            self.schema = json.load(file)
+        if self.schema['version'] != _FORMAT_VERSION:
+            raise ValueError("Unsupported columnar format version {} of {}".format(self.schema['version'], path))
+        self.header = self.schema['header']
+        self.kinds = self.schema['kinds']
+        self.row_num = self.schema['row_num']
+
+    def load_array(self, name):
+        return np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+
+    def get_column(self, index, begin=0, end=None):
+        """Get the values of a column
+
+        :param index: the index of the column
+        :param begin: the first row
+        :param end: the end row (exclusive, None for the last row)
+        :return: the array of a numeric or string column, or (values, offsets) of a ragged column where the offsets
+                 start at 0
+        """
+        end = self.row_num if end is None else end
+        if self.kinds[index] != data_util.RAGGED:
+            return self.load_array('c{}'.format(index))[begin:end]
+        offsets = self.load_array('c{}_offsets'.format(index))[begin:end + 1]
+        values = self.load_array('c{}_values'.format(index))[offsets[0]:offsets[-1]]
+        return values, offsets - offsets[0]
+
+    def get_row_range(self, byte_range):
+        """Get the rows in a byte range of the CSV file
+
+        :param byte_range: the (begin, end) byte offsets of whole lines in the CSV file
+        :return: the (begin, end) rows
+        """
+        line_offsets = self.load_array('line_offsets')
+        begin, end = np.searchsorted(line_offsets, byte_range)
+        return int(begin), int(end)
+
+    def iterate_rows(self, begin=0, end=None):
+        """Iterate over the typed rows
+
+        :param begin: the first row
+        :param end: the end row (exclusive, None for the last row)
+        :return: generator of the rows as tuples
+        """
+        end = self.row_num if end is None else end
+        yield from _iterate_typed_rows(self.kinds, [self.get_column(i, begin, end) for i in range(len(self.kinds))])
+
+    def to_float32(self, rows=slice(None)):
+        """Get the rows of the numeric columns as one float32 array
+
+        :param rows: the index of the rows to get (a slice or the sorted row indices)
+        :return: the float32 array (row_num x numeric column num)
+        """
+        numeric_columns = [i for i, kind in enumerate(self.kinds) if kind == data_util.NUMERIC]
+        row_num = len(range(self.row_num)[rows]) if isinstance(rows, slice) else len(rows)
+        data = np.empty((row_num, len(numeric_columns)), dtype=np.float32)
+        for j, i in enumerate(numeric_columns):
+            data[:, j] = self.load_array('c{}'.format(i))[rows]
+        return data
+
+    def to_frame(self):
+        """Get all the rows as a DataFrame (the ragged columns are object columns of the typed values)
+
+        :return: the DataFrame with the column names of the CSV file
+        """
+        columns = {}
+        for i, kind in enumerate(self.kinds):
+            column = self.get_column(i)
+            columns[i] = column if kind != data_util.RAGGED else _get_ragged_rows(*column)
+        df = pd.DataFrame(columns)
+        df.columns = self.header
+        return df
+
+
+def _iterate_csv_rows(filename, column_num, byte_range):
+    # Iterate over the typed rows of the CSV file
+    for block in data_util.iterate_csv_line_blocks(filename, byte_range=byte_range):
+        try:
+            kinds, columns = data_util.parse_csv_lines(block, column_num)
+        except ValueError:
+            # The block has quoted, empty or blank fields, so parse it one field at a time
+            yield from _convert_csv_rows(block)
+            continue
+        yield from _iterate_typed_rows(kinds, columns)
+
+
+def _convert_csv_rows(block):
+    # Parse the rows of a block with the csv module and convert each number (the other fields are kept as strings)
+    for row in csv.reader(block.decode().splitlines(), delimiter=",", skipinitialspace=True):
+        if len(row) == 0:
+            continue
+        typed_row = []
+        for field in row:
+            try:
+                typed_row.append(data_util.convert_string_to_numeric(field))
+            except ValueError:
+                typed_row.append(field)
+        yield typed_row
+
+
+def _iterate_typed_rows(kinds, columns):
+    # Iterate over the rows of the typed columns as tuples
+    columns = [column.tolist() if kind != data_util.RAGGED else _get_ragged_rows(*column)
+               for kind, column in zip(kinds, columns)]
+    yield from zip(*columns)
+
+
+def _get_ragged_rows(values, offsets):
+    # The typed values of each row of a ragged column (a scalar for a single value)
+    values = values.tolist()
+    offsets = offsets.tolist()
+    return [values[begin] if end - begin == 1 else values[begin:end] for begin, end in zip(offsets[:-1], offsets[1:])]
+
+
+def _get_line_offsets(filename):
+    # The byte offset of each data line (the non-blank lines after the header) in the file
+    offsets = []
+    with open(filename, "rb") as f:
+        offset = len(f.readline())
+        for line in f:
+            if len(line.strip()) > 0:
+                offsets.append(offset)
+            offset += len(line)
+    return np.array(offsets, dtype=np.int64)
+
+
+def _to_ragged(raw_values):
+    """Convert the ";"-separated values of a column into a ragged array
+
+    :param raw_values: the string values of the column
+    :return: (values, offsets), or None if the column is not numeric
+    """
+    lists = [value.split(';') for value in raw_values]
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum([len(values) for values in lists], out=offsets[1:])
+    tokens = np.array([token for values in lists for token in values])
+    for dtype in (np.int64, np.float64):
+        try:
+            return tokens.astype(dtype), offsets
+        except ValueError:
+            continue
+    return None
+
+
+# ==============================================
+# main
+# ==============================================
+if __name__ == '__main__':
+    aparser = argparse.ArgumentParser(description='Columnar Data Converter')
+    aparser.add_argument('--input_path', default='modeling/ou_runner_input',
+                         help='Directory of the CSV data files to convert (the columnar copies are written next to '
+                              'them and used by the data loaders while the CSV files are unchanged)')
+    aparser.add_argument('--log', default='info', help='The logging level')
+    args = aparser.parse_args()
+
+    logging_util.init_logging(args.log)
+    for csv_file in sorted(glob.glob(os.path.join(args.input_path, '*.csv'))):
+        convert(csv_file)
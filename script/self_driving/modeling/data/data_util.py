@@ -1,3 +1,40 @@
+import csv
+
+import numpy as np
+import pandas as pd
+
+# The size of the blocks to count the lines of a file with
+_LINE_COUNT_BLOCK_SIZE = 1 << 20
+
+# The approximate size of the blocks of lines that parse_csv_lines() parses at a time (it allocates a few arrays with
+# 8 bytes per input byte). The blocks start small and double up to this size, so that reading only the first rows is
+# cheap
+CSV_PARSE_BLOCK_SIZE = 1 << 22
+_FIRST_CSV_PARSE_BLOCK_SIZE = 1 << 14
+
+# The kinds of the columns of the parsed data
+NUMERIC = 'numeric'
+RAGGED = 'ragged'
+STRING = 'string'
+
+# The lookup tables of the bytes that are not in the numeric and ";"-separated numeric fields (the fields with these
+# bytes are strings), and the bytes that make a number a float
+_IS_NON_NUMERIC_BYTE = np.ones(256, dtype=bool)
+_IS_NON_NUMERIC_BYTE[np.frombuffer(b'0123456789+-.eE; \t\r,\n', dtype=np.uint8)] = False
+_IS_FLOAT_BYTE = np.zeros(256, dtype=bool)
+_IS_FLOAT_BYTE[np.frombuffer(b'.eE', dtype=np.uint8)] = True
+# The letters of the nan and inf values, which are floats (like float() and np.fromstring parse them) rather than
+# strings if the whole field is such values
+_IS_NAN_INF_BYTE = np.zeros(256, dtype=bool)
+_IS_NAN_INF_BYTE[np.frombuffer(b'nNaAiIfFtTyY', dtype=np.uint8)] = True
+
+# Turns the line and value separators into "," for np.fromstring
+_TO_COMMA = bytes.maketrans(b'\n;', b',,')
+
+# The largest integer that is exactly represented by float64
+_MAX_EXACT_FLOAT_INT = 1 << 53
+
+
 def convert_string_to_numeric(value):
     """Break up a string that contains ";" to a list of values
 
@@ -5,11 +42,15 @@ def convert_string_to_numeric(value):
     :return: a list of int/float values
     """
     if ';' in value:
-        return list(map(convert_string_to_numeric, value.split(';')))
+        return [_convert_scalar(v) for v in value.split(';')]
+    return _convert_scalar(value)
 
+
+def _convert_scalar(value):
+    # Parse as an int first, and as a float only if it is not an int
     try:
         return int(value)
-    finally:
+    except ValueError:
         return float(value)
 
 
@@ -22,3 +63,220 @@ def round_to_interval(time, interval):
     """
     return time - time % interval
 
+
+def read_csv_header(filename):
+    """Read the column names of a CSV file
+
+    :param filename: the CSV file
+    :return: the list of column names (with the surrounding spaces removed)
+    """
+    with open(filename, newline='') as file:
+        return [name.strip() for name in next(csv.reader(file))]
+
+
+def count_csv_rows(filename):
+    """Count the data rows of a CSV file (without the header) by counting the lines without parsing them
+
+    :param filename: the CSV file
+    :return: the number of rows (an upper bound if the file has blank lines)
+    """
+    line_num = 0
+    last_block = b''
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(_LINE_COUNT_BLOCK_SIZE), b''):
+            line_num += block.count(b'\n')
+            last_block = block
+    # The last line may not end with a newline
+    if len(last_block) > 0 and not last_block.endswith(b'\n'):
+        line_num += 1
+    return max(line_num - 1, 0)
+
+
+def iterate_csv_chunks(filename, chunk_size):
+    """Iterate over a numeric CSV file in chunks of rows
+
+    :param filename: the CSV file
+    :param chunk_size: the number of rows in each chunk
+    :return: the generator of the float32 arrays of the chunks
+    """
+    with pd.read_csv(filename, skipinitialspace=True, dtype=np.float32, chunksize=chunk_size) as reader:
+        for chunk in reader:
+            yield chunk.to_numpy(dtype=np.float32)
+
+
+def read_csv_float32(filename, chunk_size, rows=None):
+    """Read a numeric CSV file in chunks into a preallocated float32 array
+
+    Only one chunk of the file is parsed at a time, so the peak memory is the (float32) result plus one chunk instead
+    of the DataFrame and its float64 copies.
+
+    :param filename: the CSV file
+    :param chunk_size: the number of rows to parse at a time
+    :param rows: the sorted indices of the rows to read (None to read all the rows)
+    :return: the float32 array of the rows
+    """
+    column_num = len(read_csv_header(filename))
+    capacity = count_csv_rows(filename) if rows is None else len(rows)
+    data = np.empty((capacity, column_num), dtype=np.float32)
+
+    row_num = 0
+    chunk_start = 0
+    for chunk in iterate_csv_chunks(filename, chunk_size):
+        chunk_end = chunk_start + chunk.shape[0]
+        if rows is not None:
+            begin, end = np.searchsorted(rows, [chunk_start, chunk_end])
+            chunk = chunk[rows[begin:end] - chunk_start]
+        data[row_num:row_num + chunk.shape[0]] = chunk
+        row_num += chunk.shape[0]
+        chunk_start = chunk_end
+
+    return data[:row_num]
+
+
+def iterate_csv_line_blocks(filename, block_size=CSV_PARSE_BLOCK_SIZE, byte_range=None):
+    """Read the data lines of a CSV file in blocks of whole lines
+
+    :param filename: the CSV file
+    :param block_size: the approximate maximum number of bytes per block
+    :param byte_range: only read the lines in this (begin, end) byte range of whole lines (None for all the lines after
+           the header)
+    :return: the generator of the bytes of each block
+    """
+    with open(filename, "rb") as f:
+        if byte_range is None:
+            f.readline()
+            end = None
+        else:
+            f.seek(byte_range[0])
+            end = byte_range[1]
+        size = min(_FIRST_CSV_PARSE_BLOCK_SIZE, block_size)
+        while end is None or f.tell() < end:
+            if end is not None:
+                size = min(size, end - f.tell())
+            block = f.read(size)
+            if len(block) == 0:
+                break
+            # Extend the block to the end of its last line
+            if not block.endswith(b'\n') and (end is None or f.tell() < end):
+                block += f.readline()
+            yield block
+            size = min(size * 2, block_size)
+
+
+def parse_csv_lines(data, column_num):
+    """Parse the lines of a CSV file with numbers, ";"-separated numbers and strings into typed columns
+
+    All the numbers are parsed by one np.fromstring call over the numeric text, and the fields are located with array
+    operations on the bytes instead of splitting and converting each value in Python. A column is a string column if it
+    has any non-numeric character (other than in the nan and inf values), a ragged column if it has any ";", and an
+    int column if it has no ".", "e", "E", nan or inf.
+
+    :param data: the bytes of whole CSV lines (without the header)
+    :param column_num: the number of columns
+    :return: (the kind of each column (NUMERIC, RAGGED or STRING), the columns). A numeric column is an int64 or
+             float64 array, a ragged column is (values, offsets) where the values of row i are
+             values[offsets[i]:offsets[i + 1]], and a string column is a str array with the surrounding spaces removed
+    :raises ValueError: if the lines have quoted fields or do not all have column_num non-empty fields
+    """
+    if len(data) > 0 and not data.endswith(b'\n'):
+        data += b'\n'
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if np.any(buf == ord('"')):
+        raise ValueError("The CSV lines have quoted fields")
+
+    # The fields end at the separators. Only the positions of the rare bytes (";", non-numeric and float bytes) are
+    # mapped to their fields, so there is no per-byte field index
+    field_ends = np.flatnonzero((buf == ord(',')) | (buf == ord('\n')))
+    field_num = len(field_ends)
+    if field_num % column_num != 0 or np.any(buf[field_ends[column_num - 1::column_num]] != ord('\n')):
+        raise ValueError("The CSV lines do not all have {} fields".format(column_num))
+    row_num = field_num // column_num
+    field_starts = np.concatenate(([0], field_ends[:-1] + 1))
+
+    def get_columns_with(positions):
+        return np.bincount(np.searchsorted(field_ends, positions) % column_num, minlength=column_num) > 0
+
+    is_string = get_columns_with(np.flatnonzero(_IS_NON_NUMERIC_BYTE[buf] & ~_IS_NAN_INF_BYTE[buf]))
+    is_float = get_columns_with(np.flatnonzero(_IS_FLOAT_BYTE[buf]))
+
+    # The fields with the letters of nan and inf are floats if all their values are numbers (e.g., "nan" or "-inf;1"),
+    # and strings otherwise. Such fields are rare, and each distinct text is checked once
+    nan_inf_fields = np.unique(np.searchsorted(field_ends, np.flatnonzero(_IS_NAN_INF_BYTE[buf])))
+    checked = {}
+    for field in nan_inf_fields[~is_string[nan_inf_fields % column_num]].tolist():
+        column = field % column_num
+        if is_string[column]:
+            continue
+        text = data[field_starts[field]:field_ends[field]]
+        if text not in checked:
+            checked[text] = all(_is_number(value) for value in text.decode().split(';'))
+        is_float[column] = True
+        is_string[column] = not checked[text]
+    value_separator_fields = np.searchsorted(field_ends, np.flatnonzero(buf == ord(';')))
+    token_counts = np.bincount(value_separator_fields, minlength=field_num).reshape(row_num, column_num) + 1
+    token_counts[:, is_string] = 0
+    is_ragged = np.any(token_counts > 1, axis=0)
+
+    # Parse all the numbers at once after removing the string fields and turning all the separators into ","
+    text = data
+    if np.any(is_string):
+        keep_fields = np.tile(~is_string, row_num)
+        text = buf[np.repeat(keep_fields, field_ends - field_starts + 1)].tobytes()
+    text = text[:-1].translate(_TO_COMMA)
+    try:
+        tokens = np.fromstring(text, sep=',') if len(text) > 0 else np.empty(0)
+    except ValueError as e:
+        raise ValueError("Failed to parse the CSV lines: {}".format(e))
+    # The older NumPy versions only warn (a DeprecationWarning) and stop at the text that is not a number
+    if len(tokens) != token_counts.sum():
+        raise ValueError("Failed to parse the CSV lines: empty or malformed fields")
+    token_starts = (np.cumsum(token_counts) - token_counts.ravel()).reshape(row_num, column_num)
+
+    kinds = []
+    columns = []
+    for i in range(column_num):
+        field_index = np.arange(i, field_num, column_num)
+        if is_string[i]:
+            kinds.append(STRING)
+            columns.append(np.array([data[begin:end].decode().strip() for begin, end in
+                                     zip(field_starts[field_index].tolist(), field_ends[field_index].tolist())],
+                                    dtype=np.str_))
+            continue
+
+        counts = token_counts[:, i]
+        offsets = np.zeros(row_num + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        index = np.repeat(token_starts[:, i] - offsets[:-1], counts) + np.arange(offsets[-1])
+        values = tokens[index]
+        if not is_float[i]:
+            values = _to_int_values(values, data, field_starts[field_index], field_ends[field_index], is_ragged[i])
+        if is_ragged[i]:
+            kinds.append(RAGGED)
+            columns.append((values, offsets))
+        else:
+            kinds.append(NUMERIC)
+            columns.append(values)
+    return kinds, columns
+
+
+def _is_number(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _to_int_values(values, data, field_starts, field_ends, is_ragged):
+    """Convert the parsed values of an int column to int64
+
+    The values are parsed as float64, so the large ints are parsed again from the text to keep them exact.
+
+    :return: the int64 values
+    """
+    if len(values) == 0 or np.abs(values).max() < _MAX_EXACT_FLOAT_INT:
+        return values.astype(np.int64)
+    fields = [data[begin:end].decode() for begin, end in zip(field_starts.tolist(), field_ends.tolist())]
+    if is_ragged:
+        return np.array([int(v) for field in fields for v in field.split(';')], dtype=np.int64)
+    return np.array([int(field) for field in fields], dtype=np.int64)
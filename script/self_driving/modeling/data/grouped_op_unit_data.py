@@ -1,19 +1,17 @@
-import csv
 import numpy as np
-import copy
-import tqdm
 import pandas as pd
 import os
 import logging
 
-from . import data_util
+from . import columnar_data, data_util
 from ..info import data_info
+from ..util import profiling_util
 from .. import interference_model_config
 from ..type import ConcurrentCountingMode, OpUnit, Target, ExecutionFeature
 
 
 def get_grouped_op_unit_data(filename, warmup_period, ee_sample_rate, txn_sample_rate,
-                             network_sample_rate):
+                             network_sample_rate, byte_range=None, info=None):
     """Get the training data from the global model
 
     :param filename: the input data file
@@ -21,219 +19,501 @@ def get_grouped_op_unit_data(filename, warmup_period, ee_sample_rate, txn_sample
     :param ee_sample_rate: sampling rate for the EE OUs
     :param txn_sample_rate: sampling rate for the transaction OUs
     :param network_sample_rate: sampling rate for the network OUs
-    :return: the list of global model data
+    :param byte_range: only load the lines in this (begin, end) byte range of a pipeline data file (None for the whole
+                       file). The ranges are generated by get_pipeline_chunk_ranges
+    :param info: the DataInfo of the data, i.e., of the ou models (None to use the global data_info.instance)
+    :return: the GroupedOpUnitDataStore of the global model data
     """
+    if info is None:
+        info = data_info.instance
 
     if "txn" in filename:
         # Cannot handle the transaction manager data yet
-        return _txn_get_mini_runner_data(filename, txn_sample_rate)
+        return _txn_get_mini_runner_data(filename, txn_sample_rate, info)
     if "pipeline" in filename:
         # Special handle of the pipeline execution data
-        return _pipeline_get_grouped_op_unit_data(filename, warmup_period, ee_sample_rate)
+        return _pipeline_get_grouped_op_unit_data(filename, warmup_period, ee_sample_rate, info, byte_range)
     if "gc" in filename or "log" in filename:
         # Handle of the gc or log data with interval-based conversion
-        return _interval_get_grouped_op_unit_data(filename)
+        return _interval_get_grouped_op_unit_data(filename, info)
     if "command" in filename:
         # Handle networking OUs
-        return _default_get_global_data(filename, network_sample_rate)
+        return _default_get_global_data(filename, info, network_sample_rate)
 
-    return _default_get_global_data(filename)
+    return _default_get_global_data(filename, info)
 
 
-def _default_get_global_data(filename, sample_rate=100):
+def iterate_grouped_op_unit_data(filename, warmup_period, ee_sample_rate, txn_sample_rate, network_sample_rate,
+                                 chunk_size, info=None):
+    """Get the training data from the global model chunk by chunk
+
+    The pipeline data files are read in byte-range chunks of whole lines. The other files are loaded at once.
+
+    :param filename: the input data file
+    :param warmup_period: warmup period for pipeline data
+    :param ee_sample_rate: sampling rate for the EE OUs
+    :param txn_sample_rate: sampling rate for the transaction OUs
+    :param network_sample_rate: sampling rate for the network OUs
+    :param chunk_size: the approximate number of bytes of a pipeline data file to load in one chunk
+    :param info: the DataInfo of the data, i.e., of the ou models (None to use the global data_info.instance)
+    :return: generator of the GroupedOpUnitDataStore of each chunk (in the order of the lines in the file)
+    """
+    if "txn" not in filename and "pipeline" in filename:
+        for byte_range in get_pipeline_chunk_ranges(filename, chunk_size):
+            yield get_grouped_op_unit_data(filename, warmup_period, ee_sample_rate, txn_sample_rate,
+                                           network_sample_rate, byte_range, info)
+    else:
+        yield get_grouped_op_unit_data(filename, warmup_period, ee_sample_rate, txn_sample_rate, network_sample_rate,
+                                       info=info)
+
+
+def concatenate(store_list, info):
+    """Concatenate multiple GroupedOpUnitDataStore into one
+
+    :param store_list: the list of GroupedOpUnitDataStore to concatenate
+    :param info: the DataInfo of the data
+    :return: the concatenated GroupedOpUnitDataStore
+    """
+    name_list = []
+    name_code_map = {}
+    name_codes = []
+    opunit_offsets = [np.zeros(1, dtype=np.int64)]
+    entry_num = 0
+    opunit_x = {}
+    feature_rows = []
+    for store in store_list:
+        # Re-map the name codes into the merged name list
+        code_map = np.empty(len(store.name_list), dtype=np.int32)
+        for i, name in enumerate(store.name_list):
+            if name not in name_code_map:
+                name_code_map[name] = len(name_list)
+                name_list.append(name)
+            code_map[i] = name_code_map[name]
+        name_codes.append(code_map[store.name_codes])
+
+        opunit_offsets.append(store.opunit_offsets[1:] + entry_num)
+        entry_num += store.opunit_offsets[-1]
+
+        # Shift the feature rows by the number of rows already stored for the same opunit
+        rows = store.feature_rows.copy()
+        for opunit, x in store.opunit_x.items():
+            if opunit in opunit_x:
+                rows[store.opunits == opunit] += sum(len(part) for part in opunit_x[opunit])
+                opunit_x[opunit].append(x)
+            else:
+                opunit_x[opunit] = [x]
+        feature_rows.append(rows)
+
+    store = GroupedOpUnitDataStore(name_list,
+                                   _concatenate_or_empty(name_codes, np.int32),
+                                   _concatenate_or_empty([s.y for s in store_list], np.float64,
+                                                         (0, info.MINI_MODEL_TARGET_NUM)),
+                                   _concatenate_or_empty([s.start_time for s in store_list], np.float64),
+                                   _concatenate_or_empty([s.cpu_id for s in store_list], np.int32),
+                                   _concatenate_or_empty([s.sample_rate for s in store_list], np.float64),
+                                   _concatenate_or_empty([s.concurrency for s in store_list], np.float64),
+                                   np.concatenate(opunit_offsets),
+                                   _concatenate_or_empty([s.opunits for s in store_list], np.int32),
+                                   _concatenate_or_empty(feature_rows, np.int64),
+                                   {opunit: np.concatenate(x_list) for opunit, x_list in opunit_x.items()}, info)
+    if len(store) > 0 and all(s.y_pred is not None for s in store_list):
+        store.y_pred = np.concatenate([s.y_pred for s in store_list])
+    return store
+
+
+def _concatenate_or_empty(array_list, dtype, empty_shape=(0,)):
+    if len(array_list) == 0:
+        return np.zeros(empty_shape, dtype=dtype)
+    return np.concatenate(array_list).astype(dtype, copy=False)
+
+
+def _split_metrics(metrics, info):
+    """Split the raw metrics matrix into (the targets, start times, cpu ids)
+    """
+    index_map = info.target_csv_index
+    y = np.asarray(metrics[:, -info.MINI_MODEL_TARGET_NUM:], dtype=np.float64)
+    start_time = np.asarray(metrics[:, index_map[Target.START_TIME]], dtype=np.float64)
+    cpu_id = np.asarray(metrics[:, index_map[Target.CPU_ID]]).astype(np.int32)
+    return y, start_time, cpu_id
+
+
+def _group_by_interval(start_times, interval):
+    """Group the data points by the interval their start times fall into
+
+    The groups are numbered in the order of their first appearance.
+
+    :param start_times: the start time of each data point
+    :param interval: in us
+    :return: (the group index of each data point, the rounded start time of each group, the data point indexes
+             sorted by group, the number of data points in each group)
+    """
+    with profiling_util.stage("interval_grouping"):
+        rounded_times = data_util.round_to_interval(start_times, interval)
+        unique_times, first_index, inverse = np.unique(rounded_times, return_index=True, return_inverse=True)
+        group_order = np.argsort(first_index, kind='stable')
+        group_rank = np.empty_like(group_order)
+        group_rank[group_order] = np.arange(len(group_order))
+        group_index = group_rank[inverse.reshape(-1)]
+        sorted_index = np.argsort(group_index, kind='stable')
+        group_size = np.bincount(group_index, minlength=len(group_order))
+    return group_index, unique_times[group_order], sorted_index, group_size
+
+
+def _group_sum(values, sorted_index, group_size):
+    group_start = np.concatenate(([0], np.cumsum(group_size)[:-1]))
+    return np.add.reduceat(values[sorted_index], group_start, axis=0)
+
+
+def _default_get_global_data(filename, info, sample_rate=100):
     # In the default case, the data does not need any pre-processing and the file name indicates the opunit
-    df = pd.read_csv(filename)
+    df = columnar_data.read_csv(filename)
     file_name = os.path.splitext(os.path.basename(filename))[0]
 
-    x = df.iloc[:, :-data_info.instance.METRICS_OUTPUT_NUM].values
-    y = df.iloc[:, -data_info.instance.MINI_MODEL_TARGET_NUM:].values
+    x = df.iloc[:, :-info.METRICS_OUTPUT_NUM].values.astype(np.float64)
+    metrics = df.iloc[:, -info.METRICS_OUTPUT_NUM:].values
 
-    # Construct the new data
+    # Construct the new data with one opunit per group
     opunit = OpUnit[file_name.upper()]
-    data_list = []
-
-    for i in range(x.shape[0]):
-        data_list.append(GroupedOpUnitData("{}".format(file_name), [(opunit, x[i])], y[i], sample_rate))
-    return data_list
+    n = x.shape[0]
+    y, start_time, cpu_id = _split_metrics(metrics, info)
+    return GroupedOpUnitDataStore([file_name], np.zeros(n, dtype=np.int32), y, start_time, cpu_id,
+                                  np.full(n, sample_rate, dtype=np.float64), np.zeros(n),
+                                  np.arange(n + 1, dtype=np.int64), np.full(n, opunit, dtype=np.int32),
+                                  np.arange(n, dtype=np.int64), {opunit: x}, info)
 
 
-def _txn_get_mini_runner_data(filename, txn_sample_rate):
+def _txn_get_mini_runner_data(filename, txn_sample_rate, info):
     # In the default case, the data does not need any pre-processing and the file name indicates the opunit
-    df = pd.read_csv(filename)
+    df = columnar_data.read_csv(filename)
     file_name = os.path.splitext(os.path.basename(filename))[0]
 
     # prepending a column of ones as the base transaction data feature
     base_x = pd.DataFrame(data=np.ones((df.shape[0], 1), dtype=int))
     df = pd.concat([base_x, df], axis=1)
-    x = df.iloc[:, :-data_info.instance.METRICS_OUTPUT_NUM].values
-    y = df.iloc[:, -data_info.instance.MINI_MODEL_TARGET_NUM:].values
-    start_times = df.iloc[:, data_info.instance.target_csv_index[data_info.instance.Target.START_TIME]].values
-    cpu_ids = df.iloc[:, data_info.instance.target_csv_index[data_info.instance.Target.CPU_ID]].values
+    x = df.iloc[:, :-info.METRICS_OUTPUT_NUM].values.astype(np.float64)
+    y = df.iloc[:, -info.MINI_MODEL_TARGET_NUM:].values.astype(np.float64)
+    start_times = df.iloc[:, info.target_csv_index[Target.START_TIME]].values
+    cpu_ids = df.iloc[:, info.target_csv_index[Target.CPU_ID]].values
 
     logging.info("Loaded file: {}".format(OpUnit[file_name.upper()]))
 
-    interval = data_info.instance.CONTENDING_OPUNIT_INTERVAL
+    interval = info.CONTENDING_OPUNIT_INTERVAL
 
-    # Map from interval start time to the data in this interval
-    interval_x_map = {}
-    interval_y_map = {}
-    interval_cpu_id_map = {}
-    interval_start_time_map = {}
-    n = x.shape[0]
-    for i in tqdm.tqdm(list(range(n)), desc="Group data by interval"):
-        rounded_time = data_util.round_to_interval(start_times[i], interval)
-        if rounded_time not in interval_x_map:
-            interval_x_map[rounded_time] = []
-            interval_y_map[rounded_time] = []
-            interval_cpu_id_map[rounded_time] = []
-            interval_start_time_map[rounded_time] = []
-        interval_x_map[rounded_time].append(x[i])
-        interval_y_map[rounded_time].append(y[i])
-        interval_cpu_id_map[rounded_time].append(cpu_ids[i])
-        interval_start_time_map[rounded_time].append(start_times[i])
-
-    # Construct the new data
+    # Group the data by interval
+    group_index, _, sorted_index, group_size = _group_by_interval(start_times, interval)
+    num_groups = len(group_size)
+
+    # Sum the features
+    x_new = _group_sum(x, sorted_index, group_size)
+    # Concatenate the number of different threads
+    thread_groups = np.unique(np.stack((group_index, cpu_ids)), axis=1)[0]
+    x_new = np.concatenate((x_new, np.bincount(thread_groups, minlength=num_groups)[:, np.newaxis]), axis=1)
+    if txn_sample_rate > 0:
+        x_new *= 100 / txn_sample_rate
+    # The prediction is the average behavior
+    y_new = _group_sum(y, sorted_index, group_size) / group_size[:, np.newaxis]
+
+    # Every data point in the interval shares the new feature (and the average behavior), but keeps its own start time
+    # and cpu id
     opunit = OpUnit[file_name.upper()]
-    data_list = []
-    for rounded_time in interval_x_map:
-        # Sum the features
-        x_new = np.sum(interval_x_map[rounded_time], axis=0)
-        # Concatenate the number of different threads
-        x_new = np.concatenate((x_new, [len(set(interval_cpu_id_map[rounded_time]))]))
-        if txn_sample_rate > 0:
-            x_new *= 100 / txn_sample_rate
-        # Change all the opunits in the group for this interval to be the new feature
-        opunits = [(opunit, x_new)]
-        # The prediction is the average behavior
-        y_new = np.average(interval_y_map[rounded_time], axis=0)
-        n = len(interval_x_map[rounded_time])
-        for i in range(n):
-            metrics = np.concatenate(([interval_start_time_map[rounded_time][i]],
-                                      [interval_cpu_id_map[rounded_time][i]],
-                                      y_new))
-            data_list.append(GroupedOpUnitData("{}".format(file_name), opunits, metrics, txn_sample_rate))
-
-    return data_list
-
-
-def _pipeline_get_grouped_op_unit_data(filename, warmup_period, ee_sample_rate):
+    n = len(sorted_index)
+    sorted_group_index = group_index[sorted_index]
+    return GroupedOpUnitDataStore([file_name], np.zeros(n, dtype=np.int32), y_new[sorted_group_index],
+                                  start_times[sorted_index].astype(np.float64),
+                                  cpu_ids[sorted_index].astype(np.int32),
+                                  np.full(n, txn_sample_rate, dtype=np.float64), np.zeros(n),
+                                  np.arange(n + 1, dtype=np.int64), np.full(n, opunit, dtype=np.int32),
+                                  sorted_group_index.astype(np.int64), {opunit: x_new}, info)
+
+
+def get_pipeline_chunk_ranges(filename, chunk_size):
+    """Split a pipeline data file into byte ranges of whole lines that can be loaded independently
+
+    :param filename: the pipeline data file
+    :param chunk_size: the approximate number of bytes per chunk
+    :return: the list of (begin, end) byte offsets that cover all the data lines (excluding the header)
+    """
+    if filename.endswith(columnar_data.COLUMNAR_SUFFIX):
+        # A columnar file without its CSV file is loaded in one chunk
+        return [(0, np.iinfo(np.int64).max)]
+
+    ranges = []
+    with open(filename, "rb") as f:
+        f.readline()
+        begin = f.tell()
+        file_size = os.fstat(f.fileno()).st_size
+        while begin < file_size:
+            # Align the end of the chunk to the end of a line
+            f.seek(min(begin + chunk_size, file_size))
+            if f.tell() < file_size:
+                f.readline()
+            end = f.tell()
+            ranges.append((begin, end))
+            begin = end
+    return ranges
+
+
+def _pipeline_get_grouped_op_unit_data(filename, warmup_period, ee_sample_rate, info, byte_range=None):
     # Get the global running data for the execution engine
-    start_time = None
-
-    data_list = []
-    with open(filename, "r") as f:
-        reader = csv.reader(f, delimiter=",", skipinitialspace=True)
-        next(reader)
-        features_vector_index = data_info.instance.raw_features_csv_index[ExecutionFeature.FEATURES]
-        input_output_boundary = data_info.instance.raw_features_csv_index[data_info.instance.INPUT_OUTPUT_BOUNDARY]
-        input_end_boundary = len(data_info.instance.input_csv_index)
-
-        for line in reader:
-            # extract the time
-            cpu_time = line[data_info.instance.raw_target_csv_index[Target.START_TIME]]
-            if start_time is None:
-                start_time = cpu_time
-
-            if int(cpu_time) - int(start_time) < warmup_period * 1000000:
+    _, reader = columnar_data.read_rows(filename)
+    first_line = next(reader, None)
+    reader.close()
+    if first_line is None:
+        return _GroupedOpUnitDataStoreBuilder(info).build()
+    # The warmup period is always relative to the first data point in the file
+    start_time = first_line[info.raw_target_csv_index[Target.START_TIME]]
+
+    builder = _GroupedOpUnitDataStoreBuilder(info)
+    _, reader = columnar_data.read_rows(filename, byte_range)
+    _pipeline_append_lines(builder, reader, start_time, warmup_period, ee_sample_rate, info)
+
+    return builder.build()
+
+
+def _pipeline_append_lines(builder, reader, start_time, warmup_period, ee_sample_rate, info):
+    features_vector_index = info.raw_features_csv_index[ExecutionFeature.FEATURES]
+    input_output_boundary = info.raw_features_csv_index[info.INPUT_OUTPUT_BOUNDARY]
+    input_end_boundary = len(info.input_csv_index)
+
+    for line in reader:
+        # extract the time
+        cpu_time = line[info.raw_target_csv_index[Target.START_TIME]]
+
+        if int(cpu_time) - int(start_time) < warmup_period * 1000000:
+            continue
+
+        sample_rate = ee_sample_rate
+
+        # drop query_id, pipeline_id, num_features, features_vector
+        data = [d for i, d in enumerate(line) if i >= input_output_boundary]
+        x_multiple = data[:input_end_boundary]
+        metrics = data[-info.METRICS_OUTPUT_NUM:]
+
+        # Get the opunits located within
+        opunits = []
+        features = line[features_vector_index].split(';')
+        concurrency = 0
+        for idx, feature in enumerate(features):
+            opunit = OpUnit[feature]
+            x_loc = [v[idx] if type(v) == list else v for v in x_multiple]
+            if x_loc[info.input_csv_index[ExecutionFeature.NUM_ROWS]] == 0:
+                logging.info("Skipping {} OU with 0 tuple num".format(opunit.name))
                 continue
 
-            sample_rate = ee_sample_rate
-
-            # drop query_id, pipeline_id, num_features, features_vector
-            record = [d for i, d in enumerate(line) if i >= input_output_boundary]
-            data = list(map(data_util.convert_string_to_numeric, record))
-            x_multiple = data[:input_end_boundary]
-            metrics = np.array(data[-data_info.instance.METRICS_OUTPUT_NUM:])
-
-            # Get the opunits located within
-            opunits = []
-            features = line[features_vector_index].split(';')
-            concurrency = 0
-            for idx, feature in enumerate(features):
-                opunit = OpUnit[feature]
-                x_loc = [v[idx] if type(v) == list else v for v in x_multiple]
-                if x_loc[data_info.instance.input_csv_index[ExecutionFeature.NUM_ROWS]] == 0:
-                    logging.info("Skipping {} OU with 0 tuple num".format(opunit.name))
-                    continue
-
-                if opunit == OpUnit.CREATE_INDEX:
-                    concurrency = x_loc[data_info.instance.CONCURRENCY_INDEX]
-                    # TODO(lin): we won't do sampling for CREATE_INDEX. We probably should encapsulate this when
-                    #  generating the data
-                    sample_rate = 100
-
-                # TODO(lin): skip the main thing for interference model for now
-                if opunit == OpUnit.CREATE_INDEX_MAIN:
-                    continue
-
-                opunits.append((opunit, x_loc))
-
-            if len(opunits) == 0:
+            if opunit == OpUnit.CREATE_INDEX:
+                concurrency = x_loc[info.input_csv_index[ExecutionFeature.NUM_CONCURRENT]]
+                # TODO(lin): we won't do sampling for CREATE_INDEX. We probably should encapsulate this when
+                #  generating the data
+                sample_rate = 100
+
+            # TODO(lin): skip the main thing for interference model for now
+            if opunit == OpUnit.CREATE_INDEX_MAIN:
                 continue
 
-            # TODO(lin): Again, we won't do sampling for TPCH queries (with the assumption that the query id < 10).
-            #  Should encapsulate this wit the metrics
-            if int(line[0]) < 10:
-                sample_rate = 100
+            opunits.append((opunit, x_loc))
+
+        if len(opunits) == 0:
+            continue
 
-            data_list.append(GroupedOpUnitData("q{} p{}".format(line[0], line[1]), opunits, np.array(metrics),
-                                               sample_rate, concurrency))
+        # TODO(lin): Again, we won't do sampling for TPCH queries (with the assumption that the query id < 10).
+        #  Should encapsulate this wit the metrics
+        if int(line[0]) < 10:
+            sample_rate = 100
 
-    return data_list
+        builder.append("q{} p{}".format(line[0], line[1]), opunits, metrics, sample_rate, concurrency)
 
 
-def _interval_get_grouped_op_unit_data(filename):
+def _interval_get_grouped_op_unit_data(filename, info):
     # In the default case, the data does not need any pre-processing and the file name indicates the opunit
-    df = pd.read_csv(filename, skipinitialspace=True)
+    df = columnar_data.read_csv(filename, skipinitialspace=True)
     file_name = os.path.splitext(os.path.basename(filename))[0]
 
-    x = df.iloc[:, :-data_info.instance.METRICS_OUTPUT_NUM].values
-    y = df.iloc[:, -data_info.instance.MINI_MODEL_TARGET_NUM:].values
-    start_times = df.iloc[:, data_info.instance.target_csv_index[Target.START_TIME]].values
-    cpu_ids = df.iloc[:, data_info.instance.target_csv_index[Target.CPU_ID]].values
-    interval = data_info.instance.PERIODIC_OPUNIT_INTERVAL
-
-    # Map from interval start time to the data in this interval
-    interval_x_map = {}
-    interval_y_map = {}
-    interval_cpu_map = {}
-    n = x.shape[0]
-    for i in tqdm.tqdm(list(range(n)), desc="Group data by interval"):
-        rounded_time = data_util.round_to_interval(start_times[i], interval)
-        if rounded_time not in interval_x_map:
-            interval_x_map[rounded_time] = []
-            interval_y_map[rounded_time] = []
-        interval_x_map[rounded_time].append(x[i])
-        interval_y_map[rounded_time].append(y[i])
-        interval_cpu_map[rounded_time] = cpu_ids[i]
-
-    # Construct the new data
+    x = df.iloc[:, :-info.METRICS_OUTPUT_NUM].values.astype(np.float64)
+    y = df.iloc[:, -info.MINI_MODEL_TARGET_NUM:].values.astype(np.float64)
+    start_times = df.iloc[:, info.target_csv_index[Target.START_TIME]].values
+    cpu_ids = df.iloc[:, info.target_csv_index[Target.CPU_ID]].values
+    interval = info.PERIODIC_OPUNIT_INTERVAL
+
+    # Group the data by interval
+    group_index, group_time, sorted_index, group_size = _group_by_interval(start_times, interval)
+
+    # Sum the features
+    x_new = _group_sum(x, sorted_index, group_size)
+    # Keep the interval parameter the same
+    # TODO: currently the interval parameter is always the last. Change the hard-coding later
+    x_new[:, -1] /= group_size
+    # The prediction is the average behavior
+    y_new = _group_sum(y, sorted_index, group_size) / group_size[:, np.newaxis]
+    # The cpu id of an interval is the one of the last data point in it
+    last_index = np.zeros(len(group_size), dtype=np.int64)
+    np.maximum.at(last_index, group_index, np.arange(len(group_index)))
+
+    # Every data point in the interval shares the new feature (and the average behavior), and the data points are
+    # evenly spread across the interval
     opunit = OpUnit[file_name.upper()]
-    data_list = []
-    for rounded_time in interval_x_map:
-        # Sum the features
-        x_new = np.sum(interval_x_map[rounded_time], axis=0)
-        # Keep the interval parameter the same
-        # TODO: currently the interval parameter is always the last. Change the hard-coding later
-        x_new[-1] /= len(interval_x_map[rounded_time])
-        # Change all the opunits in the group for this interval to be the new feature
-        opunits = [(opunit, x_new)]
-        # The prediction is the average behavior
-        y_new = np.average(interval_y_map[rounded_time], axis=0)
-        n = len(interval_x_map[rounded_time])
-        for i in range(n):
-            metrics = np.concatenate(([rounded_time + i * interval // n], [interval_cpu_map[rounded_time]], y_new))
-            data_list.append(GroupedOpUnitData("{}".format(file_name), opunits, metrics))
-
-    return data_list
+    n = len(sorted_index)
+    sorted_group_index = group_index[sorted_index]
+    group_start = np.concatenate(([0], np.cumsum(group_size)[:-1]))
+    position = np.arange(n) - group_start[sorted_group_index]
+    new_start_times = group_time[sorted_group_index] + position * interval // group_size[sorted_group_index]
+    return GroupedOpUnitDataStore([file_name], np.zeros(n, dtype=np.int32), y_new[sorted_group_index],
+                                  new_start_times.astype(np.float64),
+                                  cpu_ids[last_index][sorted_group_index].astype(np.int32),
+                                  np.full(n, 100, dtype=np.float64), np.zeros(n),
+                                  np.arange(n + 1, dtype=np.int64), np.full(n, opunit, dtype=np.int32),
+                                  sorted_group_index.astype(np.int64), {opunit: x_new}, info)
+
+
+class GroupedOpUnitDataStore:
+    """
+    The columnar storage of a collection of GroupedOpUnitData
 
+    The per-group information is stored as parallel arrays. The opunits in the groups are stored in a CSR-style ragged
+    layout: the opunits of group i are the entries in [opunit_offsets[i], opunit_offsets[i + 1]), and the input feature
+    of entry j is the row feature_rows[j] in the feature matrix opunit_x[opunits[j]]. Different groups may share the
+    same feature row.
+    """
 
-class GroupedOpUnitData:
+    def __init__(self, name_list, name_codes, y, start_time, cpu_id, sample_rate, concurrency, opunit_offsets,
+                 opunits, feature_rows, opunit_x, info):
+        """
+        :param name_list: The list of distinct data point names (e.g., could be the pipeline identifier)
+        :param name_codes: The index of the name in name_list for each group
+        :param y: The runtime metrics (targets) for each group
+        :param start_time: The start time for each group
+        :param cpu_id: The cpu id for each group
+        :param sample_rate: The sampling rate for each group
+        :param concurrency: The number of concurrency for each contending (parallel) group
+        :param opunit_offsets: The offsets of the opunits of each group in opunits and feature_rows
+        :param opunits: The opunit of each entry
+        :param feature_rows: The row of each entry in the feature matrix of its opunit
+        :param opunit_x: The map from opunit to its input feature matrix
+        :param info: The DataInfo of the data (i.e., of the ou models that predict it)
+        """
+        self.name_list = name_list
+        self.name_codes = name_codes
+        self.y = y
+        self.y_pred = None
+        self.start_time = start_time
+        self.end_time = start_time + y[:, info.target_csv_index[Target.ELAPSED_US]] - 1
+        self.cpu_id = cpu_id
+        self.sample_rate = sample_rate
+        self.concurrency = concurrency
+        self.opunit_offsets = opunit_offsets
+        self.opunits = opunits
+        self.feature_rows = feature_rows
+        self.opunit_x = opunit_x
+        self.info = info
+
+    def __len__(self):
+        return len(self.start_time)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("GroupedOpUnitDataStore index out of range")
+        return GroupedOpUnitData(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield GroupedOpUnitData(self, i)
+
+    def get_names(self):
+        """Get the name of each group
+
+        :return: the list of names
+        """
+        return [self.name_list[code] for code in self.name_codes]
+
+    def get_start_time(self, concurrent_counting_mode):
+        """Get the start times of all the groups for counting the concurrent operations
+
+        :param concurrent_counting_mode: ConcurrentCountingMode type
+        :return: the start time array
+        """
+        start_time = None
+        if concurrent_counting_mode is ConcurrentCountingMode.EXACT:
+            start_time = self.start_time
+        if concurrent_counting_mode is ConcurrentCountingMode.ESTIMATED:
+            start_time = self.start_time
+        if concurrent_counting_mode is ConcurrentCountingMode.INTERVAL:
+            start_time = self.start_time + interference_model_config.INTERVAL_START
+        return start_time
+
+    def get_end_time(self, concurrent_counting_mode):
+        """Get the end times of all the groups for counting the concurrent operations
+
+        :param concurrent_counting_mode: ConcurrentCountingMode type
+        :return: the end time array
+        """
+        end_time = None
+        if concurrent_counting_mode is ConcurrentCountingMode.EXACT:
+            end_time = self.end_time
+        if concurrent_counting_mode is ConcurrentCountingMode.ESTIMATED:
+            end_time = self.start_time + self.y_pred[:, self.info.target_csv_index[Target.ELAPSED_US]] - 1
+        if concurrent_counting_mode is ConcurrentCountingMode.INTERVAL:
+            end_time = (self.start_time + interference_model_config.INTERVAL_START +
+                        interference_model_config.INTERVAL_SIZE)
+        return end_time
+
+    def take(self, indices):
+        """Get a new store with the groups at the given indices
+
+        Only the names and the feature rows used by the selected groups are kept in the new store.
+
+        :param indices: the indices of the groups to select (in the order of the new store)
+        :return: the GroupedOpUnitDataStore with the selected groups
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        entry_begin = self.opunit_offsets[indices]
+        entry_num = self.opunit_offsets[indices + 1] - entry_begin
+        opunit_offsets = np.concatenate(([0], np.cumsum(entry_num))).astype(np.int64)
+        entries = np.repeat(entry_begin - opunit_offsets[:-1], entry_num) + np.arange(opunit_offsets[-1])
+        opunits = self.opunits[entries]
+
+        # Compact the feature matrices to the rows still in use
+        rows = self.feature_rows[entries]
+        feature_rows = np.empty_like(rows)
+        opunit_x = {}
+        for opunit, x in self.opunit_x.items():
+            mask = opunits == opunit
+            if mask.any():
+                used_rows, feature_rows[mask] = np.unique(rows[mask], return_inverse=True)
+                opunit_x[opunit] = x[used_rows]
+
+        used_codes, name_codes = np.unique(self.name_codes[indices], return_inverse=True)
+        store = GroupedOpUnitDataStore([self.name_list[code] for code in used_codes], name_codes.astype(np.int32),
+                                       self.y[indices], self.start_time[indices], self.cpu_id[indices],
+                                       self.sample_rate[indices], self.concurrency[indices], opunit_offsets, opunits,
+                                       feature_rows, opunit_x, self.info)
+        if self.y_pred is not None:
+            store.y_pred = self.y_pred[indices]
+        return store
+
+
+class _GroupedOpUnitDataStoreBuilder:
     """
-    The class that stores the information about a group of operating units measured together
+    Accumulate the groups one by one (e.g., when parsing the rows of a file) and build a GroupedOpUnitDataStore
     """
 
-    def __init__(self, name, opunit_features, metrics, sample_rate=100, concurrency=0):
+    def __init__(self, info):
+        """
+        :param info: The DataInfo of the data
+        """
+        self._info = info
+        self._name_list = []
+        self._name_code_map = {}
+        self._name_codes = []
+        self._metrics = []
+        self._sample_rate = []
+        self._concurrency = []
+        self._opunit_offsets = [0]
+        self._opunits = []
+        self._feature_rows = []
+        self._opunit_x = {}
+
+    def append(self, name, opunit_features, metrics, sample_rate=100, concurrency=0):
         """
         :param name: The name of the data point (e.g., could be the pipeline identifier)
         :param opunit_features: The list of opunits and their inputs for this event
@@ -241,16 +521,102 @@ class GroupedOpUnitData:
         :param sample_rate: The sampling rate for this OU group
         :param concurrency: The number of concurrency for this contending (parallel) OU group
         """
-        self.name = name
-        self.opunit_features = opunit_features
-        self.y = metrics[-data_info.instance.MINI_MODEL_TARGET_NUM:]
-        self.y_pred = None
-        index_map = data_info.instance.target_csv_index
-        self.start_time = metrics[index_map[Target.START_TIME]]
-        self.end_time = self.start_time + self.y[index_map[Target.ELAPSED_US]] - 1
-        self.cpu_id = int(metrics[index_map[Target.CPU_ID]])
-        self.sample_rate = sample_rate
-        self.concurrency = concurrency
+        if name not in self._name_code_map:
+            self._name_code_map[name] = len(self._name_list)
+            self._name_list.append(name)
+        self._name_codes.append(self._name_code_map[name])
+        self._metrics.append(metrics)
+        self._sample_rate.append(sample_rate)
+        self._concurrency.append(concurrency)
+        for opunit, x in opunit_features:
+            x_list = self._opunit_x.setdefault(opunit, [])
+            self._opunits.append(opunit)
+            self._feature_rows.append(len(x_list))
+            x_list.append(x)
+        self._opunit_offsets.append(len(self._opunits))
+
+    def build(self):
+        """
+        :return: the GroupedOpUnitDataStore with all the appended groups
+        """
+        metrics = np.array(self._metrics, dtype=np.float64).reshape(len(self._metrics), -1)
+        if metrics.shape[1] == 0:
+            metrics = np.zeros((0, self._info.METRICS_OUTPUT_NUM))
+        y, start_time, cpu_id = _split_metrics(metrics, self._info)
+        return GroupedOpUnitDataStore(self._name_list, np.array(self._name_codes, dtype=np.int32), y, start_time,
+                                      cpu_id, np.array(self._sample_rate, dtype=np.float64),
+                                      np.array(self._concurrency, dtype=np.float64),
+                                      np.array(self._opunit_offsets, dtype=np.int64),
+                                      np.array(self._opunits, dtype=np.int32),
+                                      np.array(self._feature_rows, dtype=np.int64),
+                                      {opunit: np.array(x_list, dtype=np.float64)
+                                       for opunit, x_list in self._opunit_x.items()}, self._info)
+
+
+class GroupedOpUnitData:
+    """
+    The class that stores the information about a group of operating units measured together
+
+    This is a lightweight view of one group in a GroupedOpUnitDataStore.
+    """
+
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store, index):
+        """
+        :param store: The GroupedOpUnitDataStore that stores the group
+        :param index: The index of the group in the store
+        """
+        self._store = store
+        self._index = index
+
+    @property
+    def name(self):
+        return self._store.name_list[self._store.name_codes[self._index]]
+
+    @property
+    def opunit_features(self):
+        store = self._store
+        begin = store.opunit_offsets[self._index]
+        end = store.opunit_offsets[self._index + 1]
+        return [(OpUnit(store.opunits[j]), store.opunit_x[store.opunits[j]][store.feature_rows[j]])
+                for j in range(begin, end)]
+
+    @property
+    def y(self):
+        return self._store.y[self._index]
+
+    @property
+    def y_pred(self):
+        if self._store.y_pred is None:
+            return None
+        return self._store.y_pred[self._index]
+
+    @y_pred.setter
+    def y_pred(self, y_pred):
+        if self._store.y_pred is None:
+            self._store.y_pred = np.full(self._store.y.shape, np.nan)
+        self._store.y_pred[self._index] = y_pred
+
+    @property
+    def start_time(self):
+        return self._store.start_time[self._index]
+
+    @property
+    def end_time(self):
+        return self._store.end_time[self._index]
+
+    @property
+    def cpu_id(self):
+        return int(self._store.cpu_id[self._index])
+
+    @property
+    def sample_rate(self):
+        return self._store.sample_rate[self._index]
+
+    @property
+    def concurrency(self):
+        return self._store.concurrency[self._index]
 
     def get_start_time(self, concurrent_counting_mode):
         """Get the start time for this group for counting the concurrent operations
@@ -277,7 +643,7 @@ class GroupedOpUnitData:
         if concurrent_counting_mode is ConcurrentCountingMode.EXACT:
             end_time = self.end_time
         if concurrent_counting_mode is ConcurrentCountingMode.ESTIMATED:
-            end_time = self.start_time + self.y_pred[data_info.instance.target_csv_index[Target.ELAPSED_US]] - 1
+            end_time = self.start_time + self.y_pred[self._store.info.target_csv_index[Target.ELAPSED_US]] - 1
         if concurrent_counting_mode is ConcurrentCountingMode.INTERVAL:
             end_time = self.start_time + interference_model_config.INTERVAL_START + interference_model_config.INTERVAL_SIZE
         return end_time
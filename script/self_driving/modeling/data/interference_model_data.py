@@ -3,53 +3,185 @@ import numpy as np
 from ..info import hardware_info
 
 
-class InterferenceImpactData:
+class InterferenceImpactDataStore:
     """
-    The class used to store the information for the interference impact model training and prediction
+    The columnar storage of the InterferenceImpactData for all the groups in a GroupedOpUnitDataStore
+
+    The resource data of the groups are stored in a CSR-style ragged layout: the InterferenceResourceData that group i
+    overlaps with are the rows resource_indices[resource_offsets[i]:resource_offsets[i + 1]] in the resource store.
     """
 
-    def __init__(self, data, resource_data_list):
+    def __init__(self, grouped_op_unit_data, resource_data, resource_offsets, resource_indices):
         """
-        :param data: The target GroupedOpUnitData to measure and predict
-        :param resource_data_list: The InterferenceResourceData list in the interval that the target GroupedOpUnitData
-                overlap with
+        :param grouped_op_unit_data: The GroupedOpUnitDataStore with the target groups to measure and predict
+        :param resource_data: The InterferenceResourceDataStore with the intervals that the target groups overlap with
+        :param resource_offsets: The offsets of the resource data of each group in resource_indices
+        :param resource_indices: The index of the InterferenceResourceData in resource_data for each overlap
         """
-        self.target_grouped_op_unit_data = data
-        self.resource_data_list = resource_data_list
+        self.grouped_op_unit_data = grouped_op_unit_data
+        self.resource_data = resource_data
+        self.resource_offsets = resource_offsets
+        self.resource_indices = resource_indices
+        self.resource_num = np.diff(resource_offsets)
 
         # Derive the same_core_x feature
-        cpu_id = data.cpu_id
+        cpu_id = grouped_op_unit_data.cpu_id
         physical_core_num = hardware_info.PHYSICAL_CORE_NUM
-        same_core_x_list = [d.x_list[cpu_id - physical_core_num if cpu_id > physical_core_num else cpu_id] for d
-                            in resource_data_list]
-        same_core_x = np.average(same_core_x_list, axis=0)
-        self.resource_util_same_core_x = same_core_x
+        core_id = np.where(cpu_id > physical_core_num, cpu_id - physical_core_num, cpu_id)
+        overlap_core_id = np.repeat(core_id, self.resource_num)
+        self.resource_util_same_core_x = self._average(resource_data.x_list[resource_indices, overlap_core_id])
 
         # Derive the x feature
-        x_list = [d.x for d in resource_data_list]
-        x = np.average(x_list, axis=0)
-        self.x = x
+        self.x = self._average(resource_data.x[resource_indices])
+
+    def __len__(self):
+        return len(self.resource_num)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("InterferenceImpactDataStore index out of range")
+        return InterferenceImpactData(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield InterferenceImpactData(self, i)
 
     def get_y_pred(self):
-        y_pred_list = [d.y_pred for d in self.resource_data_list]
+        """Get the average predicted resource utilization of the intervals that each group overlaps with
+
+        :return: the average y_pred for each group
+        """
+        return self._average(self.resource_data.y_pred[self.resource_indices])
+
+    def _average(self, overlap_values):
+        # Average the values of the overlapping resource data for each group
+        values = np.zeros((len(self),) + overlap_values.shape[1:])
+        np.add.at(values, np.repeat(np.arange(len(self)), self.resource_num), overlap_values)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return values / self.resource_num.reshape((-1,) + (1,) * (values.ndim - 1))
+
+
+class InterferenceImpactData:
+    """
+    The class used to store the information for the interference impact model training and prediction
+
+    This is a lightweight view of one group in an InterferenceImpactDataStore.
+    """
+
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store, index):
+        """
+        :param store: The InterferenceImpactDataStore that stores the data
+        :param index: The index of the target GroupedOpUnitData in the store
+        """
+        self._store = store
+        self._index = index
+
+    @property
+    def target_grouped_op_unit_data(self):
+        return self._store.grouped_op_unit_data[self._index]
+
+    @property
+    def resource_data_list(self):
+        store = self._store
+        begin = store.resource_offsets[self._index]
+        end = store.resource_offsets[self._index + 1]
+        return [store.resource_data[i] for i in store.resource_indices[begin:end]]
+
+    @property
+    def resource_util_same_core_x(self):
+        return self._store.resource_util_same_core_x[self._index]
+
+    @property
+    def x(self):
+        return self._store.x[self._index]
+
+    def get_y_pred(self):
+        store = self._store
+        begin = store.resource_offsets[self._index]
+        end = store.resource_offsets[self._index + 1]
+        y_pred_list = store.resource_data.y_pred[store.resource_indices[begin:end]]
         y_pred = np.average(y_pred_list, axis=0)
         return y_pred
 
 
-class InterferenceResourceData:
+class InterferenceResourceDataStore:
     """
-    The class used to store the information for the interference resource model training and prediction
+    The columnar storage of the InterferenceResourceData for all the intervals
     """
 
     def __init__(self, start_time, x_list, x, y):
         """
-        :param start_time: for the interval to measure the resource
-        :param x_list: the list of normalized estimated resource usage per core
-        :param x: input feature to predict y
-        :param y: the normalized estimated total resource numbers
+        :param start_time: for the intervals to measure the resource
+        :param x_list: the normalized estimated resource usage per core for each interval
+        :param x: input feature to predict y for each interval
+        :param y: the normalized estimated total resource numbers for each interval
         """
         self.start_time = start_time
         self.x_list = x_list
         self.x = x
         self.y = y
         self.y_pred = None
+
+    def __len__(self):
+        return len(self.start_time)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("InterferenceResourceDataStore index out of range")
+        return InterferenceResourceData(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield InterferenceResourceData(self, i)
+
+
+class InterferenceResourceData:
+    """
+    The class used to store the information for the interference resource model training and prediction
+
+    This is a lightweight view of one interval in an InterferenceResourceDataStore.
+    """
+
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store, index):
+        """
+        :param store: The InterferenceResourceDataStore that stores the data
+        :param index: The index of the interval in the store
+        """
+        self._store = store
+        self._index = index
+
+    @property
+    def start_time(self):
+        return self._store.start_time[self._index]
+
+    @property
+    def x_list(self):
+        return self._store.x_list[self._index]
+
+    @property
+    def x(self):
+        return self._store.x[self._index]
+
+    @property
+    def y(self):
+        return self._store.y[self._index]
+
+    @property
+    def y_pred(self):
+        if self._store.y_pred is None:
+            return None
+        return self._store.y_pred[self._index]
+
+    @y_pred.setter
+    def y_pred(self, y_pred):
+        if self._store.y_pred is None:
+            self._store.y_pred = np.full(self._store.y.shape, np.nan)
+        self._store.y_pred[self._index] = y_pred
@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 
-import csv
 import numpy as np
 import pandas as pd
 import os
@@ -8,9 +7,9 @@ import logging
 import tqdm
 import math
 
-from . import data_util
+from . import columnar_data, data_util
 from ..info import data_info
-from ..util import io_util
+from ..util import io_util, profiling_util
 from ..type import OpUnit, Target, ExecutionFeature
 
 
@@ -23,7 +22,8 @@ def write_extended_data(output_path, symbol, index_value_list, data_map):
         io_util.write_csv_result(output_path, key, value)
 
 
-def get_ou_runner_data(filename, model_results_path, txn_sample_rate, model_map={}, predict_cache={}, trim=0.2):
+def get_ou_runner_data(filename, model_results_path, txn_sample_rate, model_map={}, predict_cache={}, trim=0.2,
+                       chunk_size=None, max_rows=None, info=None):
     """Get the training data from the ou runner
 
     :param filename: the input data file
@@ -32,47 +32,108 @@ def get_ou_runner_data(filename, model_results_path, txn_sample_rate, model_map=
     :param model_map: the map from OpUnit to the ou model
     :param predict_cache: cache for the ou model prediction
     :param trim: % of too high/too low anomalies to prune
+    :param chunk_size: if not None, the files that need no pre-processing are read in chunks of this many rows into
+           float32 arrays
+    :param max_rows: if not None (with chunk_size), the files that need no pre-processing and have more rows are
+           sampled down to this many rows (the full data can be streamed with iterate_ou_runner_chunks())
+    :param info: the DataInfo to parse the header of the file into (None to use the global data_info.instance)
     :return: the list of Data for execution operating units
     """
+    if info is None:
+        info = data_info.instance
 
     if "txn" in filename:
         # Cannot handle the transaction manager data yet
-        return _txn_get_ou_runner_data(filename, model_results_path, txn_sample_rate)
+        return _txn_get_ou_runner_data(filename, model_results_path, txn_sample_rate, info)
     if "execution" in filename:
         # Handle the execution data
-        return _execution_get_ou_runner_data(filename, model_map, predict_cache, trim)
+        return _execution_get_ou_runner_data(filename, model_map, predict_cache, trim, info)
     if "gc" in filename or "log" in filename:
         # Handle of the gc or log data with interval-based conversion
-        return _interval_get_ou_runner_data(filename, model_results_path)
+        return _interval_get_ou_runner_data(filename, model_results_path, info)
 
-    return _default_get_ou_runner_data(filename)
+    if chunk_size is not None:
+        return _chunked_get_ou_runner_data(filename, chunk_size, max_rows, info)
+    return _default_get_ou_runner_data(filename, info)
 
 
-def _default_get_ou_runner_data(filename):
+def iterate_ou_runner_chunks(filename, chunk_size, info=None):
+    """Iterate over the training data of an ou runner file that needs no pre-processing in chunks of rows
+
+    :param filename: the input data file
+    :param chunk_size: the number of rows in each chunk
+    :param info: the DataInfo of the file (None to use the global data_info.instance)
+    :return: the generator of the (x, y) float32 chunks
+    """
+    if info is None:
+        info = data_info.instance
+    columnar_file = columnar_data.get_columnar_file(filename)
+    if columnar_file is None:
+        chunks = data_util.iterate_csv_chunks(filename, chunk_size)
+    else:
+        chunks = (columnar_file.to_float32(slice(begin, begin + chunk_size))
+                  for begin in range(0, columnar_file.row_num, chunk_size))
+    for chunk in chunks:
+        yield chunk[:, :-info.METRICS_OUTPUT_NUM], chunk[:, -info.MINI_MODEL_TARGET_NUM:]
+
+
+def _chunked_get_ou_runner_data(filename, chunk_size, max_rows, info):
+    # The default case with bounded memory: the file is parsed in chunks into one float32 array, and x and y are views
+    # of the array (no copies)
+    columnar_file = columnar_data.get_columnar_file(filename)
+    if columnar_file is None:
+        with profiling_util.stage("parse_header"):
+            info.parse_csv_header(data_util.read_csv_header(filename), False)
+        row_num = data_util.count_csv_rows(filename)
+    else:
+        with profiling_util.stage("parse_header"):
+            info.parse_csv_header(columnar_file.header, False)
+        row_num = columnar_file.row_num
+    file_name = os.path.splitext(os.path.basename(filename))[0]
+
+    rows = None
+    source = None
+    if max_rows is not None and row_num > max_rows:
+        rows = np.sort(np.random.default_rng(0).choice(row_num, max_rows, replace=False))
+        source = filename
+        logging.info("Sampled {} of the {} rows in {}".format(max_rows, row_num, filename))
+
+    if columnar_file is None:
+        data = data_util.read_csv_float32(filename, chunk_size, rows)
+    else:
+        data = columnar_file.to_float32(slice(None) if rows is None else rows)
+    x = data[:, :-info.METRICS_OUTPUT_NUM]
+    y = data[:, -info.MINI_MODEL_TARGET_NUM:]
+
+    return [OpUnitData(OpUnit[file_name.upper()], x, y, source)]
+
+
+def _default_get_ou_runner_data(filename, info):
     # In the default case, the data does not need any pre-processing and the file name indicates the opunit
-    df = pd.read_csv(filename, skipinitialspace=True)
+    df = columnar_data.read_csv(filename, skipinitialspace=True)
     headers = list(df.columns.values)
-    data_info.instance.parse_csv_header(headers, False)
+    with profiling_util.stage("parse_header"):
+        info.parse_csv_header(headers, False)
     file_name = os.path.splitext(os.path.basename(filename))[0]
 
-    x = df.iloc[:, :-data_info.instance.METRICS_OUTPUT_NUM].values
-    y = df.iloc[:, -data_info.instance.MINI_MODEL_TARGET_NUM:].values
+    x = df.iloc[:, :-info.METRICS_OUTPUT_NUM].values
+    y = df.iloc[:, -info.MINI_MODEL_TARGET_NUM:].values
 
     return [OpUnitData(OpUnit[file_name.upper()], x, y)]
 
 
-def _txn_get_ou_runner_data(filename, model_results_path, txn_sample_rate):
+def _txn_get_ou_runner_data(filename, model_results_path, txn_sample_rate, info):
     # In the default case, the data does not need any pre-processing and the file name indicates the opunit
-    df = pd.read_csv(filename)
+    df = columnar_data.read_csv(filename)
     file_name = os.path.splitext(os.path.basename(filename))[0]
 
     # prepending a column of ones as the base transaction data feature
     base_x = pd.DataFrame(data=np.ones((df.shape[0], 1), dtype=int))
     df = pd.concat([base_x, df], axis=1)
-    x = df.iloc[:, :-data_info.instance.METRICS_OUTPUT_NUM].values
-    y = df.iloc[:, -data_info.instance.MINI_MODEL_TARGET_NUM:].values
-    start_times = df.iloc[:, data_info.instance.TARGET_CSV_INDEX[data_info.instance.Target.START_TIME]].values
-    cpu_ids = df.iloc[:, data_info.instance.TARGET_CSV_INDEX[data_info.instance.Target.CPU_ID]].values
+    x = df.iloc[:, :-info.METRICS_OUTPUT_NUM].values
+    y = df.iloc[:, -info.MINI_MODEL_TARGET_NUM:].values
+    start_times = df.iloc[:, info.TARGET_CSV_INDEX[info.Target.START_TIME]].values
+    cpu_ids = df.iloc[:, info.TARGET_CSV_INDEX[info.Target.CPU_ID]].values
 
     logging.info("Loaded file: {}".format(OpUnit[file_name.upper()]))
 
@@ -80,22 +141,23 @@ def _txn_get_ou_runner_data(filename, model_results_path, txn_sample_rate):
     prediction_path = "{}/{}_txn_converted_data.csv".format(model_results_path, file_name)
     io_util.create_csv_file(prediction_path, [""])
 
-    interval = data_info.instance.CONTENDING_OPUNIT_INTERVAL
+    interval = info.CONTENDING_OPUNIT_INTERVAL
 
     # Map from interval start time to the data in this interval
     interval_x_map = {}
     interval_y_map = {}
     interval_id_map = {}
     n = x.shape[0]
-    for i in tqdm.tqdm(list(range(n)), desc="Group data by interval"):
-        rounded_time = data_util.round_to_interval(start_times[i], interval)
-        if rounded_time not in interval_x_map:
-            interval_x_map[rounded_time] = []
-            interval_y_map[rounded_time] = []
-            interval_id_map[rounded_time] = set()
-        interval_x_map[rounded_time].append(x[i])
-        interval_y_map[rounded_time].append(y[i])
-        interval_id_map[rounded_time].add(cpu_ids[i])
+    with profiling_util.stage("interval_grouping"):
+        for i in tqdm.tqdm(list(range(n)), desc="Group data by interval"):
+            rounded_time = data_util.round_to_interval(start_times[i], interval)
+            if rounded_time not in interval_x_map:
+                interval_x_map[rounded_time] = []
+                interval_y_map[rounded_time] = []
+                interval_id_map[rounded_time] = set()
+            interval_x_map[rounded_time].append(x[i])
+            interval_y_map[rounded_time].append(y[i])
+            interval_id_map[rounded_time].add(cpu_ids[i])
 
     # Construct the new data
     x_list = []
@@ -115,35 +177,37 @@ def _txn_get_ou_runner_data(filename, model_results_path, txn_sample_rate):
     return [OpUnitData(OpUnit[file_name.upper()], np.array(x_list), np.array(y_list))]
 
 
-def _interval_get_ou_runner_data(filename, model_results_path):
+def _interval_get_ou_runner_data(filename, model_results_path, info):
     # In the default case, the data does not need any pre-processing and the file name indicates the opunit
-    df = pd.read_csv(filename, skipinitialspace=True)
+    df = columnar_data.read_csv(filename, skipinitialspace=True)
     headers = list(df.columns.values)
-    data_info.instance.parse_csv_header(headers, False)
+    with profiling_util.stage("parse_header"):
+        info.parse_csv_header(headers, False)
     file_name = os.path.splitext(os.path.basename(filename))[0]
 
-    x = df.iloc[:, :-data_info.instance.METRICS_OUTPUT_NUM].values
-    y = df.iloc[:, -data_info.instance.MINI_MODEL_TARGET_NUM:].values
-    start_times = df.iloc[:, data_info.instance.RAW_TARGET_CSV_INDEX[Target.START_TIME]].values
+    x = df.iloc[:, :-info.METRICS_OUTPUT_NUM].values
+    y = df.iloc[:, -info.MINI_MODEL_TARGET_NUM:].values
+    start_times = df.iloc[:, info.RAW_TARGET_CSV_INDEX[Target.START_TIME]].values
     logging.info("Loaded file: {}".format(OpUnit[file_name.upper()]))
 
     # change the data based on the interval for the periodically invoked operating units
     prediction_path = "{}/{}_interval_converted_data.csv".format(model_results_path, file_name)
     io_util.create_csv_file(prediction_path, [""])
 
-    interval = data_info.instance.PERIODIC_OPUNIT_INTERVAL
+    interval = info.PERIODIC_OPUNIT_INTERVAL
 
     # Map from interval start time to the data in this interval
     interval_x_map = {}
     interval_y_map = {}
     n = x.shape[0]
-    for i in tqdm.tqdm(list(range(n)), desc="Group data by interval"):
-        rounded_time = data_util.round_to_interval(start_times[i], interval)
-        if rounded_time not in interval_x_map:
-            interval_x_map[rounded_time] = []
-            interval_y_map[rounded_time] = []
-        interval_x_map[rounded_time].append(x[i])
-        interval_y_map[rounded_time].append(y[i])
+    with profiling_util.stage("interval_grouping"):
+        for i in tqdm.tqdm(list(range(n)), desc="Group data by interval"):
+            rounded_time = data_util.round_to_interval(start_times[i], interval)
+            if rounded_time not in interval_x_map:
+                interval_x_map[rounded_time] = []
+                interval_y_map[rounded_time] = []
+            interval_x_map[rounded_time].append(x[i])
+            interval_y_map[rounded_time].append(y[i])
 
     # Construct the new data
     x_list = []
@@ -162,13 +226,14 @@ def _interval_get_ou_runner_data(filename, model_results_path):
     return [OpUnitData(OpUnit[file_name.upper()], np.array(x_list), np.array(y_list))]
 
 
-def _execution_get_ou_runner_data(filename, model_map, predict_cache, trim):
+def _execution_get_ou_runner_data(filename, model_map, predict_cache, trim, info):
     """Get the training data from the ou runner
 
     :param filename: the input data file
     :param model_map: the map from OpUnit to the ou model
     :param predict_cache: cache for the ou model prediction
     :param trim: % of too high/too low anomalies to prune
+    :param info: the DataInfo to parse the header of the file into
     :return: the list of Data for execution operating units
     """
 
@@ -176,51 +241,50 @@ def _execution_get_ou_runner_data(filename, model_map, predict_cache, trim):
     data_map = {}
     raw_data_map = {}
     input_output_boundary = math.nan
-    with open(filename, "r") as f:
-        reader = csv.reader(f, delimiter=",", skipinitialspace=True)
-        indexes = next(reader)
-        data_info.instance.parse_csv_header(indexes, True)
-        features_vector_index = data_info.instance.raw_features_csv_index[ExecutionFeature.FEATURES]
-        raw_boundary = data_info.instance.raw_features_csv_index[data_info.instance.INPUT_OUTPUT_BOUNDARY]
-        input_output_boundary = len(data_info.instance.input_csv_index)
-
-        for line in reader:
-            # drop query_id, pipeline_id, num_features, features_vector
-            record = [d for i, d in enumerate(line) if i >= raw_boundary]
-            data = list(map(data_util.convert_string_to_numeric, record))
-            x_multiple = data[:input_output_boundary]
-            y_merged = np.array(data[-data_info.instance.MINI_MODEL_TARGET_NUM:])
-
-            # Get the opunits located within
-            opunits = []
-            features = line[features_vector_index].split(';')
-            for idx, feature in enumerate(features):
-                opunit = OpUnit[feature]
-                x_loc = [v[idx] if type(v) == list else v for v in x_multiple]
-                if opunit in model_map:
-                    key = [opunit] + x_loc
-                    if tuple(key) not in predict_cache:
+    indexes, reader = columnar_data.read_rows(filename)
+    with profiling_util.stage("parse_header"):
+        info.parse_csv_header(indexes, True)
+    features_vector_index = info.raw_features_csv_index[ExecutionFeature.FEATURES]
+    raw_boundary = info.raw_features_csv_index[info.INPUT_OUTPUT_BOUNDARY]
+    input_output_boundary = len(info.input_csv_index)
+
+    for line in reader:
+        # drop query_id, pipeline_id, num_features, features_vector
+        data = [d for i, d in enumerate(line) if i >= raw_boundary]
+        x_multiple = data[:input_output_boundary]
+        y_merged = np.array(data[-info.MINI_MODEL_TARGET_NUM:])
+
+        # Get the opunits located within
+        opunits = []
+        features = line[features_vector_index].split(';')
+        for idx, feature in enumerate(features):
+            opunit = OpUnit[feature]
+            x_loc = [v[idx] if type(v) == list else v for v in x_multiple]
+            if opunit in model_map:
+                key = [opunit] + x_loc
+                if tuple(key) not in predict_cache:
+                    with profiling_util.stage("ou_prediction", opunit=opunit.name):
                         predict = model_map[opunit].predict(np.array(x_loc).reshape(1, -1))[0]
-                        predict_cache[tuple(key)] = predict
-                        assert len(predict) == len(y_merged)
-                        y_merged = y_merged - predict
-                    else:
-                        predict = predict_cache[tuple(key)]
-                        assert len(predict) == len(y_merged)
-                        y_merged = y_merged - predict
-
-                    y_merged = np.clip(y_merged, 0, None)
+                    predict_cache[tuple(key)] = predict
+                    assert len(predict) == len(y_merged)
+                    y_merged = y_merged - predict
                 else:
-                    opunits.append((opunit, x_loc))
+                    predict = predict_cache[tuple(key)]
+                    assert len(predict) == len(y_merged)
+                    y_merged = y_merged - predict
+
+                y_merged = np.clip(y_merged, 0, None)
+            else:
+                opunits.append((opunit, x_loc))
 
-            if len(opunits) > 1:
-                raise Exception('Unmodelled OperatingUnits detected: {}'.format(opunits))
+        if len(opunits) > 1:
+            raise Exception('Unmodelled OperatingUnits detected: {}'.format(opunits))
 
-            # Record into predict_cache
-            key = tuple([opunits[0][0]] + opunits[0][1])
-            if key not in raw_data_map:
-                raw_data_map[key] = []
-            raw_data_map[key].append(y_merged)
+        # Record into predict_cache
+        key = tuple([opunits[0][0]] + opunits[0][1])
+        if key not in raw_data_map:
+            raw_data_map[key] = []
+        raw_data_map[key].append(y_merged)
 
     # Postprocess the raw_data_map -> data_map
     # We need to do this here since we need to have seen all the data
@@ -254,7 +318,7 @@ def _execution_get_ou_runner_data(filename, model_map, predict_cache, trim):
     for opunit, values in data_map.items():
         np_value = np.array(values)
         x = np_value[:, :input_output_boundary]
-        y = np_value[:, -data_info.instance.MINI_MODEL_TARGET_NUM:]
+        y = np_value[:, -info.MINI_MODEL_TARGET_NUM:]
         data_list.append(OpUnitData(opunit, x, y))
 
     return data_list
@@ -265,13 +329,15 @@ class OpUnitData:
     The class that stores data and provides basic functions to manipulate the training data for the operating unit
     """
 
-    def __init__(self, opunit, x, y):
+    def __init__(self, opunit, x, y, source=None):
         """
 
         :param opunit: The opunit that the data is related to
         :param x: The input feature
         :param y: The outputs
+        :param source: The input file that the data is sampled from (None if the data has all the rows)
         """
         self.opunit = opunit
         self.x = x
         self.y = y
+        self.source = source
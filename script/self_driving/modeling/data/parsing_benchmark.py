@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import itertools
+import logging
+import os
+import time
+
+from . import data_util
+from ..util import logging_util
+
+
+def generate_file(input_file, output_file, row_num):
+    """Generate a large data file by repeating the data lines of a CSV data file
+
+    :param input_file: the CSV data file (e.g., the pipeline.csv of the OU runners)
+    :param output_file: the generated file with the header of the input file
+    :param row_num: the number of data lines of the generated file
+    """
+    with open(input_file, "rb") as f:
+        header = f.readline()
+        lines = [line if line.endswith(b'\n') else line + b'\n' for line in f if len(line.strip()) > 0]
+    if len(lines) == 0:
+        raise ValueError("No data lines in {}".format(input_file))
+
+    with open(output_file, "wb") as f:
+        f.write(header)
+        for i in range(0, row_num, len(lines)):
+            f.writelines(lines[:row_num - i])
+
+
+def parse_by_value(filename):
+    """Parse a CSV data file with the csv module and data_util.convert_string_to_numeric on each value
+
+    :param filename: the CSV data file
+    :return: generator of the typed rows (the non-numeric values are kept as strings)
+    """
+    with open(filename, "r") as f:
+        reader = csv.reader(f, delimiter=",", skipinitialspace=True)
+        next(reader)
+        for row in reader:
+            typed_row = []
+            for value in row:
+                try:
+                    typed_row.append(data_util.convert_string_to_numeric(value))
+                except ValueError:
+                    typed_row.append(value)
+            yield typed_row
+
+
+def parse_by_block(filename):
+    """Parse a CSV data file with data_util.parse_csv_lines on each block of lines
+
+    :param filename: the CSV data file
+    :return: generator of the (kinds, columns) of each block
+    """
+    column_num = len(data_util.read_csv_header(filename))
+    for block in data_util.iterate_csv_line_blocks(filename):
+        yield data_util.parse_csv_lines(block, column_num)
+
+
+def count_mismatches(filename, row_num):
+    """Compare the values of the two parsers
+
+    :param filename: the CSV data file
+    :param row_num: the number of the first rows to compare
+    :return: the number of mismatched rows
+    """
+    block_rows = (row for kinds, columns in parse_by_block(filename) for row in _get_rows(kinds, columns))
+    rows = zip(itertools.islice(parse_by_value(filename), row_num), block_rows)
+    return sum(value_row != list(block_row) for value_row, block_row in rows)
+
+
+def _get_rows(kinds, columns):
+    # The rows of the parsed columns (a single ";"-separated value is a scalar like convert_string_to_numeric returns)
+    lists = []
+    for kind, column in zip(kinds, columns):
+        if kind != data_util.RAGGED:
+            lists.append(column.tolist())
+            continue
+        values, offsets = column[0].tolist(), column[1].tolist()
+        lists.append([values[begin] if end - begin == 1 else values[begin:end]
+                      for begin, end in zip(offsets[:-1], offsets[1:])])
+    return zip(*lists)
+
+
+def _time_iteration(iterator):
+    # The wall-clock time to consume an iterator
+    start_time = time.perf_counter()
+    for _ in iterator:
+        pass
+    return time.perf_counter() - start_time
+
+
+# ==============================================
+# main
+# ==============================================
+if __name__ == '__main__':
+    aparser = argparse.ArgumentParser(description='CSV Data Parsing Benchmark')
+    aparser.add_argument('--input_file', default='modeling/ou_runner_input/pipeline.csv',
+                         help='CSV data file whose lines are repeated to generate the benchmark file')
+    aparser.add_argument('--benchmark_file', default='parsing_benchmark.csv',
+                         help='The generated benchmark file (kept for the following runs)')
+    aparser.add_argument('--row_num', type=int, default=2000000, help='The number of rows of the benchmark file')
+    aparser.add_argument('--check_row_num', type=int, default=100000,
+                         help='The number of the first rows to compare the parsed values of')
+    aparser.add_argument('--log', default='info', help='The logging level')
+    args = aparser.parse_args()
+
+    logging_util.init_logging(args.log)
+    if not os.path.exists(args.benchmark_file):
+        generate_file(args.input_file, args.benchmark_file, args.row_num)
+    logging.info("Benchmark file {} ({} MB)".format(args.benchmark_file,
+                                                     os.path.getsize(args.benchmark_file) // (1 << 20)))
+
+    value_time = _time_iteration(parse_by_value(args.benchmark_file))
+    logging.info("csv module + convert_string_to_numeric: {:.2f}s".format(value_time))
+    block_time = _time_iteration(parse_by_block(args.benchmark_file))
+    logging.info("parse_csv_lines: {:.2f}s ({:.1f}x faster)".format(block_time, value_time / block_time))
+    logging.info("Mismatched rows in the first {} rows: {}".format(
+        args.check_row_num, count_mismatches(args.benchmark_file, args.check_row_num)))
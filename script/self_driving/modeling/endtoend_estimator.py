@@ -2,13 +2,11 @@ import numpy as np
 import argparse
 import pickle
 import logging
-import tqdm
 
 from . import interference_model_config
-from .util import io_util, logging_util
+from .util import io_util, logging_util, profiling_util
 from .training_util import interference_data_constructing_util, result_writing_util
 from .info import data_info
-from .type import Target
 
 np.set_printoptions(precision=4)
 np.set_printoptions(edgeitems=10)
@@ -22,7 +20,7 @@ class EndtoendEstimator:
 
     def __init__(self, input_path, model_results_path, ou_model_map, interference_resource_model,
                  interference_impact_model, interference_direct_model, ee_sample_rate, txn_sample_rate,
-                 network_sample_rate):
+                 network_sample_rate, ou_model_file=None):
         self.input_path = input_path
         self.model_results_path = model_results_path
         self.ou_model_map = ou_model_map
@@ -32,6 +30,8 @@ class EndtoendEstimator:
         self.ee_sample_rate = ee_sample_rate
         self.txn_sample_rate = txn_sample_rate
         self.network_sample_rate = network_sample_rate
+        # The file that ou_model_map is loaded from, which keys the cache of the constructed data (None if unknown)
+        self.ou_model_file = ou_model_file
 
     def estimate(self):
         """Train the ou-models
@@ -47,168 +47,229 @@ class EndtoendEstimator:
                                                                                             False,
                                                                                             self.ee_sample_rate,
                                                                                             self.txn_sample_rate,
-                                                                                            self.network_sample_rate)
+                                                                                            self.network_sample_rate,
+                                                                                            self.ou_model_file)
         return self._interference_model_prediction(resource_data_list, impact_data_list)
 
-    def _interference_model_prediction(self, resource_data_list, impact_data_list):
+    def estimate_streaming(self, window_size, order_slack=interference_model_config.INTERVAL_SIZE):
+        """Estimate the opunit groups in time-ordered windows
+
+        The input is read incrementally and only the data of the active window are kept in memory, so that long traces
+        can be evaluated. The predictions and the metrics are recorded in the same files as estimate(), except that
+        the global resource data are not logged.
+
+        :param window_size: the time span (us) of the opunit groups to estimate in each window
+        :param order_slack: the maximum time (us) that a line in an input file may start before the previous lines
+        """
+        recorders = {label: _ResultRecorder(self.model_results_path, label)
+                     for label in ["resource", "impact", "direct"]}
+        for resource_data_list, impact_data_list, resource_mask, complete_time in \
+                interference_data_constructing_util.iterate_window_data(self.input_path, self.ou_model_map,
+                                                                        window_size, self.ee_sample_rate,
+                                                                        self.txn_sample_rate,
+                                                                        self.network_sample_rate, order_slack):
+            self._interference_model_prediction(resource_data_list, impact_data_list, recorders, resource_mask,
+                                                complete_time)
+            logging.info("Estimated {} OU groups until {}".format(len(impact_data_list), complete_time))
+
+        for recorder in recorders.values():
+            recorder.finish()
+
+    def _interference_model_prediction(self, resource_data_list, impact_data_list, recorders=None,
+                                       resource_mask=None, complete_time=None):
         """Use the interference models to predict
 
-        :param resource_data_list: list of GlobalResourceData
-        :param impact_data_list: list of GlobalImpactData
+        :param resource_data_list: InterferenceResourceDataStore
+        :param impact_data_list: InterferenceImpactDataStore
+        :param recorders: the map from the model label to the _ResultRecorder to accumulate the results into (None to
+                          record the results of this data only)
+        :param resource_mask: the mask of the resource data to record (None for all)
+        :param complete_time: the groups starting before this time have all been recorded (None if unknown)
         """
+        finish = recorders is None
+        if recorders is None:
+            recorders = {label: _ResultRecorder(self.model_results_path, label)
+                         for label in ["resource", "impact", "direct"]}
+
         # First apply the interference resource prediction model
         # Get the features and labels
-        x = np.array([d.x for d in resource_data_list])
-        y = np.array([d.y for d in resource_data_list])
-        # Predict
-        y_pred = self.interference_resource_model.predict(x)
+        x = resource_data_list.x
+        y = resource_data_list.y
+        with profiling_util.stage("evaluation", opunit="interference_resource"):
+            # Predict
+            y_pred = self.interference_resource_model.predict(x)
 
-        self._record_results(x, y, y_pred, None, None, "resource", None)
+            if resource_mask is None:
+                recorders["resource"].record(x, y, y_pred)
+            else:
+                recorders["resource"].record(x[resource_mask], y[resource_mask], y_pred[resource_mask])
 
         # Put the prediction interference resource util back to the GlobalImpactData
-        for i, data in enumerate(resource_data_list):
-            data.y_pred = y_pred[i]
+        resource_data_list.y_pred = y_pred
+
+        self._model_prediction_with_derived_data(impact_data_list, "impact", self.interference_impact_model,
+                                                 recorders["impact"], complete_time)
 
-        self._model_prediction_with_derived_data(impact_data_list, "impact", self.interference_impact_model)
+        self._model_prediction_with_derived_data(impact_data_list, "direct", self.interference_direct_model,
+                                                 recorders["direct"], complete_time)
 
-        self._model_prediction_with_derived_data(impact_data_list, "direct", self.interference_direct_model)
+        if finish:
+            for recorder in recorders.values():
+                recorder.finish()
 
-    def _model_prediction_with_derived_data(self, impact_data_list, model_name, model):
+    def _model_prediction_with_derived_data(self, impact_data_list, model_name, model, recorder, complete_time):
         # Then apply the interference impact model
-        x = []
-        y = []
-        ou_model_y_pred = []  # The labels directly predicted from the ou models
-        raw_y = []  # The actual labels
-        data_list = []
-        # The input feature is (normalized ou model prediction, predicted interference resource util, the predicted
-        # resource util on the same core that the opunit group runs)
-        # The output target is the ratio between the actual resource util (including the elapsed time) and the
-        # normalized ou model prediction
-        for d in tqdm.tqdm(impact_data_list, desc="Construct data for the {} model".format(model_name)):
-            data_list.append(d.target_grouped_op_unit_data)
-            ou_model_y_pred.append(d.target_grouped_op_unit_data.y_pred)
-            raw_y.append(d.target_grouped_op_unit_data.y)
-            predicted_elapsed_us = ou_model_y_pred[-1][data_info.instance.target_csv_index[Target.ELAPSED_US]]
-            predicted_resource_util = None
-            if model_name == "impact":
-                predicted_resource_util = d.get_y_pred()
-            if model_name == "direct":
-                predicted_resource_util = d.x
-            # Remove the OU group itself from the total resource data
-            self_resource = (ou_model_y_pred[-1] * max(1, d.target_grouped_op_unit_data.concurrency) /
-                             len(d.resource_data_list) / interference_model_config.INTERVAL_SIZE)
-            predicted_resource_util[:ou_model_y_pred[-1].shape[0]] -= self_resource
-            predicted_resource_util[predicted_resource_util < 0] = 0
-            x.append(np.concatenate((ou_model_y_pred[-1] / predicted_elapsed_us,
-                                     predicted_resource_util,
-                                     d.resource_util_same_core_x)))
-            # x.append(np.concatenate((ou_model_y_pred[-1] / predicted_elapsed_us, predicted_resource_util)))
-            y.append(d.target_grouped_op_unit_data.y / (d.target_grouped_op_unit_data.y_pred +
-                                                        interference_model_config.RATIO_DIVISION_EPSILON))
-
-        # Predict
-        x = np.array(x)
-        y = np.array(y)
-        y_pred = model.predict(x)
-
-        # Record results
-        self._record_results(x, y, y_pred, raw_y, ou_model_y_pred, model_name, data_list)
-
-    def _record_results(self, x, y, y_pred, raw_y, ou_model_y_pred, label, data_list):
-        """Record the prediction results
+        with profiling_util.label(opunit="interference_" + model_name):
+            x, y, ou_model_y_pred, raw_y = interference_data_constructing_util.construct_derived_data(
+                impact_data_list, model_name, include_same_core_x=True)
+
+            with profiling_util.stage("evaluation"):
+                # Predict
+                y_pred = model.predict(x)
+
+                # Record results
+                recorder.record(x, y, y_pred, raw_y, ou_model_y_pred, impact_data_list.grouped_op_unit_data,
+                                complete_time)
+
+
+class _ResultRecorder:
+    """
+    Record the prediction results of a model, and accumulate the error metrics over (possibly multiple batches of) the
+    predictions
+    """
+
+    def __init__(self, model_results_path, label):
+        """
+        :param model_results_path: directory path to log the result information
+        :param label: the result label ("resource", "impact", or "direct")
+        """
+        self.label = label
+        self.metrics_path = "{}/interference_{}_model_metrics.csv".format(model_results_path, label)
+        self.prediction_path = "{}/interference_{}_model_prediction.csv".format(model_results_path, label)
+        result_writing_util.create_metrics_and_prediction_files(self.metrics_path, self.prediction_path, True)
+
+        self.data_num = 0
+        self.sum_ratio_error = 0
+        self.sum_original_ratio_error = 0
+        # Accumulated for the impact and direct models
+        self.accumulated_raw_y = 0
+        self.accumulated_raw_y_pred = 0
+        self.accumulated_ou_model_y_pred = 0
+        self.sum_raw_ratio_error = 0
+        self.sum_raw_original_ratio_error = 0
+
+        self.grouped_prediction_path = None
+        self.average_result_path = None
+        # Map from the averaging interval to the [sum of actual, sum of predicted, count]
+        self.interval_result_map = {}
+        if label == 'direct':
+            self.grouped_prediction_path = "{}/grouped_opunit_prediction.csv".format(model_results_path)
+            self.average_result_path = "{}/interval_average_prediction.csv".format(model_results_path)
+            io_util.create_csv_file(self.grouped_prediction_path,
+                                    ["Pipeline", "", "Actual", "", "Predicted", "", "Ratio Error"])
+            io_util.create_csv_file(self.average_result_path, ["Timestamp", "Actual Average", "Predicted Average"])
+
+    def record(self, x, y, y_pred, raw_y=None, ou_model_y_pred=None, data_list=None, complete_time=None):
+        """Record a batch of prediction results
 
         :param x: the input data
         :param y: the actual output
         :param y_pred: the predicted output
-        :param label: the result label ("resource" or "impact")
+        :param raw_y: the actual labels (for the impact and direct models)
+        :param ou_model_y_pred: the labels directly predicted from the ou models (for the impact and direct models)
+        :param data_list: the GroupedOpUnitDataStore of the predictions (for the impact and direct models)
+        :param complete_time: the groups starting before this time have all been recorded (None if unknown)
         """
-        # Result files
-        metrics_path = "{}/interference_{}_model_metrics.csv".format(self.model_results_path, label)
-        prediction_path = "{}/interference_{}_model_prediction.csv".format(self.model_results_path, label)
-        result_writing_util.create_metrics_and_prediction_files(metrics_path, prediction_path, True)
-
-        # Log the prediction results
-        ratio_error = np.average(np.abs(y - y_pred) / (y + 1e-6), axis=0)
-        io_util.write_csv_result(metrics_path, "Model Ratio Error", ratio_error)
-        result_writing_util.record_predictions((x, y_pred, y), prediction_path)
+        self.data_num += len(y)
+        self.sum_ratio_error = self.sum_ratio_error + np.sum(np.abs(y - y_pred) / (y + 1e-6), axis=0)
+        if self.label == "resource":
+            original_ratio_error = np.abs(y - x[:, :y.shape[1]]) / (y + 1e-6)
+        else:
+            original_ratio_error = np.abs(1 / (y + 1e-6) - 1)
+        self.sum_original_ratio_error = self.sum_original_ratio_error + np.sum(original_ratio_error, axis=0)
+        result_writing_util.record_predictions((x, y_pred, y), self.prediction_path)
+
+        if self.label == "resource":
+            return
+
+        # Calculate the accumulated ratio error
+        epsilon = interference_model_config.RATIO_DIVISION_EPSILON
+        raw_y_pred = (ou_model_y_pred + epsilon) * y_pred
+        ratio_error = np.abs(raw_y - raw_y_pred) / (raw_y + epsilon)
+        self.accumulated_raw_y = self.accumulated_raw_y + np.sum(raw_y, axis=0)
+        self.accumulated_raw_y_pred = self.accumulated_raw_y_pred + np.sum(raw_y_pred, axis=0)
+        self.accumulated_ou_model_y_pred = self.accumulated_ou_model_y_pred + np.sum(ou_model_y_pred, axis=0)
+        self.sum_raw_ratio_error = self.sum_raw_ratio_error + np.sum(ratio_error, axis=0)
+        self.sum_raw_original_ratio_error = self.sum_raw_original_ratio_error + np.sum(
+            np.abs(raw_y - ou_model_y_pred) / (raw_y + epsilon), axis=0)
+
+        if self.label != 'direct':
+            return
+
+        io_util.write_csv_results(self.grouped_prediction_path, data_list.get_names(),
+                                  [[""] + list(raw_y[i]) + [""] + list(raw_y_pred[i]) + [""] + list(ratio_error[i])
+                                   for i in range(len(raw_y))])
+
+        # Don't count the create index OU
+        # TODO(lin): needs better way to evaluate... maybe add a id_query field to GroupedOpunitData
+        # mark_list = _generate_mark_list(data_list)
+        mask = data_list.concurrency <= 0
+        interval_time = _round_to_interval(data_list.start_time[mask], interference_model_config.AVERAGING_INTERVAL)
+        for time, actual, predicted in zip(interval_time, raw_y[mask][:, -5], raw_y_pred[mask][:, -5]):
+            result = self.interval_result_map.setdefault(time, [0, 0, 0])
+            result[0] += actual
+            result[1] += predicted
+            result[2] += 1
+
+        if complete_time is not None:
+            self._write_interval_results(_round_to_interval(complete_time,
+                                                            interference_model_config.AVERAGING_INTERVAL))
+
+    def finish(self):
+        """Write the error metrics after all the predictions are recorded
+        """
+        label = self.label
+        data_num = max(self.data_num, 1)
+        ratio_error = self.sum_ratio_error / data_num
+        io_util.write_csv_result(self.metrics_path, "Model Ratio Error", ratio_error)
 
         # Print Error summary to command line
-        if label == "resource":
-            avg_original_ratio_error = np.average(np.abs(y - x[:, :y.shape[1]]) / (y + 1e-6), axis=0)
-        else:
-            avg_original_ratio_error = np.average(np.abs(1 / (y + 1e-6) - 1), axis=0)
-        logging.info('Model Original Ratio Error ({}): {}'.format(label, avg_original_ratio_error))
+        logging.info('Model Original Ratio Error ({}): {}'.format(label, self.sum_original_ratio_error / data_num))
         logging.info('Model Ratio Error ({}): {}'.format(label, ratio_error))
         logging.info('')
 
-        if label != "resource":
-            # Calculate the accumulated ratio error
-            epsilon = interference_model_config.RATIO_DIVISION_EPSILON
-            ou_model_y_pred = np.array(ou_model_y_pred)
-            raw_y = np.array(raw_y)
-            raw_y_pred = (ou_model_y_pred + epsilon) * y_pred
-            accumulated_raw_y = np.sum(raw_y, axis=0)
-            accumulated_raw_y_pred = np.sum(raw_y_pred, axis=0)
-            original_ratio_error = np.abs(raw_y - ou_model_y_pred) / (raw_y + epsilon)
-            avg_original_ratio_error = np.average(original_ratio_error, axis=0)
-            ratio_error = np.abs(raw_y - raw_y_pred) / (raw_y + epsilon)
-            avg_ratio_error = np.average(ratio_error, axis=0)
-            accumulated_percentage_error = np.abs(accumulated_raw_y - accumulated_raw_y_pred) / (
-                    accumulated_raw_y + epsilon)
-            original_accumulated_percentage_error = np.abs(accumulated_raw_y - np.sum(ou_model_y_pred, axis=0)) / (
-                    accumulated_raw_y + epsilon)
-
-            logging.info('Original Ratio Error: {}'.format(avg_original_ratio_error))
-            io_util.write_csv_result(metrics_path, "Original Ratio Error", avg_original_ratio_error)
-            logging.info('Ratio Error: {}'.format(avg_ratio_error))
-            io_util.write_csv_result(metrics_path, "Ratio Error", avg_ratio_error)
-            logging.info('Original Accumulated Ratio Error: {}'.format(original_accumulated_percentage_error))
-            io_util.write_csv_result(metrics_path, "Original Accumulated Ratio Error",
-                                     original_accumulated_percentage_error)
-            logging.info('Accumulated Ratio Error: {}'.format(accumulated_percentage_error))
-            io_util.write_csv_result(metrics_path, "Accumulated Ratio Error", accumulated_percentage_error)
-            logging.info('Accumulated Actual: {}'.format(accumulated_raw_y))
-            logging.info('Original Accumulated Predict: {}'.format(np.sum(ou_model_y_pred, axis=0)))
-            logging.info('Accumulated Predict: {}'.format(accumulated_raw_y_pred))
-
-            if label == 'direct':
-                prediction_path = "{}/grouped_opunit_prediction.csv".format(self.model_results_path)
-                io_util.create_csv_file(prediction_path, ["Pipeline", "", "Actual", "", "Predicted", "", "Ratio Error"])
-                for i, data in enumerate(data_list):
-                    io_util.write_csv_result(prediction_path, data.name, [""] + list(raw_y[i]) + [""] +
-                                             list(raw_y_pred[i]) + [""] + list(ratio_error[i]))
-
-                average_result_path = "{}/interval_average_prediction.csv".format(self.model_results_path)
-                io_util.create_csv_file(average_result_path,
-                                        ["Timestamp", "Actual Average", "Predicted Average"])
-
-                interval_y_map = {}
-                interval_y_pred_map = {}
-                mark_list = None
-                # mark_list = _generate_mark_list(data_list)
-                for i, data in enumerate(data_list):
-                    # Don't count the create index OU
-                    # TODO(lin): needs better way to evaluate... maybe add a id_query field to GroupedOpunitData
-                    if data.concurrency > 0:
-                        continue
-                    if mark_list is not None and not mark_list[i]:
-                        continue
-                    interval_time = _round_to_interval(data.start_time, interference_model_config.AVERAGING_INTERVAL)
-                    if interval_time not in interval_y_map:
-                        interval_y_map[interval_time] = []
-                        interval_y_pred_map[interval_time] = []
-                    interval_y_map[interval_time].append(raw_y[i][-5])
-                    interval_y_pred_map[interval_time].append(raw_y_pred[i][-5])
-
-                for time in sorted(interval_y_map.keys()):
-                    if mark_list is None:
-                        io_util.write_csv_result(average_result_path, time,
-                                                 [np.average(interval_y_map[time]),
-                                                  np.average(interval_y_pred_map[time])])
-                    else:
-                        io_util.write_csv_result(average_result_path, time,
-                                                 [np.sum(interval_y_map[time]),
-                                                  np.sum(interval_y_pred_map[time])])
+        if label == "resource":
+            return
+
+        epsilon = interference_model_config.RATIO_DIVISION_EPSILON
+        avg_original_ratio_error = self.sum_raw_original_ratio_error / data_num
+        avg_ratio_error = self.sum_raw_ratio_error / data_num
+        accumulated_percentage_error = np.abs(self.accumulated_raw_y - self.accumulated_raw_y_pred) / (
+                self.accumulated_raw_y + epsilon)
+        original_accumulated_percentage_error = np.abs(self.accumulated_raw_y - self.accumulated_ou_model_y_pred) / (
+                self.accumulated_raw_y + epsilon)
+
+        logging.info('Original Ratio Error: {}'.format(avg_original_ratio_error))
+        io_util.write_csv_result(self.metrics_path, "Original Ratio Error", avg_original_ratio_error)
+        logging.info('Ratio Error: {}'.format(avg_ratio_error))
+        io_util.write_csv_result(self.metrics_path, "Ratio Error", avg_ratio_error)
+        logging.info('Original Accumulated Ratio Error: {}'.format(original_accumulated_percentage_error))
+        io_util.write_csv_result(self.metrics_path, "Original Accumulated Ratio Error",
+                                 original_accumulated_percentage_error)
+        logging.info('Accumulated Ratio Error: {}'.format(accumulated_percentage_error))
+        io_util.write_csv_result(self.metrics_path, "Accumulated Ratio Error", accumulated_percentage_error)
+        logging.info('Accumulated Actual: {}'.format(self.accumulated_raw_y))
+        logging.info('Original Accumulated Predict: {}'.format(self.accumulated_ou_model_y_pred))
+        logging.info('Accumulated Predict: {}'.format(self.accumulated_raw_y_pred))
+
+        if label == 'direct':
+            self._write_interval_results(np.inf)
+
+    def _write_interval_results(self, complete_time):
+        # Write the average results of the averaging intervals before complete_time (in the order of time)
+        for time in sorted(t for t in self.interval_result_map if t < complete_time):
+            actual, predicted, count = self.interval_result_map.pop(time)
+            io_util.write_csv_result(self.average_result_path, time, [actual / count, predicted / count])
 
 
 def _round_to_interval(time, interval):
@@ -262,13 +323,24 @@ if __name__ == '__main__':
                          help='Sampling rate for the transaction OUs')
     aparser.add_argument('--network_sample_rate', type=int, default=2,
                          help='Sampling rate for the network OUs')
+    aparser.add_argument('--streaming_window', type=float, default=0,
+                         help='Estimate in time-ordered windows of this many seconds to bound the memory (ignored if 0)')
+    aparser.add_argument('--profile_path', default=None,
+                         help='Record the wall time, CPU time and peak RSS of the estimation stages per model in this '
+                              'report file (JSON if it ends with .json, otherwise CSV)')
+    aparser.add_argument('--cprofile_path', default=None,
+                         help='With --profile_path, also dump the cProfile statistics of each stage into this '
+                              'directory')
     aparser.add_argument('--log', default='info', help='The logging level')
     args = aparser.parse_args()
 
     logging_util.init_logging(args.log)
+    if args.profile_path is not None:
+        profiling_util.instance = profiling_util.Profiler(args.cprofile_path)
 
     with open(args.ou_model_file, 'rb') as pickle_file:
-        model_map, data_info.instance = pickle.load(pickle_file)
+        model_map, info = pickle.load(pickle_file)
+    data_info.set_model_map_info(model_map, info)
     with open(args.interference_resource_model_file, 'rb') as pickle_file:
         resource_model = pickle.load(pickle_file)
     with open(args.interference_impact_model_file, 'rb') as pickle_file:
@@ -277,5 +349,10 @@ if __name__ == '__main__':
         direct_model = pickle.load(pickle_file)
     estimator = EndtoendEstimator(args.input_path, args.model_results_path, model_map, resource_model, impact_model,
                                   direct_model, args.ee_sample_rate, args.txn_sample_rate,
-                                  args.network_sample_rate)
-    estimator.estimate()
+                                  args.network_sample_rate, args.ou_model_file)
+    if args.streaming_window > 0:
+        estimator.estimate_streaming(int(args.streaming_window * 1000000))
+    else:
+        estimator.estimate()
+    if profiling_util.instance is not None:
+        profiling_util.instance.write_report(args.profile_path)
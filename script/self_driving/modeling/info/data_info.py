@@ -93,4 +93,30 @@ class DataInfo:
                 self.input_csv_index[ExecutionFeature[index.upper()]] = i - input_output_boundary
 
 
+# The data info of the data that is being loaded and trained with. The trained models keep their own data info (see
+# set_model_map_info), so that the model maps with different CSV layouts can be used at the same time
 instance = DataInfo()
+
+
+def set_model_map_info(model_map, info):
+    """Attach a data info to the models of a model map that do not have their own
+
+    :param model_map: the map from the key (e.g., OpUnit) to the trained model
+    :param info: the DataInfo of the data that the models are trained with
+    """
+    for model in model_map.values():
+        if model is not None and model.get_data_info() is None:
+            model.set_data_info(info)
+
+
+def get_model_map_info(model_map):
+    """Get the data info of a model map
+
+    :param model_map: the map from the key (e.g., OpUnit) to the trained model
+    :return: the DataInfo of the first model that has one (the global instance if none of them has)
+    """
+    for model in model_map.values():
+        info = None if model is None else model.get_data_info()
+        if info is not None:
+            return info
+    return instance
@@ -2,15 +2,14 @@ import numpy as np
 import argparse
 import pickle
 import logging
-import tqdm
 import random
 from sklearn import model_selection
 
 from . import model
 from . import interference_model_config
 from .info import data_info
-from .util import io_util, logging_util
-from .training_util import interference_data_constructing_util, result_writing_util
+from .util import io_util, logging_util, profiling_util
+from .training_util import hyperparameter_search_util, interference_data_constructing_util, result_writing_util
 from .type import Target
 
 np.set_printoptions(precision=4)
@@ -18,7 +17,13 @@ np.set_printoptions(edgeitems=10)
 np.set_printoptions(suppress=True)
 
 
-def _interference_model_training_process(x, y, methods, test_ratio, metrics_path, prediction_path):
+def _get_ratio_error(evaluate_y, y_pred):
+    # The average ratio error of each target
+    return np.average(np.abs(evaluate_y - y_pred) / (evaluate_y + 1), axis=0)
+
+
+def _interference_model_training_process(x, y, methods, test_ratio, metrics_path, prediction_path, info,
+                                         search_budget=None):
     """Training process for the interference models
 
     :param x: input feature
@@ -27,6 +32,9 @@ def _interference_model_training_process(x, y, methods, test_ratio, metrics_path
     :param test_ratio: train-test split ratio
     :param metrics_path: to store the prediction metrics
     :param prediction_path: to store the raw prediction results
+    :param info: the DataInfo of the ou models that the data is constructed with
+    :param search_budget: the CPU time budget (in seconds) to search the hyperparameters of the methods (None to only
+           evaluate the default configuration of each method)
     :return: (the best model, the indices for the test data for additional metric calculation)
     """
     interference_model = None
@@ -39,13 +47,23 @@ def _interference_model_training_process(x, y, methods, test_ratio, metrics_path
 
     min_percentage_error = 1
     pred_results = None
-    elapsed_us_index = data_info.instance.target_csv_index[Target.ELAPSED_US]
+    elapsed_us_index = info.target_csv_index[Target.ELAPSED_US]
+
+    candidates = [(method, None) for method in methods]
+    if search_budget is not None:
+        with profiling_util.stage("search"):
+            method, params, _, _ = hyperparameter_search_util.search(
+                x_train, y_train, x_test, y_test, methods,
+                lambda evaluate_y, y_pred: _get_ratio_error(evaluate_y, y_pred)[elapsed_us_index], search_budget)
+        candidates = [(method, params)]
 
-    for method in methods:
+    for method, params in candidates:
         # Train the model
-        logging.info("Training the interference model with {}".format(method))
-        regressor = model.Model(method)
-        regressor.train(x_train, y_train)
+        label = method if params is None else "{} {}".format(method, params)
+        logging.info("Training the interference model with {}".format(label))
+        regressor = model.Model(method, params=params)
+        with profiling_util.label(method=label):
+            regressor.train(x_train, y_train)
 
         # Evaluate on both the training and test set
         results = []
@@ -55,10 +73,11 @@ def _interference_model_training_process(x, y, methods, test_ratio, metrics_path
             evaluate_x = d[0]
             evaluate_y = d[1]
 
-            y_pred = regressor.predict(evaluate_x)
+            with profiling_util.stage("evaluation", method=label):
+                y_pred = regressor.predict(evaluate_x)
+                percentage_error = _get_ratio_error(evaluate_y, y_pred)
             logging.debug("x shape: {}".format(evaluate_x.shape))
             logging.debug("y shape: {}".format(y_pred.shape))
-            percentage_error = np.average(np.abs(evaluate_y - y_pred) / (evaluate_y + 1), axis=0)
             results += list(percentage_error) + [""]
 
             logging.info('{} Ratio Error: {}'.format(train_test_label[i], percentage_error))
@@ -70,7 +89,7 @@ def _interference_model_training_process(x, y, methods, test_ratio, metrics_path
                 interference_model = regressor
                 pred_results = (evaluate_x, y_pred, evaluate_y)
 
-        io_util.write_csv_result(metrics_path, method, results)
+        io_util.write_csv_result(metrics_path, label, results)
 
         logging.info("")
 
@@ -87,13 +106,15 @@ class InterferenceModelTrainer:
 
     def __init__(self, input_path, model_results_path, ml_models, test_ratio, impact_model_ratio, ou_model_map,
                  warmup_period, use_query_predict_cache, add_noise, predict_ou_only, ee_sample_rate,
-                 txn_sample_rate, network_sample_rate):
+                 txn_sample_rate, network_sample_rate, search_budget=None, ou_model_file=None):
         self.input_path = input_path
         self.model_results_path = model_results_path
         self.ml_models = ml_models
         self.test_ratio = test_ratio
         self.impact_model_ratio = impact_model_ratio
         self.ou_model_map = ou_model_map
+        # The data is located with the data info of the ou models
+        self.info = data_info.get_model_map_info(ou_model_map)
         self.warmup_period = warmup_period
         self.use_query_predict_cache = use_query_predict_cache
         self.add_noise = add_noise
@@ -101,6 +122,10 @@ class InterferenceModelTrainer:
         self.ee_sample_rate = ee_sample_rate
         self.txn_sample_rate = txn_sample_rate
         self.network_sample_rate = network_sample_rate
+        # The CPU time budget (in seconds) of the hyperparameter search for each model (None for no search)
+        self.search_budget = search_budget
+        # The file that ou_model_map is loaded from, which keys the cache of the constructed data (None if unknown)
+        self.ou_model_file = ou_model_file
 
         self.resource_data_list = None
         self.impact_data_list = None
@@ -118,7 +143,8 @@ class InterferenceModelTrainer:
                                                                   self.predict_ou_only,
                                                                   self.ee_sample_rate,
                                                                   self.txn_sample_rate,
-                                                                  self.network_sample_rate)
+                                                                  self.network_sample_rate,
+                                                                  self.ou_model_file)
 
         self.resource_data_list = data_lists[0]
         self.impact_data_list = data_lists[1]
@@ -130,76 +156,53 @@ class InterferenceModelTrainer:
         """
         # First train the resource prediction model
         # Get the features and labels
-        x = np.array([d.x for d in self.resource_data_list])
-        y = np.array([d.y for d in self.resource_data_list])
+        x = self.resource_data_list.x
+        y = self.resource_data_list.y
 
         # Training
         metrics_path = "{}/interference_resource_model_metrics.csv".format(self.model_results_path)
         prediction_path = "{}/interference_resource_model_prediction.csv".format(self.model_results_path)
-        interference_resource_model, _ = _interference_model_training_process(x, y, self.ml_models, self.test_ratio,
-                                                                              metrics_path,
-                                                                              prediction_path)
+        with profiling_util.label(opunit="interference_resource"):
+            interference_resource_model, _ = _interference_model_training_process(x, y, self.ml_models,
+                                                                                  self.test_ratio, metrics_path,
+                                                                                  prediction_path, self.info,
+                                                                                  self.search_budget)
 
-        # Put the prediction interference resource util back to the InterferenceImpactData
-        y_pred = interference_resource_model.predict(x)
-        for i, data in enumerate(self.resource_data_list):
-            data.y_pred = y_pred[i]
+            # Put the prediction interference resource util back to the InterferenceImpactData
+            with profiling_util.stage("evaluation"):
+                self.resource_data_list.y_pred = interference_resource_model.predict(x)
 
-        interference_impact_model = self._train_model_with_derived_data(self.impact_data_list, "impact")
+        with profiling_util.label(opunit="interference_impact"):
+            interference_impact_model = self._train_model_with_derived_data(self.impact_data_list, "impact")
 
-        interference_direct_model = self._train_model_with_derived_data(self.impact_data_list, "direct")
+        with profiling_util.label(opunit="interference_direct"):
+            interference_direct_model = self._train_model_with_derived_data(self.impact_data_list, "direct")
 
         return interference_resource_model, interference_impact_model, interference_direct_model
 
     def _train_model_with_derived_data(self, impact_data_list, model_name):
         # Then train the interference impact model
-        x = []
-        y = []
-        ou_model_y_pred = []  # The labels directly predicted from the ou models
-        raw_y = []  # The actual labels
         data_len = len(impact_data_list)
         sample_list = random.sample(range(data_len), k=int(data_len * self.impact_model_ratio))
         epsilon = interference_model_config.RATIO_DIVISION_EPSILON
-        # The input feature is (normalized ou model prediction, predicted interference resource util, the predicted
-        # resource util on the same core that the opunit group runs)
-        # The output target is the ratio between the actual resource util (including the elapsed time) and the
-        # normalized ou model prediction
-        for idx in tqdm.tqdm(sample_list, desc="Construct data for the {} model".format(model_name)):
-            d = impact_data_list[idx]
-            ou_model_y_pred.append(d.target_grouped_op_unit_data.y_pred)
-            predicted_elapsed_us = ou_model_y_pred[-1][data_info.instance.target_csv_index[Target.ELAPSED_US]]
-            predicted_resource_util = None
-            if model_name == "impact":
-                predicted_resource_util = d.get_y_pred().copy()
-            if model_name == "direct":
-                predicted_resource_util = d.x.copy()
-            # Remove the OU group itself from the total resource data
-            self_resource = (ou_model_y_pred[-1] * max(1, d.target_grouped_op_unit_data.concurrency) /
-                             len(d.resource_data_list) / interference_model_config.INTERVAL_SIZE)
-            predicted_resource_util[:ou_model_y_pred[-1].shape[0]] -= self_resource
-            predicted_resource_util[predicted_resource_util < 0] = 0
-            # x.append(np.concatenate((ou_model_y_pred[-1] / predicted_elapsed_us,
-            #                          predicted_resource_util,
-            #                          d.resource_util_same_core_x)))
-            x.append(np.concatenate((ou_model_y_pred[-1] / predicted_elapsed_us, predicted_resource_util)))
-            raw_y.append(d.target_grouped_op_unit_data.y)
-            y.append(raw_y[-1] / (ou_model_y_pred[-1] + epsilon))
-            # Do not adjust memory consumption since it shouldn't change
-            y[-1][data_info.instance.target_csv_index[Target.MEMORY_B]] = 1
+        x, y, ou_model_y_pred, raw_y = interference_data_constructing_util.construct_derived_data(
+            impact_data_list, model_name, np.array(sample_list, dtype=np.int64))
+        # Do not adjust memory consumption since it shouldn't change
+        y[:, self.info.target_csv_index[Target.MEMORY_B]] = 1
 
         # Training
         metrics_path = "{}/interference_{}_model_metrics.csv".format(self.model_results_path, model_name)
         prediction_path = "{}/interference_{}_model_prediction.csv".format(self.model_results_path, model_name)
-        x = np.array(x)
-        y = np.array(y)
         trained_model, test_indices = _interference_model_training_process(x, y, self.ml_models, self.test_ratio,
-                                                                           metrics_path, prediction_path)
+                                                                           metrics_path, prediction_path, self.info,
+                                                                           self.search_budget)
 
         # Calculate the accumulated ratio error
-        ou_model_y_pred = np.array(ou_model_y_pred)[test_indices]
-        y_pred = trained_model.predict(x)[test_indices]
+        ou_model_y_pred = ou_model_y_pred[test_indices]
+        with profiling_util.stage("evaluation"):
+            y_pred = trained_model.predict(x)[test_indices]
         raw_y_pred = (ou_model_y_pred + epsilon) * y_pred
-        raw_y = np.array(raw_y)[test_indices]
+        raw_y = raw_y[test_indices]
         accumulated_raw_y = np.sum(raw_y, axis=0)
         accumulated_raw_y_pred = np.sum(raw_y_pred, axis=0)
         original_ratio_error = np.average(np.abs(raw_y - ou_model_y_pred) / (raw_y + epsilon), axis=0)
@@ -245,20 +248,32 @@ if __name__ == '__main__':
                          help='Sampling rate percentage for the transaction OUs (ignored if 0)')
     aparser.add_argument('--network_sample_rate', type=int, default=2,
                          help='Sampling rate percentage for the network OUs (ignored if 0)')
+    aparser.add_argument('--search_budget', type=float, default=None,
+                         help='CPU time budget (seconds) of the hyperparameter search for each model (no search if '
+                              'not set)')
+    aparser.add_argument('--profile_path', default=None,
+                         help='Record the wall time, CPU time and peak RSS of the training stages per model and method '
+                              'in this report file (JSON if it ends with .json, otherwise CSV)')
+    aparser.add_argument('--cprofile_path', default=None,
+                         help='With --profile_path, also dump the cProfile statistics of each stage into this '
+                              'directory')
     aparser.add_argument('--log', default='info', help='The logging level')
     args = aparser.parse_args()
 
     logging_util.init_logging(args.log)
+    if args.profile_path is not None:
+        profiling_util.instance = profiling_util.Profiler(args.cprofile_path)
 
     logging.info("Interference trainer starts.")
 
     with open(args.ou_model_file, 'rb') as pickle_file:
-        model_map, data_info.instance = pickle.load(pickle_file)
+        model_map, info = pickle.load(pickle_file)
+    data_info.set_model_map_info(model_map, info)
     trainer = InterferenceModelTrainer(args.input_path, args.model_results_path, args.ml_models, args.test_ratio,
                                        args.impact_model_ratio, model_map, args.warmup_period,
                                        args.use_query_predict_cache,
                                        args.add_noise, args.predict_ou_only, args.ee_sample_rate, args.txn_sample_rate,
-                                       args.network_sample_rate)
+                                       args.network_sample_rate, args.search_budget, args.ou_model_file)
     trainer.predict_ou_data()
     if not args.predict_ou_only:
         resource_model, impact_model, direct_model = trainer.train()
@@ -268,3 +283,5 @@ if __name__ == '__main__':
             pickle.dump(impact_model, file)
         with open(args.save_path + '/interference_direct_model.pickle', 'wb') as file:
             pickle.dump(direct_model, file)
+    if profiling_util.instance is not None:
+        profiling_util.instance.write_report(args.profile_path)
@@ -2,15 +2,9 @@
 
 import numpy as np
 
-import lightgbm as lgb
-
-from sklearn import linear_model
-from sklearn import kernel_ridge
-from sklearn import ensemble
-from sklearn import preprocessing
-from sklearn import neural_network
-from sklearn import multioutput
-from sklearn import svm
+from .info import data_info
+from .util import profiling_util
+from .numpy_model import InferencePath as _InferencePath, _LOGTRANS_EPS
 
 # import warnings filter
 from warnings import simplefilter
@@ -18,41 +12,121 @@ from warnings import simplefilter
 # ignore all future warnings
 simplefilter(action='ignore', category=FutureWarning)
 
-_LOGTRANS_EPS = 1e-4
+# The number of passes over the data when training the MLP models chunk by chunk
+_PARTIAL_FIT_EPOCHS = 20
+
+# The ML libraries are imported on first use so that loading a trained model only imports the libraries that the
+# model is built with (e.g., LightGBM is only imported for the gbm models)
 
 
-def _get_base_ml_model(method):
+def _get_base_ml_model(method, params=None):
+    # The hyperparameters in params override the default configuration of the method
+    params = {} if params is None else params
     regressor = None
     if method == 'lr':
-        regressor = linear_model.LinearRegression()
+        from sklearn import linear_model
+        regressor = linear_model.LinearRegression(**params)
     if method == 'huber':
-        regressor = linear_model.HuberRegressor(max_iter=50)
+        from sklearn import linear_model, multioutput
+        regressor = linear_model.HuberRegressor(**{'max_iter': 50, **params})
         regressor = multioutput.MultiOutputRegressor(regressor)
     if method == 'svr':
-        regressor = svm.LinearSVR()
+        from sklearn import svm, multioutput
+        regressor = svm.LinearSVR(**params)
         regressor = multioutput.MultiOutputRegressor(regressor)
     if method == 'kr':
-        regressor = kernel_ridge.KernelRidge(kernel='rbf')
+        from sklearn import kernel_ridge
+        regressor = kernel_ridge.KernelRidge(**{'kernel': 'rbf', **params})
     if method == 'rf':
-        regressor = ensemble.RandomForestRegressor(n_estimators=50, n_jobs=8)
+        from sklearn import ensemble
+        regressor = ensemble.RandomForestRegressor(**{'n_estimators': 50, 'n_jobs': 8, **params})
     if method == 'gbm':
-        regressor = lgb.LGBMRegressor(max_depth=20, num_leaves=1000, n_estimators=100, min_child_samples=5,
-                                      random_state=42)
+        import lightgbm as lgb
+        from sklearn import multioutput
+        regressor = lgb.LGBMRegressor(**{'max_depth': 20, 'num_leaves': 1000, 'n_estimators': 100,
+                                         'min_child_samples': 5, 'random_state': 42, **params})
         regressor = multioutput.MultiOutputRegressor(regressor)
     if method == 'nn':
-        regressor = neural_network.MLPRegressor(hidden_layer_sizes=(25, 25), early_stopping=True,
-                                                max_iter=1000000, alpha=5)
+        from sklearn import neural_network
+        regressor = neural_network.MLPRegressor(**{'hidden_layer_sizes': (25, 25), 'early_stopping': True,
+                                                   'max_iter': 1000000, 'alpha': 5, **params})
 
     return regressor
 
 
+def _get_base_model_updater(regressor):
+    # Get the function that continues training the base ML model with new data (None if not supported)
+    from sklearn import multioutput, neural_network
+
+    if isinstance(regressor, multioutput.MultiOutputRegressor) and all(
+            hasattr(estimator, 'booster_') for estimator in regressor.estimators_):
+        def update_gbm(x, y):
+            # Continue boosting from the trees of each target
+            for i, estimator in enumerate(regressor.estimators_):
+                estimator.fit(x, y[:, i], init_model=estimator.booster_)
+
+        return update_gbm
+
+    if isinstance(regressor, neural_network.MLPRegressor):
+        def update_nn(x, y):
+            # Continue the optimization from the existing weights (partial_fit does not support early stopping)
+            regressor.set_params(warm_start=True)
+            regressor.fit(x, y)
+            regressor.set_params(warm_start=False)
+
+        return update_nn
+
+    return None
+
+
+def _get_base_model_chunk_trainer(regressor, chunk_num):
+    """Get the function that trains the base ML model with one chunk of the data at a time
+
+    :param regressor: the untrained base ML model
+    :param chunk_num: the number of chunks in the data
+    :return: (the function (x, y) that trains with one chunk, the number of passes over the chunks), or None if the
+             method does not support partial fitting
+    """
+    from sklearn import base, multioutput, neural_network
+
+    # The booster_ property of an unfitted LightGBM model raises an error, so the class is checked instead
+    if isinstance(regressor, multioutput.MultiOutputRegressor) and hasattr(type(regressor.estimator), 'booster_'):
+        # Boost an equal share of the trees on each chunk, continuing from the trees of the previous chunks
+        tree_num = max(regressor.estimator.get_params()['n_estimators'] // chunk_num, 1)
+        estimators = []
+
+        def train_gbm_chunk(x, y):
+            if len(estimators) == 0:
+                estimators.extend(base.clone(regressor.estimator).set_params(n_estimators=tree_num)
+                                  for _ in range(y.shape[1]))
+                regressor.estimators_ = estimators
+                init_models = [None] * y.shape[1]
+            else:
+                init_models = [estimator.booster_ for estimator in estimators]
+            for i, estimator in enumerate(estimators):
+                estimator.fit(x, y[:, i], init_model=init_models[i])
+
+        return train_gbm_chunk, 1
+
+    if isinstance(regressor, neural_network.MLPRegressor):
+        def train_nn_chunk(x, y):
+            # partial_fit runs one epoch on the chunk and does not support early stopping
+            regressor.set_params(early_stopping=False)
+            regressor.partial_fit(x, y)
+
+        return train_nn_chunk, _PARTIAL_FIT_EPOCHS
+
+    return None
+
+
 class Model:
     """
     The class that wraps around standard ML libraries.
     With the implementation for different normalization handlings
     """
 
-    def __init__(self, method, normalize=True, log_transform=True, y_transformer=None, x_transformer=None):
+    def __init__(self, method, normalize=True, log_transform=True, y_transformer=None, x_transformer=None,
+                 params=None, info=None):
         """
 
         :param method: which ML method to use
@@ -61,55 +135,195 @@ class Model:
         :param y_transformer: the customized data transformer for output (a pair of functions with the first for
                training and second for predict)
         :param x_transformer: the customized data transformer for input
+        :param params: the hyperparameters of the ML method that override its default configuration
+        :param info: the DataInfo of the data that the transformers locate the features and targets with (None to use
+               the global data_info.instance until one is set with set_data_info)
         """
-        self._base_model = _get_base_ml_model(method)
+        from sklearn import preprocessing
+
+        self._base_model = _get_base_ml_model(method, params)
         self._normalize = normalize
         self._log_transform = log_transform
         self._xscaler = preprocessing.StandardScaler()
         self._yscaler = preprocessing.StandardScaler()
         self._y_transformer = y_transformer
         self._x_transformer = x_transformer
+        self._data_info = info
+        self._inference = None
+
+    def get_data_info(self):
+        """
+        :return: the DataInfo of the model, or None if the model uses the global data_info.instance
+        """
+        # The models pickled before the data info was kept with the model do not have the attribute
+        return getattr(self, '_data_info', None)
+
+    def set_data_info(self, info):
+        """Set the DataInfo of the data that the model is trained with
+
+        :param info: the DataInfo
+        """
+        self._data_info = info
 
-    def train(self, x, y):
+    def _get_info(self):
+        # The data info that the transformers use
+        info = self.get_data_info()
+        return data_info.instance if info is None else info
+
+    def train(self, x, y, copy=True):
+        """Train the model
+
+        :param x: the input
+        :param y: the labels
+        :param copy: whether to keep x and y unchanged. If False, the log transformation and the normalization
+               overwrite the (floating point) input arrays instead of allocating the transformed copies
+        """
+        with profiling_util.stage("transform"):
+            if self._y_transformer is not None:
+                y = self._y_transformer[0](x, y, self._get_info())
+
+            if self._x_transformer is not None:
+                x = self._x_transformer(x, self._get_info())
+
+            if self._log_transform:
+                x = _log(x, copy)
+                y = _log(y, copy)
+
+            if self._normalize:
+                x = self._xscaler.fit(x).transform(x, copy=copy)
+                y = self._yscaler.fit(y).transform(y, copy=copy)
+
+        with profiling_util.stage("fit"):
+            self._base_model.fit(x, y)
+        self.compile_inference()
+
+    def train_chunks(self, get_chunks):
+        """Train the model out-of-core with the data streamed in chunks
+
+        The first pass over the chunks fits the normalization. The LightGBM models then boost a share of the trees on
+        each chunk, and the MLP models run partial_fit on each chunk for a fixed number of passes. Only one chunk is
+        transformed at a time.
+
+        :param get_chunks: the function that returns a new iterator over the (x, y) chunks of the data
+        :return: whether the model is trained (the model is unchanged if the method does not support partial fitting)
+        """
+        # Check the support before reading the data
+        if _get_base_model_chunk_trainer(self._base_model, 1) is None:
+            return False
+
+        # The chunks are read and transformed again in each pass, which is recorded as part of the fitting
+        chunk_num = 0
+        with profiling_util.stage("transform"):
+            for x, y in get_chunks():
+                chunk_num += 1
+                if self._normalize:
+                    x, y = self._transform_chunk(x, y, False)
+                    self._xscaler.partial_fit(x)
+                    self._yscaler.partial_fit(y)
+
+        train_chunk, pass_num = _get_base_model_chunk_trainer(self._base_model, max(chunk_num, 1))
+        with profiling_util.stage("fit"):
+            for _ in range(pass_num):
+                for x, y in get_chunks():
+                    train_chunk(*self._transform_chunk(x, y, self._normalize))
+        self.compile_inference()
+        return True
+
+    def _transform_chunk(self, x, y, normalize):
+        # Apply the training transformations to a chunk in place (the chunks are not reused)
         if self._y_transformer is not None:
-            y = self._y_transformer[0](x, y)
+            y = self._y_transformer[0](x, y, self._get_info())
 
         if self._x_transformer is not None:
-            x = self._x_transformer(x)
+            x = self._x_transformer(x, self._get_info())
 
         if self._log_transform:
-            x = np.log(x + _LOGTRANS_EPS)
-            y = np.log(y + _LOGTRANS_EPS)
+            x = _log(x, False)
+            y = _log(y, False)
+
+        if normalize:
+            x = self._xscaler.transform(x, copy=False)
+            y = self._yscaler.transform(y, copy=False)
+        return x, y
+
+    def update(self, x, y):
+        """Continue training the model with new data
+
+        The normalization of the previous training is kept. The LightGBM models continue boosting from the existing
+        trees, and the MLP models continue from the existing weights. The other methods are not supported.
 
-        if self._normalize:
-            x = self._xscaler.fit_transform(x)
-            y = self._yscaler.fit_transform(y)
+        :param x: the input of the new data
+        :param y: the labels of the new data
+        :return: whether the model is updated (the model is unchanged if the method does not support it)
+        """
+        update_base_model = _get_base_model_updater(self._base_model)
+        if update_base_model is None:
+            return False
+
+        with profiling_util.stage("transform"):
+            if self._y_transformer is not None:
+                y = self._y_transformer[0](x, y, self._get_info())
+
+            if self._x_transformer is not None:
+                x = self._x_transformer(x, self._get_info())
+
+            if self._log_transform:
+                x = np.log(x + _LOGTRANS_EPS)
+                y = np.log(y + _LOGTRANS_EPS)
+
+            if self._normalize:
+                x = self._xscaler.transform(x)
+                y = self._yscaler.transform(y)
+
+        with profiling_util.stage("fit"):
+            update_base_model(x, y)
+        self.compile_inference()
+        return True
+
+    def compile_inference(self, dtype=np.float64):
+        """Precompute the inference path of the trained model
 
-        self._base_model.fit(x, y)
+        The scaler parameters are extracted once, and the feature and target transformations are fused into in-place
+        ufunc calls on reused buffers. Called with float64 at the end of each training, so the prediction does not
+        modify the model.
+
+        :param dtype: the floating point type of the transformations (float32 is faster but less precise)
+        :return: the compiled inference path
+        """
+        self._inference = _InferencePath(self, dtype)
+        return self._inference
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # The models pickled before the inference path was compiled with the training do not have one
+        if '_inference' not in state:
+            self.compile_inference()
 
     def predict(self, x):
         original_x = x
+        inference = self._inference
 
         if self._x_transformer is not None:
-            x = self._x_transformer(x)
+            x = self._x_transformer(x, self._get_info())
 
         # transform the features
-        if self._log_transform:
-            x = np.log(x + _LOGTRANS_EPS)
-        if self._normalize:
-            x = self._xscaler.transform(x)
+        x = inference.transform_x(x)
 
         # make prediction
         y = self._base_model.predict(x)
 
         # transform the y back
-        if self._normalize:
-            y = self._yscaler.inverse_transform(y)
-        if self._log_transform:
-            y = np.exp(y) - _LOGTRANS_EPS
-            y = np.clip(y, 0, None)
+        y = inference.inverse_transform_y(y)
 
         if self._y_transformer is not None:
-            y = self._y_transformer[1](original_x, y)
+            y = self._y_transformer[1](original_x, y, self._get_info())
 
         return y
+
+
+def _log(x, copy):
+    # The log transformation, in place if the copy is not needed and x is a floating point array
+    if copy or not np.issubdtype(np.asarray(x).dtype, np.floating):
+        return np.log(x + _LOGTRANS_EPS)
+    x += _LOGTRANS_EPS
+    return np.log(x, out=x)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import pickle
+
+import numpy as np
+
+from sklearn import ensemble
+from sklearn import linear_model
+from sklearn import multioutput
+from sklearn import neural_network
+from sklearn import svm
+
+from . import numpy_model
+from .util import logging_util
+
+# The LightGBM objectives whose predictions are the raw scores (no output transformation)
+_LGB_IDENTITY_OBJECTIVES = {'regression', 'regression_l1', 'huber', 'fair', 'quantile', 'mape'}
+
+_LGB_MISSING_TYPES = {'None': numpy_model.MISSING_NONE, 'Zero': numpy_model.MISSING_ZERO,
+                      'NaN': numpy_model.MISSING_NAN}
+
+
+def export_model(model):
+    """Convert a trained Model into a NumpyModel that predicts without the ML libraries
+
+    :param model: the trained Model
+    :return: the NumpyModel with the same predictions
+    """
+    method, regressor = _export_regressor(model._base_model)
+    return numpy_model.NumpyModel(method, regressor, numpy_model.InferencePath(model, np.float64),
+                                  model._y_transformer, model._x_transformer, model.get_data_info())
+
+
+def export_model_map(model_map):
+    """Convert the trained Models in a model map (e.g., the OU model map)
+
+    The models with unsupported ML methods are kept as they are.
+
+    :param model_map: the map from the key (e.g., OpUnit) to the trained Model
+    :return: the map from the key to the exported model
+    """
+    exported_model_map = {}
+    for key, model in model_map.items():
+        try:
+            exported_model_map[key] = export_model(model)
+        except ValueError as e:
+            logging.warning("Keeping the original model for {}: {}".format(key, e))
+            exported_model_map[key] = model
+    return exported_model_map
+
+
+def _export_regressor(regressor):
+    # Convert the base ML model into the NumPy evaluator and return it with the name of the ML method
+    if isinstance(regressor, multioutput.MultiOutputRegressor):
+        estimators = regressor.estimators_
+        if all(isinstance(e, (linear_model.HuberRegressor, svm.LinearSVR)) for e in estimators):
+            method = 'huber' if isinstance(estimators[0], linear_model.HuberRegressor) else 'svr'
+            coef = np.stack([e.coef_ for e in estimators])
+            intercept = np.array([np.ravel(e.intercept_)[0] for e in estimators])
+            return method, numpy_model.LinearRegressor(coef, intercept)
+        if all(hasattr(e, 'booster_') for e in estimators):
+            return 'gbm', _export_lgb_boosters([e.booster_ for e in estimators])
+        raise ValueError("Unsupported multi-output regressor {}".format(type(estimators[0]).__name__))
+
+    if isinstance(regressor, linear_model.LinearRegression):
+        coef = np.atleast_2d(regressor.coef_)
+        intercept = np.broadcast_to(regressor.intercept_, coef.shape[0])
+        return 'lr', numpy_model.LinearRegressor(coef, intercept)
+    if isinstance(regressor, ensemble.RandomForestRegressor):
+        return 'rf', _export_sklearn_forest(regressor)
+    if isinstance(regressor, neural_network.MLPRegressor):
+        return 'nn', numpy_model.MLPRegressor(regressor.coefs_, regressor.intercepts_, regressor.activation,
+                                              regressor.out_activation_)
+    raise ValueError("Unsupported regressor {}".format(type(regressor).__name__))
+
+
+def _export_sklearn_forest(forest):
+    # Concatenate the node arrays of the sklearn trees
+    feature_list, threshold_list, left_list, right_list, value_list, default_left_list = [], [], [], [], [], []
+    roots = []
+    node_num = 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        is_leaf = tree.children_left < 0
+        roots.append(node_num)
+        feature_list.append(np.where(is_leaf, 0, tree.feature))
+        threshold_list.append(tree.threshold)
+        left_list.append(np.where(is_leaf, -1, tree.children_left + node_num))
+        right_list.append(np.where(is_leaf, -1, tree.children_right + node_num))
+        value_list.append(tree.value.reshape(tree.node_count, -1))
+        default_left_list.append(np.asarray(tree.missing_go_to_left, dtype=bool))
+        node_num += tree.node_count
+
+    # sklearn compares the features in float32 and sends NaN to the side chosen at training time
+    return numpy_model.TreeEnsembleRegressor(np.concatenate(feature_list), np.concatenate(threshold_list),
+                                             np.concatenate(left_list), np.concatenate(right_list),
+                                             np.concatenate(value_list), roots, average=True,
+                                             missing_type=np.full(node_num, numpy_model.MISSING_NAN),
+                                             default_left=np.concatenate(default_left_list), input_dtype=np.float32)
+
+
+def _export_lgb_boosters(boosters):
+    # Concatenate the trees of the LightGBM boosters (one booster for each target)
+    nodes = []
+    roots = []
+    output_offsets = [0]
+    for booster in boosters:
+        dump = booster.dump_model()
+        objective = dump['objective'].split()[0]
+        if objective not in _LGB_IDENTITY_OBJECTIVES or dump['num_tree_per_iteration'] != 1:
+            raise ValueError("Unsupported LightGBM objective {}".format(dump['objective']))
+        if dump['average_output']:
+            raise ValueError("Unsupported LightGBM random forest mode")
+        for tree_info in dump['tree_info']:
+            roots.append(len(nodes))
+            _append_lgb_tree(nodes, tree_info['tree_structure'])
+        output_offsets.append(len(roots))
+
+    feature, threshold, left, right, value, missing_type, default_left = (np.array(column) for column in zip(*nodes))
+    return numpy_model.TreeEnsembleRegressor(feature, threshold, left, right, value.reshape(-1, 1), roots,
+                                             output_offsets=output_offsets, missing_type=missing_type,
+                                             default_left=default_left)
+
+
+def _append_lgb_tree(nodes, root):
+    """Append the nodes of a dumped LightGBM tree in depth-first order
+
+    :param nodes: the list of (feature, threshold, left, right, value, missing_type, default_left) to append to
+    :param root: the tree structure from Booster.dump_model()
+    """
+    # (node structure, index of the parent, whether it is the left child)
+    stack = [(root, None, False)]
+    while len(stack) > 0:
+        node, parent, is_left = stack.pop()
+        index = len(nodes)
+        if parent is not None:
+            nodes[parent][2 if is_left else 3] = index
+
+        if 'leaf_value' in node:
+            nodes.append([0, 0.0, -1, -1, node['leaf_value'], numpy_model.MISSING_NONE, False])
+            continue
+        if node['decision_type'] != '<=':
+            raise ValueError("Unsupported LightGBM split {}".format(node['decision_type']))
+        nodes.append([node['split_feature'], node['threshold'], None, None, 0.0,
+                      _LGB_MISSING_TYPES[node['missing_type']], node['default_left']])
+        stack.append((node['right_child'], index, False))
+        stack.append((node['left_child'], index, True))
+
+
+# ==============================================
+# main
+# ==============================================
+if __name__ == '__main__':
+    aparser = argparse.ArgumentParser(description='Model Exporter')
+    aparser.add_argument('--model_file', default='modeling/trained_model/ou_model_map.pickle',
+                         help='Trained model file (the OU model map with the data info, or a single model)')
+    aparser.add_argument('--save_path', default='modeling/trained_model/ou_model_map_numpy.pickle',
+                         help='Path to save the exported models (same layout as the input file)')
+    aparser.add_argument('--log', default='info', help='The logging level')
+    args = aparser.parse_args()
+
+    logging_util.init_logging(args.log)
+    with open(args.model_file, 'rb') as pickle_file:
+        models = pickle.load(pickle_file)
+
+    if isinstance(models, tuple):
+        # The OU model map is saved together with the data info
+        exported_models = (export_model_map(models[0]),) + models[1:]
+    elif isinstance(models, dict):
+        exported_models = export_model_map(models)
+    else:
+        exported_models = export_model(models)
+
+    with open(args.save_path, 'wb') as file:
+        pickle.dump(exported_models, file)
+    logging.info("Exported the models in {} to {}".format(args.model_file, args.save_path))
@@ -0,0 +1,327 @@
+import threading
+
+import numpy as np
+
+from .info import data_info
+
+# This module only depends on NumPy so that the exported models can be loaded and evaluated without importing the
+# ML libraries that trained them
+
+_LOGTRANS_EPS = 1e-4
+
+# LightGBM treats the values within this range as zero when the missing type of a split is "Zero"
+_LGB_ZERO_THRESHOLD = 1e-35
+
+# The missing value handling of a tree split
+MISSING_NONE = 0
+MISSING_ZERO = 1
+MISSING_NAN = 2
+
+# The maximum number of (row, tree) pairs to traverse at once
+_TREE_TRAVERSAL_CHUNK_SIZE = 1 << 20
+
+# The maximum number of rows of the batches transformed in a reused buffer. The small batches (e.g., the single queries
+# of the model server) are dominated by the allocation, while the larger ones are allocated per call so that the buffers
+# do not hold on to the memory of the largest batch
+_BUFFER_MAX_ROWS = 64
+
+
+class InferencePath:
+    """
+    The precomputed transformations for the inference of a trained Model
+    """
+
+    def __init__(self, model, dtype):
+        """
+        :param model: the trained Model
+        :param dtype: the floating point type of the transformations
+        """
+        self._dtype = np.dtype(dtype)
+        self._log_transform = model._log_transform
+        self._x_mean = None
+        self._x_scale = None
+        self._y_mean = None
+        self._y_scale = None
+        if model._normalize:
+            self._x_mean = model._xscaler.mean_.astype(self._dtype)
+            self._x_scale = model._xscaler.scale_.astype(self._dtype)
+            self._y_mean = model._yscaler.mean_.astype(self._dtype)
+            self._y_scale = model._yscaler.scale_.astype(self._dtype)
+        # The buffers for the small batches, one per thread so that the predictions are reentrant
+        self._local = threading.local()
+
+    def __getstate__(self):
+        # Do not pickle the buffers
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def transform_x(self, x):
+        """Apply the log transformation and the normalization to the features
+
+        :param x: the features (not modified)
+        :return: the transformed features, which may be in a reused buffer (valid until the next call in the same
+                 thread)
+        """
+        n, feature_num = x.shape
+        if n <= _BUFFER_MAX_ROWS:
+            buffer = getattr(self._local, 'buffer', None)
+            if buffer is None or buffer.shape[1] != feature_num:
+                buffer = np.empty((_BUFFER_MAX_ROWS, feature_num), dtype=self._dtype)
+                self._local.buffer = buffer
+            buffer = buffer[:n]
+        else:
+            buffer = np.empty((n, feature_num), dtype=self._dtype)
+
+        if self._log_transform:
+            np.add(x, _LOGTRANS_EPS, out=buffer, casting='same_kind')
+            np.log(buffer, out=buffer)
+        else:
+            buffer[...] = x
+        if self._x_mean is not None:
+            buffer -= self._x_mean
+            buffer /= self._x_scale
+        return buffer
+
+    def inverse_transform_y(self, y):
+        """Revert the normalization and the log transformation of the predictions (in place when possible)
+
+        :param y: the raw predictions of the base model
+        :return: the predictions in the original scale
+        """
+        y = np.asarray(y, dtype=self._dtype)
+        if self._y_mean is not None:
+            y *= self._y_scale
+            y += self._y_mean
+        if self._log_transform:
+            np.exp(y, out=y)
+            y -= _LOGTRANS_EPS
+            np.maximum(y, 0, out=y)
+        return y
+
+
+class NumpyModel:
+    """
+    The exported counterpart of a trained Model that predicts with pure NumPy evaluators.
+    Created by model_exporter.export_model() and used the same way as the Model (only for prediction)
+    """
+
+    def __init__(self, method, regressor, inference, y_transformer=None, x_transformer=None, info=None):
+        """
+        :param method: the ML method of the original model
+        :param regressor: the NumPy evaluator of the base ML model (LinearRegressor, TreeEnsembleRegressor, or
+               MLPRegressor)
+        :param inference: the InferencePath of the original model
+        :param y_transformer: the customized data transformer for output of the original model
+        :param x_transformer: the customized data transformer for input of the original model
+        :param info: the DataInfo of the original model (None to use the global data_info.instance)
+        """
+        self.method = method
+        self._regressor = regressor
+        self._inference = inference
+        self._y_transformer = y_transformer
+        self._x_transformer = x_transformer
+        self._data_info = info
+
+    def get_data_info(self):
+        """
+        :return: the DataInfo of the model, or None if the model uses the global data_info.instance
+        """
+        return getattr(self, '_data_info', None)
+
+    def set_data_info(self, info):
+        """Set the DataInfo of the original model
+
+        :param info: the DataInfo
+        """
+        self._data_info = info
+
+    def predict(self, x):
+        original_x = x
+        info = self.get_data_info()
+        if info is None:
+            info = data_info.instance
+
+        if self._x_transformer is not None:
+            x = self._x_transformer(x, info)
+
+        x = self._inference.transform_x(x)
+        y = self._regressor.predict(x)
+        y = self._inference.inverse_transform_y(y)
+
+        if self._y_transformer is not None:
+            y = self._y_transformer[1](original_x, y, info)
+
+        return y
+
+
+class LinearRegressor:
+    """
+    Linear model y = x * coef^T + intercept (linear regression, Huber, LinearSVR)
+    """
+
+    def __init__(self, coef, intercept):
+        """
+        :param coef: the coefficient matrix (target_num x feature_num)
+        :param intercept: the intercepts (target_num)
+        """
+        self.coef = np.ascontiguousarray(coef, dtype=np.float64)
+        self.intercept = np.ascontiguousarray(intercept, dtype=np.float64)
+
+    def predict(self, x):
+        y = x @ self.coef.T
+        y += self.intercept
+        return y
+
+
+class TreeEnsembleRegressor:
+    """
+    Ensemble of binary regression trees (random forest, LightGBM) stored in flattened node arrays.
+
+    The nodes of all the trees are concatenated. A split node goes to left[i] if x[feature[i]] <= threshold[i] and to
+    right[i] otherwise. The children of a leaf node are -1.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, output_offsets=None, average=False,
+                 missing_type=None, default_left=None, input_dtype=np.float64):
+        """
+        :param feature: the split feature of each node
+        :param threshold: the split threshold of each node
+        :param left: the index of the left child of each node
+        :param right: the index of the right child of each node
+        :param value: the value of each node (node_num x value_num)
+        :param roots: the index of the root node of each tree
+        :param output_offsets: if not None, each tree predicts one target with a scalar value and the trees of target
+               i are [output_offsets[i], output_offsets[i + 1]). Otherwise each tree predicts all the targets
+        :param average: whether to average (random forest) instead of summing (boosting) the predictions of the trees
+        :param missing_type: the missing value handling (MISSING_*) of each node, None for no handling
+        :param default_left: whether the missing values go to the left child for each node
+        :param input_dtype: the type that the features are converted to before being compared with the thresholds
+        """
+        self.feature = np.ascontiguousarray(feature, dtype=np.intp)
+        self.threshold = np.ascontiguousarray(threshold, dtype=np.float64)
+        self.left = np.ascontiguousarray(left, dtype=np.intp)
+        self.right = np.ascontiguousarray(right, dtype=np.intp)
+        self.value = np.ascontiguousarray(value, dtype=np.float64)
+        self.roots = np.ascontiguousarray(roots, dtype=np.intp)
+        self.output_offsets = None if output_offsets is None else np.asarray(output_offsets, dtype=np.intp)
+        self.average = average
+        self.missing_type = None if missing_type is None else np.ascontiguousarray(missing_type, dtype=np.int8)
+        self.default_left = None if default_left is None else np.ascontiguousarray(default_left, dtype=bool)
+        self.input_dtype = np.dtype(input_dtype)
+        self._has_zero_missing = self.missing_type is not None and bool(np.any(self.missing_type == MISSING_ZERO))
+        self._is_leaf = self.left < 0
+        # The right and the left child of each node interleaved so that the next node is children[2 * node + go_left]
+        self._children = np.stack([self.right, self.left], axis=1).ravel()
+
+    def predict(self, x):
+        x = np.asarray(x, dtype=self.input_dtype)
+        tree_num = len(self.roots)
+        if self.output_offsets is None:
+            y = np.zeros((x.shape[0], self.value.shape[1]))
+        else:
+            y = np.zeros((x.shape[0], len(self.output_offsets) - 1))
+
+        chunk_size = max(1, _TREE_TRAVERSAL_CHUNK_SIZE // max(tree_num, 1))
+        for start in range(0, x.shape[0], chunk_size):
+            end = min(start + chunk_size, x.shape[0])
+            leaves = self.apply(x[start:end])
+            if self.output_offsets is None:
+                y[start:end] = self.value[leaves].sum(axis=1)
+            else:
+                leaf_value = self.value[leaves, 0]
+                for i in range(len(self.output_offsets) - 1):
+                    y[start:end, i] = leaf_value[:, self.output_offsets[i]:self.output_offsets[i + 1]].sum(axis=1)
+
+        if self.average:
+            y /= tree_num
+        return y
+
+    def apply(self, x):
+        """Find the leaf that each row falls into for every tree
+
+        :param x: the features (already converted to input_dtype)
+        :return: the leaf node indices (row_num x tree_num)
+        """
+        # Gather the features and the children from the flattened arrays
+        tree_num = len(self.roots)
+        flat_x = x.ravel()
+        row_offsets = np.repeat(np.arange(x.shape[0]) * x.shape[1], tree_num)
+        handle_missing = self.missing_type is not None and (self._has_zero_missing or np.isnan(flat_x).any())
+
+        # Only advance the (row, tree) pairs that have not reached the leaves
+        node = np.tile(self.roots, x.shape[0])
+        active = np.flatnonzero(~self._is_leaf[node])
+        active_node = node[active]
+        active_row_offsets = row_offsets[active]
+        while len(active) > 0:
+            value = flat_x[active_row_offsets + self.feature[active_node]]
+            if handle_missing:
+                go_left = self._go_left_with_missing(active_node, value)
+            else:
+                go_left = value <= self.threshold[active_node]
+            active_node = self._children[2 * active_node + go_left]
+            node[active] = active_node
+            not_leaf = ~self._is_leaf[active_node]
+            active = active[not_leaf]
+            active_node = active_node[not_leaf]
+            active_row_offsets = active_row_offsets[not_leaf]
+        return node.reshape(x.shape[0], tree_num)
+
+    def _go_left_with_missing(self, node, value):
+        # Send the missing values to the default side of the split
+        missing_type = self.missing_type[node]
+        is_nan = np.isnan(value)
+        # The NaN values are treated as zero when the split does not handle NaN
+        value = np.where(is_nan & (missing_type != MISSING_NAN), 0, value)
+        missing = ((missing_type == MISSING_NAN) & is_nan) | (
+                (missing_type == MISSING_ZERO) & (np.abs(value) <= _LGB_ZERO_THRESHOLD))
+        return np.where(missing, self.default_left[node], value <= self.threshold[node])
+
+
+class MLPRegressor:
+    """
+    Multi-layer perceptron with dense layers
+    """
+
+    _ACTIVATIONS = ('identity', 'relu', 'tanh', 'logistic')
+
+    def __init__(self, coefs, intercepts, activation, out_activation='identity'):
+        """
+        :param coefs: the weight matrix of each layer (input_num x output_num)
+        :param intercepts: the bias of each layer
+        :param activation: the activation function of the hidden layers
+        :param out_activation: the activation function of the output layer
+        """
+        if activation not in self._ACTIVATIONS or out_activation not in self._ACTIVATIONS:
+            raise ValueError("Unsupported MLP activation {}/{}".format(activation, out_activation))
+        self.coefs = [np.ascontiguousarray(coef, dtype=np.float64) for coef in coefs]
+        self.intercepts = [np.ascontiguousarray(intercept, dtype=np.float64) for intercept in intercepts]
+        self.activation = activation
+        self.out_activation = out_activation
+
+    def predict(self, x):
+        y = x
+        layer_num = len(self.coefs)
+        for i in range(layer_num):
+            y = y @ self.coefs[i]
+            y += self.intercepts[i]
+            _activate(y, self.activation if i != layer_num - 1 else self.out_activation)
+        return y
+
+
+def _activate(x, activation):
+    # Apply the activation function in place
+    if activation == 'relu':
+        np.maximum(x, 0, out=x)
+    elif activation == 'tanh':
+        np.tanh(x, out=x)
+    elif activation == 'logistic':
+        np.negative(x, out=x)
+        np.exp(x, out=x)
+        x += 1
+        np.reciprocal(x, out=x)
@@ -1,5 +1,9 @@
+import copy
 import glob
+import hashlib
+import math
 import os
+import time
 import numpy as np
 import argparse
 import pickle
@@ -8,23 +12,92 @@ import logging
 from sklearn import model_selection
 
 from . import model
-from .util import io_util, logging_util
+from .util import io_util, logging_util, profiling_util
 from .data import opunit_data
 from .info import data_info
-from .training_util import data_transforming_util, result_writing_util
+from .training_util import data_reduction_util, data_transforming_util, hyperparameter_search_util, \
+    model_compression_util, result_writing_util
 from .type import Target
 
 np.set_printoptions(precision=4)
 np.set_printoptions(edgeitems=10)
 np.set_printoptions(suppress=True)
 
+# The header of the report of the data reduction (the errors are the percentage errors of the evaluated target)
+_REDUCTION_HEADER = ["OpUnit", "Method", "Training Rows", "Reduced Rows", "Full Error", "Reduced Error",
+                     "Error Delta", "Full Training Seconds", "Reduced Training Seconds"]
+
+# The header of the report of the prediction latency of the candidate models
+_LATENCY_HEADER = ["OpUnit", "Method", "Test Error", "Latency Us", "Score"]
+
+
+def _get_percentage_error(evaluate_y, y_pred):
+    """Get the percentage error of each target
+
+    In order to avoid the percentage error to explode when the actual label is very small, we omit the data point with
+    the actual label <= 5 when calculating the percentage error (by essentially giving the data points with small labels
+    a very small weight)
+
+    :param evaluate_y: the actual labels
+    :param y_pred: the predicted labels
+    :return: the percentage error of each target
+    """
+    error_bias = 1
+    evaluate_threshold = 5
+    weights = np.where(evaluate_y > evaluate_threshold, np.ones(evaluate_y.shape), np.full(evaluate_y.shape, 1e-6))
+    return np.average(np.abs(evaluate_y - y_pred) / (evaluate_y + error_bias), axis=0, weights=weights)
+
+
+def _get_data_digest(x, y):
+    # The digest of the training data to detect whether the data of an opunit has changed
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(x).tobytes())
+    digest.update(np.ascontiguousarray(y).tobytes())
+    return digest.hexdigest()
+
+
+def get_training_state_file(model_file):
+    """Get the file that stores the training state along with a saved model map
+
+    :param model_file: the file of the saved model map
+    :return: the training state file
+    """
+    return os.path.splitext(str(model_file))[0] + '_training_state.pickle'
+
+
+def get_checkpoint_file(model_file):
+    """Get the file that stores the checkpoint of an unfinished training of a model map
+
+    :param model_file: the file of the saved model map
+    :return: the checkpoint file
+    """
+    return os.path.splitext(str(model_file))[0] + '_checkpoint.pickle'
+
+
+def load_checkpoint(checkpoint_file):
+    """Load the checkpoint of an unfinished training
+
+    :param checkpoint_file: the checkpoint file
+    :return: (the model map, the data info, the training state) of the trained opunits, to resume the training with
+             OUModelTrainer (with the data info) and OUModelTrainer.train, or (None, None, None) if there is no
+             checkpoint
+    """
+    if not os.path.exists(checkpoint_file):
+        return None, None, None
+    with open(checkpoint_file, 'rb') as pickle_file:
+        model_map, info, training_state = pickle.load(pickle_file)
+    logging.info("Resuming the training of {} opunits from {}".format(len(model_map), checkpoint_file))
+    return model_map, info, training_state
+
 
 class OUModelTrainer:
     """
     Trainer for the ou models
     """
 
-    def __init__(self, input_path, model_metrics_path, ml_models, test_ratio, trim, expose_all, txn_sample_rate):
+    def __init__(self, input_path, model_metrics_path, ml_models, test_ratio, trim, expose_all, txn_sample_rate,
+                 search_budget=None, chunk_size=None, max_memory_rows=None, reduction_budget=None,
+                 evaluate_reduction=False, latency_penalty=0, latency_budget=None, info=None):
         self.input_path = input_path
         self.model_metrics_path = model_metrics_path
         self.ml_models = ml_models
@@ -34,11 +107,51 @@ class OUModelTrainer:
         self.trim = trim
         self.expose_all = expose_all
         self.txn_sample_rate = txn_sample_rate
+        # The CPU time budget (in seconds) of the hyperparameter search for each opunit (None to evaluate each method
+        # with its default configuration)
+        self.search_budget = search_budget
+        # The number of rows to read at a time for the memory-bounded training (None to load each file at once). The
+        # data is then kept in float32, and it is split and transformed in place
+        self.chunk_size = chunk_size
+        # The maximum number of rows of an opunit to hold in memory with the memory-bounded training. The larger
+        # opunits select the model on a sample of the rows and train the final model out-of-core (if supported)
+        self.max_memory_rows = max_memory_rows
+        if max_memory_rows is not None and chunk_size is None:
+            raise ValueError("max_memory_rows requires chunk_size")
+        # The maximum number of rows to train the models of an opunit with (None to train with all the rows). The
+        # identical feature rows are merged and the rest are sampled across the feature space (see data_reduction_util)
+        self.reduction_budget = reduction_budget
+        # Whether to also train the selected model on the unreduced training data to record the error of the reduction
+        self.evaluate_reduction = evaluate_reduction
+        if evaluate_reduction and reduction_budget is None:
+            raise ValueError("evaluate_reduction requires reduction_budget")
+        # The test error added to a candidate model per microsecond of its prediction time per row, to prefer the
+        # faster models that are nearly as accurate
+        self.latency_penalty = latency_penalty
+        # The maximum prediction time per row (in microseconds) of the selected models (None for no limit). The models
+        # within the budget are preferred, and a selected model over the budget is compressed if possible
+        self.latency_budget = latency_budget
+        # The data info that the data is parsed into and the models locate the features and targets with. The
+        # incremental (or resumed) training starts from a copy of the data info of the previous models, since the
+        # files of the reused opunits are not parsed again
+        self.info = data_info.DataInfo() if info is None else copy.deepcopy(info)
+        self.training_state = None
+        # The opunit that is being trained, and the number of opunits whose training is done
+        self.current_opunit = None
+        self.trained_opunit_num = 0
 
     def get_model_map(self):
         return self.model_map
 
-    def train_specific_model(self, data, y_transformer_idx, method_idx):
+    def get_training_state(self):
+        """Get the state of the last training that allows the next training to be incremental
+
+        :return: {config: the training parameters, files: {file name: (fingerprint, opunits)},
+                  opunits: {opunit: (number of rows, digest of the data), or None if the data is sampled}}
+        """
+        return self.training_state
+
+    def train_specific_model(self, data, y_transformer_idx, method_idx, params=None, teacher=None):
         methods = self.ml_models
         method = methods[method_idx]
         label = method if y_transformer_idx == 0 else method + " transform"
@@ -47,14 +160,26 @@ class OUModelTrainer:
         y_transformers = [None, data_transforming_util.OPUNIT_Y_TRANSFORMER_MAP[data.opunit]]
         x_transformer = data_transforming_util.OPUNIT_X_TRANSFORMER_MAP[data.opunit]
         regressor = model.Model(methods[method_idx], y_transformer=y_transformers[y_transformer_idx],
-                                x_transformer=x_transformer)
-        regressor.train(data.x, data.y)
+                                x_transformer=x_transformer, params=params, info=self.info)
+        with profiling_util.stage("final_training", method=label):
+            # The distilled models are trained in memory on the predictions of the teacher model
+            if data.source is None or teacher is not None or not regressor.train_chunks(
+                    lambda: opunit_data.iterate_ou_runner_chunks(data.source, self.chunk_size, self.info)):
+                if data.source is not None:
+                    logging.info("Training {} on the sampled data since it cannot be trained out-of-core".format(
+                        label))
+                x, y = self._reduce_data(data.opunit, data.x, data.y)
+                if teacher is not None:
+                    y = teacher.predict(x)
+                # The data is not used after the final training, so the memory-bounded training transforms it in
+                # place
+                regressor.train(x, y, copy=self.chunk_size is None)
         self.model_map[data.opunit] = regressor
 
     def train_data(self, data, summary_file):
-        x_train, x_test, y_train, y_test = model_selection.train_test_split(data.x, data.y,
-                                                                            test_size=self.test_ratio,
-                                                                            random_state=0)
+        x_train, x_test, y_train, y_test = self._split_data(data)
+        full_train = (x_train, y_train)
+        x_train, y_train = self._reduce_data(data.opunit, x_train, y_train)
 
         # Write the first header rwo to the result file
         metrics_path = "{}/{}.csv".format(self.model_metrics_path, data.opunit.name.lower())
@@ -70,21 +195,27 @@ class OUModelTrainer:
         #    transformers.append(modeling_transformer)
         x_transformer = data_transforming_util.OPUNIT_X_TRANSFORMER_MAP[data.opunit]
 
-        error_bias = 1
-        min_percentage_error = 2
+        # The models with a larger test error are not selected
+        max_percentage_error = 2
         pred_results = None
-        elapsed_us_index = data_info.instance.target_csv_index[Target.ELAPSED_US]
-        memory_b_index = data_info.instance.target_csv_index[Target.MEMORY_B]
+        elapsed_us_index = self.info.target_csv_index[Target.ELAPSED_US]
+        memory_b_index = self.info.target_csv_index[Target.MEMORY_B]
 
         best_y_transformer = -1
         best_method = -1
+        best_score = None
+        best_regressor = None
+        # The prediction latency of each method (with the target transformer)
+        latencies = {}
         for i, y_transformer in enumerate(y_transformers):
             for m, method in enumerate(methods):
                 # Train the model
                 label = method if i == 0 else method + " transform"
                 logging.info("{} {}".format(data.opunit.name, label))
-                regressor = model.Model(method, y_transformer=y_transformer, x_transformer=x_transformer)
-                regressor.train(x_train, y_train)
+                regressor = model.Model(method, y_transformer=y_transformer, x_transformer=x_transformer,
+                                        info=self.info)
+                with profiling_util.label(method=label):
+                    regressor.train(x_train, y_train)
 
                 # Evaluate on both the training and test set
                 results = []
@@ -94,16 +225,11 @@ class OUModelTrainer:
                     evaluate_x = d[0]
                     evaluate_y = d[1]
 
-                    y_pred = regressor.predict(evaluate_x)
+                    with profiling_util.stage("evaluation", method=label):
+                        y_pred = regressor.predict(evaluate_x)
+                        percentage_error = _get_percentage_error(evaluate_y, y_pred)
                     logging.debug("x shape: {}".format(evaluate_x.shape))
                     logging.debug("y shape: {}".format(y_pred.shape))
-                    # In order to avoid the percentage error to explode when the actual label is very small,
-                    # we omit the data point with the actual label <= 5 when calculating the percentage error (by
-                    # essentially giving the data points with small labels a very small weight)
-                    evaluate_threshold = 5
-                    weights = np.where(evaluate_y > evaluate_threshold, np.ones(evaluate_y.shape), np.full(evaluate_y.shape, 1e-6))
-                    percentage_error = np.average(np.abs(evaluate_y - y_pred) / (evaluate_y + error_bias), axis=0,
-                                                  weights=weights)
                     results += list(percentage_error) + [""]
 
                     logging.info('{} Percentage Error: {}'.format(train_test_label[j], percentage_error))
@@ -112,20 +238,27 @@ class OUModelTrainer:
                     # on the elapsed us. For any opunits in MEM_EVALUATE_OPUNITS, we evaluate by comparing the
                     # model error on memory_b.
                     eval_error = percentage_error[elapsed_us_index]
-                    if data.opunit in data_info.instance.MEM_EVALUATE_OPUNITS:
+                    if data.opunit in self.info.MEM_EVALUATE_OPUNITS:
                         eval_error = percentage_error[memory_b_index]
 
+                    if j == 1:
+                        latency = self._measure_latency(data.opunit, label, regressor, evaluate_x, eval_error)
+                        score = eval_error + self.latency_penalty * latency
+                        if y_transformer == y_transformers[-1]:
+                            latencies[method] = latency
+
                     # Record the model with the lowest elapsed time prediction (since that might be the most
-                    # important prediction)
+                    # important prediction) plus the latency penalty, preferring the models within the latency budget
                     # Only use linear regression for the arithmetic operating units
-                    if (j == 1 and eval_error < min_percentage_error
+                    if (j == 1 and eval_error < max_percentage_error
                             and y_transformer == y_transformers[-1]
-                            and (data.opunit not in data_info.instance.ARITHMETIC_OPUNITS or method == 'lr')):
-                        min_percentage_error = eval_error
-                        if self.expose_all:
-                            best_y_transformer = i
-                            best_method = m
-                        else:
+                            and (data.opunit not in self.info.ARITHMETIC_OPUNITS or method == 'lr')
+                            and (best_score is None or (self._is_over_latency_budget(latency), score) < best_score)):
+                        best_score = (self._is_over_latency_budget(latency), score)
+                        best_y_transformer = i
+                        best_method = m
+                        best_regressor = regressor
+                        if not self.expose_all:
                             self.model_map[data.opunit] = regressor
                         pred_results = (evaluate_x, y_pred, evaluate_y)
 
@@ -141,33 +274,366 @@ class OUModelTrainer:
 
         # Record the best prediction results on the test data
         result_writing_util.record_predictions(pred_results, prediction_path)
-        return best_y_transformer, best_method
+        if best_method < 0:
+            return -1, -1, None, None
+        model_kwargs = {'y_transformer': y_transformers[best_y_transformer], 'x_transformer': x_transformer,
+                        'info': self.info}
+        if self.evaluate_reduction:
+            self._evaluate_reduction(data.opunit, methods[best_method], None, model_kwargs, full_train,
+                                     (x_train, y_train), (x_test, y_test))
+
+        # Compress the selected model if it is over the latency budget, or distill it into the other methods whose
+        # models are within the budget
+        best_params = None
+        teacher = None
+        if best_score[0]:
+            students = [method for method, latency in latencies.items()
+                        if method != methods[best_method] and not self._is_over_latency_budget(latency)]
+            compressed = self._compress_model(data.opunit, best_regressor, methods[best_method], model_kwargs,
+                                              (x_train, y_train), (x_test, y_test), students)
+            if compressed is not None:
+                best_method, best_params, teacher = compressed
+        if not self.expose_all:
+            return -1, -1, None, None
+        return best_y_transformer, best_method, best_params, teacher
+
+    def search_data(self, data, summary_file):
+        """Search the best ML method and hyperparameters (with the target transformer) within the CPU time budget
+
+        :param data: the OpUnitData to train on
+        :param summary_file: the file to record the test error of the best model
+        :return: (the index of the best method, its hyperparameters, the teacher model to distill into the method or
+                 None)
+        """
+        x_train, x_test, y_train, y_test = self._split_data(data)
+        full_train = (x_train, y_train)
+        x_train, y_train = self._reduce_data(data.opunit, x_train, y_train)
+
+        metrics_path = "{}/{}.csv".format(self.model_metrics_path, data.opunit.name.lower())
+        prediction_path = "{}/{}_prediction.csv".format(self.model_metrics_path, data.opunit.name.lower())
+        search_path = "{}/{}_search.csv".format(self.model_metrics_path, data.opunit.name.lower())
+        result_writing_util.create_metrics_and_prediction_files(metrics_path, prediction_path, False)
+        io_util.create_csv_file(search_path, ["Method", "Hyperparameters", "Training Rows", "Test Error"])
 
-    def train(self):
+        # Only use linear regression for the arithmetic operating units
+        methods = self.ml_models
+        if data.opunit in self.info.ARITHMETIC_OPUNITS and 'lr' in methods:
+            methods = ['lr']
+
+        eval_index = self.info.target_csv_index[Target.ELAPSED_US]
+        if data.opunit in self.info.MEM_EVALUATE_OPUNITS:
+            eval_index = self.info.target_csv_index[Target.MEMORY_B]
+
+        model_kwargs = {'y_transformer': data_transforming_util.OPUNIT_Y_TRANSFORMER_MAP[data.opunit],
+                        'x_transformer': data_transforming_util.OPUNIT_X_TRANSFORMER_MAP[data.opunit],
+                        'info': self.info}
+        with profiling_util.stage("search"):
+            method, params, _, history = hyperparameter_search_util.search(
+                x_train, y_train, x_test, y_test, methods,
+                lambda evaluate_y, y_pred: _get_percentage_error(evaluate_y, y_pred)[eval_index],
+                self.search_budget, model_kwargs)
+        for candidate_method, candidate_params, rows, error in history:
+            io_util.write_csv_result(search_path, candidate_method, [candidate_params, rows, error])
+
+        # Evaluate the best model on both the training and test set
+        label = "{} transform {}".format(method, params)
+        logging.info("{} {}".format(data.opunit.name, label))
+        regressor = model.Model(method, params=params, **model_kwargs)
+        with profiling_util.label(method=label):
+            regressor.train(x_train, y_train)
+        results = []
+        for evaluate_x, evaluate_y in [(x_train, y_train), (x_test, y_test)]:
+            with profiling_util.stage("evaluation", method=label):
+                y_pred = regressor.predict(evaluate_x)
+                percentage_error = _get_percentage_error(evaluate_y, y_pred)
+            results += list(percentage_error) + [""]
+        logging.info('Test Percentage Error: {}'.format(percentage_error))
+        io_util.write_csv_result(metrics_path, label, results)
+        io_util.write_csv_result(summary_file, data.opunit.name, [label] + list(percentage_error))
+        result_writing_util.record_predictions((x_test, y_pred, y_test), prediction_path)
+        if self.evaluate_reduction:
+            self._evaluate_reduction(data.opunit, method, params, model_kwargs, full_train, (x_train, y_train),
+                                     (x_test, y_test))
+
+        latency = self._measure_latency(data.opunit, label, regressor, x_test, percentage_error[eval_index])
+        if not self.expose_all:
+            self.model_map[data.opunit] = regressor
+        method_idx = self.ml_models.index(method)
+        teacher = None
+        if self._is_over_latency_budget(latency):
+            compressed = self._compress_model(data.opunit, regressor, method, model_kwargs, (x_train, y_train),
+                                              (x_test, y_test), [])
+            if compressed is not None:
+                method_idx, params, teacher = compressed
+        return method_idx, params, teacher
+
+    def train(self, previous_model_map=None, previous_training_state=None, checkpoint_file=None,
+              progress_callback=None):
         """Train the ou-models
 
-        :return: the map of the trained models
+        With the model map and the training state of a previous training (with the same parameters), the models are
+        trained incrementally: the opunits whose input file or data are unchanged reuse the previous models, and the
+        models that support it (gbm, nn) are only updated with the rows appended since the previous training. This
+        also resumes an unfinished training from its checkpoint (see load_checkpoint).
+
+        :param previous_model_map: the model map of the previous training (None to train all the models)
+        :param previous_training_state: the get_training_state() of the previous training
+        :param checkpoint_file: the file to save the trained opunits to after each opunit (None for no checkpoint)
+        :param progress_callback: the function called before and after the training of each opunit (e.g., to report
+               the progress, or to stop the training by raising an exception)
+        :return: the map of the trained models (each with the data info it is trained with)
         """
 
         self.model_map = {}
+        self.training_state = {'config': self._get_config(), 'files': {}, 'opunits': {}}
+        self.current_opunit = None
+        self.trained_opunit_num = 0
+        if previous_training_state is None or previous_training_state['config'] != self.training_state['config']:
+            previous_model_map = None
 
         # Create the results files for the paper
-        header = ["OpUnit", "Method"] + [target.name for target in data_info.instance.MINI_MODEL_TARGET_LIST]
+        header = ["OpUnit", "Method"] + [target.name for target in self.info.MINI_MODEL_TARGET_LIST]
         summary_file = "{}/ou_runner.csv".format(self.model_metrics_path)
         io_util.create_csv_file(summary_file, header)
+        if self.evaluate_reduction:
+            io_util.create_csv_file(self._get_reduction_file(), _REDUCTION_HEADER)
+        if self._is_latency_aware():
+            io_util.create_csv_file(self._get_latency_file(), _LATENCY_HEADER)
 
         # First get the data for all ou runners
         for filename in sorted(glob.glob(os.path.join(self.input_path, '*.csv'))):
             print(filename)
-            data_list = opunit_data.get_ou_runner_data(filename, self.model_metrics_path, self.txn_sample_rate,
-                                                         self.model_map, self.stats_map, self.trim)
+            fingerprint = io_util.get_file_fingerprint(filename)
+            if previous_model_map is not None and self._reuse_file_models(filename, fingerprint, previous_model_map,
+                                                                          previous_training_state):
+                continue
+
+            with profiling_util.stage("load"):
+                data_list = opunit_data.get_ou_runner_data(filename, self.model_metrics_path, self.txn_sample_rate,
+                                                             self.model_map, self.stats_map, self.trim,
+                                                             self.chunk_size, self.max_memory_rows, self.info)
             for data in data_list:
-                best_y_transformer, best_method = self.train_data(data, summary_file)
-                if self.expose_all:
-                    self.train_specific_model(data, best_y_transformer, best_method)
-
+                self.current_opunit = data.opunit
+                if progress_callback is not None:
+                    progress_callback()
+                # The digest is computed before the training since the memory-bounded training modifies the data
+                opunit_state = None
+                if data.source is None:
+                    opunit_state = (len(data.x), _get_data_digest(data.x, data.y))
+                with profiling_util.label(opunit=data.opunit.name):
+                    if previous_model_map is None or not self._reuse_model(data, previous_model_map,
+                                                                           previous_training_state):
+                        self._train_opunit(data, summary_file)
+                self.training_state['opunits'][data.opunit] = opunit_state
+                self.trained_opunit_num += 1
+                if checkpoint_file is not None:
+                    self._save_checkpoint(checkpoint_file)
+                if progress_callback is not None:
+                    progress_callback()
+
+            self.training_state['files'][os.path.basename(filename)] = (fingerprint,
+                                                                        [data.opunit for data in data_list])
+
+        self.current_opunit = None
+        # The trained models have the data info of the trainer, and the reused models keep the one of their previous
+        # training (unless they are pickled before the models kept their data info)
+        data_info.set_model_map_info(self.model_map, self.info)
         return self.model_map
 
+    def _save_checkpoint(self, checkpoint_file):
+        # Save the trained opunits (into a temporary file first so that an interrupted write keeps the last checkpoint)
+        tmp_file = "{}.tmp{}".format(checkpoint_file, os.getpid())
+        with open(tmp_file, 'wb') as file:
+            pickle.dump((self.model_map, self.info, self.training_state), file)
+        os.replace(tmp_file, checkpoint_file)
+
+    def _split_data(self, data):
+        """Split the data of an opunit into the training and the test data
+
+        :return: (x_train, x_test, y_train, y_test)
+        """
+        if self.chunk_size is None:
+            return model_selection.train_test_split(data.x, data.y, test_size=self.test_ratio, random_state=0)
+
+        # Shuffle the rows in place and split them into views instead of copies. The generators with the same seed
+        # shuffle x and y with the same permutation
+        np.random.default_rng(0).shuffle(data.x)
+        np.random.default_rng(0).shuffle(data.y)
+        test_num = int(math.ceil(len(data.x) * self.test_ratio))
+        return data.x[test_num:], data.x[:test_num], data.y[test_num:], data.y[:test_num]
+
+    def _reduce_data(self, opunit, x, y):
+        """Reduce the training data to the reduction budget (unchanged if there is no budget)
+
+        :return: (the reduced input, the reduced labels)
+        """
+        if self.reduction_budget is None:
+            return x, y
+        reduced_x, reduced_y, unique_num = data_reduction_util.reduce_data(x, y, self.reduction_budget)
+        logging.info("Reduced the {} training data from {} rows ({} unique) to {} rows".format(
+            opunit.name, x.shape[0], unique_num, reduced_x.shape[0]))
+        return reduced_x, reduced_y
+
+    def _get_latency_file(self):
+        return "{}/model_latency.csv".format(self.model_metrics_path)
+
+    def _is_latency_aware(self):
+        # Whether the selection depends on the prediction latency of the models
+        return self.latency_penalty != 0 or self.latency_budget is not None
+
+    def _is_over_latency_budget(self, latency):
+        return self.latency_budget is not None and latency > self.latency_budget
+
+    def _measure_latency(self, opunit, label, regressor, x, error):
+        """Measure the prediction time per row of a candidate model and record it with its test error
+
+        The latency is only measured for the latency-aware selection (with a latency penalty or budget), since the
+        repeated timed predictions are a noticeable part of the training time otherwise.
+
+        :return: the prediction time per row in microseconds (0 if the selection is not latency-aware)
+        """
+        if not self._is_latency_aware():
+            return 0
+        with profiling_util.stage("evaluation", method=label):
+            latency = model_compression_util.measure_latency(regressor, x)
+        io_util.write_csv_result(self._get_latency_file(), opunit.name,
+                                 [label, error, latency, error + self.latency_penalty * latency])
+        return latency
+
+    def _compress_model(self, opunit, regressor, method, model_kwargs, train, test, students):
+        """Compress a selected model that is over the latency budget (see model_compression_util.compress)
+
+        Without expose_all, the compressed model replaces the selected model in the model map.
+
+        :return: (the index of the method of the compressed model, its hyperparameters, the teacher model if it is
+                 distilled or None), or None if no compressed model is within the budget
+        """
+        eval_index = self.info.target_csv_index[Target.ELAPSED_US]
+        if opunit in self.info.MEM_EVALUATE_OPUNITS:
+            eval_index = self.info.target_csv_index[Target.MEMORY_B]
+
+        with profiling_util.stage("compression"):
+            compressed = model_compression_util.compress(
+                regressor, method, train[0], train[1], test[0], test[1],
+                lambda evaluate_y, y_pred: _get_percentage_error(evaluate_y, y_pred)[eval_index],
+                self.latency_budget, self.latency_penalty, model_kwargs, students)
+        if compressed is None:
+            logging.warning("No compressed {} model is within the latency budget of {} us".format(
+                opunit.name, self.latency_budget))
+            return None
+
+        compressed_regressor, compressed_method, params, distilled, error, latency = compressed
+        label = "{} {} {}".format("distilled" if distilled else "compressed", compressed_method, params)
+        logging.info("Selected the {} {} model: test error {:.4f}, {:.2f} us per row".format(opunit.name, label,
+                                                                                            error, latency))
+        io_util.write_csv_result(self._get_latency_file(), opunit.name,
+                                 [label, error, latency, error + self.latency_penalty * latency])
+        if not self.expose_all:
+            self.model_map[opunit] = compressed_regressor
+        return self.ml_models.index(compressed_method), params, regressor if distilled else None
+
+    def _get_reduction_file(self):
+        return "{}/data_reduction.csv".format(self.model_metrics_path)
+
+    def _evaluate_reduction(self, opunit, method, params, model_kwargs, full_train, reduced_train, test):
+        """Record the test error and the training time of the selected model on the reduced and the full training data
+
+        :param opunit: the opunit
+        :param method: the selected ML method
+        :param params: the hyperparameters of the method (None for the default configuration)
+        :param model_kwargs: the other arguments of model.Model (the data transformers)
+        :param full_train: (x, y) of the unreduced training data
+        :param reduced_train: (x, y) of the reduced training data
+        :param test: (x, y) of the test data
+        """
+        eval_index = self.info.target_csv_index[Target.ELAPSED_US]
+        if opunit in self.info.MEM_EVALUATE_OPUNITS:
+            eval_index = self.info.target_csv_index[Target.MEMORY_B]
+
+        errors = []
+        train_times = []
+        for x, y in [full_train, reduced_train]:
+            regressor = model.Model(method, params=params, **model_kwargs)
+            start_time = time.process_time()
+            with profiling_util.label(method=method):
+                regressor.train(x, y)
+            train_times.append(time.process_time() - start_time)
+            with profiling_util.stage("evaluation", method=method):
+                errors.append(_get_percentage_error(test[1], regressor.predict(test[0]))[eval_index])
+
+        logging.info("{} {} test error {:.4f} with the full data and {:.4f} with the reduced data ({:.2f}s and {:.2f}s "
+                     "of training)".format(opunit.name, method, errors[0], errors[1], *train_times))
+        io_util.write_csv_result(self._get_reduction_file(), opunit.name,
+                                 [method, full_train[0].shape[0], reduced_train[0].shape[0], errors[0], errors[1],
+                                  errors[1] - errors[0], train_times[0], train_times[1]])
+
+    def _train_opunit(self, data, summary_file):
+        # Select (or search) the best model for the opunit
+        if self.search_budget is not None:
+            best_method, best_params, teacher = self.search_data(data, summary_file)
+            if self.expose_all:
+                self.train_specific_model(data, 1, best_method, best_params, teacher)
+            return
+
+        best_y_transformer, best_method, best_params, teacher = self.train_data(data, summary_file)
+        if self.expose_all:
+            self.train_specific_model(data, best_y_transformer, best_method, best_params, teacher)
+
+    def _get_config(self):
+        # The training parameters that the models depend on
+        return (list(self.ml_models), self.test_ratio, self.trim, self.expose_all, self.txn_sample_rate,
+                self.search_budget, self.chunk_size, self.max_memory_rows, self.reduction_budget, self.latency_penalty,
+                self.latency_budget)
+
+    def _reuse_file_models(self, filename, fingerprint, previous_model_map, previous_training_state):
+        """Reuse the previous models of the opunits in a file if the file is unchanged
+
+        :return: whether the previous models are reused
+        """
+        file_state = previous_training_state['files'].get(os.path.basename(filename))
+        if file_state is None or file_state[0] != fingerprint:
+            return False
+        opunits = file_state[1]
+        if any(opunit not in previous_model_map or opunit not in previous_training_state['opunits']
+               for opunit in opunits):
+            return False
+
+        logging.info("Reusing the models of the unchanged file {}".format(filename))
+        for opunit in opunits:
+            self.model_map[opunit] = previous_model_map[opunit]
+            self.training_state['opunits'][opunit] = previous_training_state['opunits'][opunit]
+        self.training_state['files'][os.path.basename(filename)] = file_state
+        return True
+
+    def _reuse_model(self, data, previous_model_map, previous_training_state):
+        """Reuse the previous model of an opunit if its data is unchanged, or update the previous model with the new
+        rows if the previous data is a prefix of the current data (and the method supports the update)
+
+        :return: whether the previous model is reused
+        """
+        regressor = previous_model_map.get(data.opunit)
+        opunit_state = previous_training_state['opunits'].get(data.opunit)
+        # The sampled data cannot be compared with the previous data
+        if regressor is None or opunit_state is None or data.source is not None:
+            return False
+
+        row_num, digest = opunit_state
+        if len(data.x) == row_num and _get_data_digest(data.x, data.y) == digest:
+            logging.info("Reusing the {} model with unchanged data".format(data.opunit.name))
+            self.model_map[data.opunit] = regressor
+            return True
+
+        # The exported models cannot be updated
+        update = getattr(regressor, 'update', None)
+        if (len(data.x) > row_num and update is not None
+                and _get_data_digest(data.x[:row_num], data.y[:row_num]) == digest
+                and update(data.x[row_num:], data.y[row_num:])):
+            logging.info("Updated the {} model with {} new rows".format(data.opunit.name, len(data.x) - row_num))
+            self.model_map[data.opunit] = regressor
+            return True
+
+        return False
+
 
 # ==============================================
 # main
@@ -187,12 +653,69 @@ if __name__ == '__main__':
     aparser.add_argument('--expose_all', default=True, help='Should expose all data to the model')
     aparser.add_argument('--txn_sample_rate', type=int, default=2,
                          help='Sampling rate percentage for the transaction OUs (ignored if 0)')
+    aparser.add_argument('--search_budget', type=float, default=None,
+                         help='CPU time budget (seconds) of the hyperparameter search for each opunit (no search if '
+                              'not set)')
+    aparser.add_argument('--chunk_size', type=int, default=None,
+                         help='Read the input files in chunks of this many rows and train with bounded memory (float32 '
+                              'data that is split and transformed in place)')
+    aparser.add_argument('--max_memory_rows', type=int, default=None,
+                         help='With --chunk_size, the opunits with more rows select the model on a sample of this many '
+                              'rows and train the final model out-of-core (gbm and nn)')
+    aparser.add_argument('--reduction_budget', type=int, default=None,
+                         help='Train the models of each opunit with at most this many rows: the identical feature rows '
+                              'are merged (averaging their targets) and the rest are sampled across the feature space')
+    aparser.add_argument('--evaluate_reduction', action='store_true',
+                         help='With --reduction_budget, also train the selected models on the unreduced data and '
+                              'record the test error and training time of both in data_reduction.csv')
+    aparser.add_argument('--latency_penalty', type=float, default=0,
+                         help='Test error added to a candidate model per microsecond of its prediction time per row')
+    aparser.add_argument('--latency_budget', type=float, default=None,
+                         help='Maximum prediction time per row (microseconds) of the selected models: the models within '
+                              'the budget are preferred, and the others are compressed (smaller ensembles or networks, '
+                              'or distilled into a faster method) if possible')
+    aparser.add_argument('--incremental', action='store_true',
+                         help='Only retrain the opunits whose data changed since the models in save_path were trained')
+    aparser.add_argument('--resume', action='store_true',
+                         help='Resume an unfinished training from the checkpoint in save_path')
+    aparser.add_argument('--profile_path', default=None,
+                         help='Record the wall time, CPU time and peak RSS of the training stages per opunit and '
+                              'method in this report file (JSON if it ends with .json, otherwise CSV)')
+    aparser.add_argument('--cprofile_path', default=None,
+                         help='With --profile_path, also dump the cProfile statistics of each stage into this '
+                              'directory')
     aparser.add_argument('--log', default='info', help='The logging level')
     args = aparser.parse_args()
 
     logging_util.init_logging(args.log)
+    if args.profile_path is not None:
+        profiling_util.instance = profiling_util.Profiler(args.cprofile_path)
+    model_file = args.save_path + '/ou_model_map.pickle'
+    training_state_file = get_training_state_file(model_file)
+    checkpoint_file = get_checkpoint_file(model_file)
+    previous_model_map = None
+    previous_info = None
+    previous_training_state = None
+    if args.resume:
+        previous_model_map, previous_info, previous_training_state = load_checkpoint(checkpoint_file)
+    if previous_model_map is None and args.incremental and os.path.exists(model_file) and os.path.exists(
+            training_state_file):
+        with open(model_file, 'rb') as pickle_file:
+            previous_model_map, previous_info = pickle.load(pickle_file)
+        data_info.set_model_map_info(previous_model_map, previous_info)
+        with open(training_state_file, 'rb') as pickle_file:
+            previous_training_state = pickle.load(pickle_file)
+
     trainer = OUModelTrainer(args.input_path, args.model_results_path, args.ml_models, args.test_ratio, args.trim,
-                             args.expose_all, args.txn_sample_rate)
-    trained_model_map = trainer.train()
-    with open(args.save_path + '/ou_model_map.pickle', 'wb') as file:
-        pickle.dump((trained_model_map, data_info.instance), file)
+                             args.expose_all, args.txn_sample_rate, args.search_budget, args.chunk_size,
+                             args.max_memory_rows, args.reduction_budget, args.evaluate_reduction,
+                             args.latency_penalty, args.latency_budget, previous_info)
+    trained_model_map = trainer.train(previous_model_map, previous_training_state, checkpoint_file)
+    with open(model_file, 'wb') as file:
+        pickle.dump((trained_model_map, data_info.get_model_map_info(trained_model_map)), file)
+    with open(training_state_file, 'wb') as file:
+        pickle.dump(trainer.get_training_state(), file)
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    if profiling_util.instance is not None:
+        profiling_util.instance.write_report(args.profile_path)
@@ -0,0 +1,106 @@
+import logging
+
+import numpy as np
+
+# The maximum width (in log2 units) of the feature bins that define the strata
+_MAX_BIN_WIDTH = 64
+
+
+def reduce_data(x, y, budget, seed=0):
+    """Reduce the training data of an opunit to at most budget rows
+
+    The identical feature rows are first merged (see deduplicate), and the unique rows are then sampled across the
+    feature space if there are still more than budget of them (see stratified_sample).
+
+    :param x: the input
+    :param y: the labels
+    :param budget: the maximum number of rows to keep
+    :param seed: the random seed of the sampling
+    :return: (the reduced input, the reduced labels, the number of unique feature rows)
+    """
+    x, y = deduplicate(x, y)
+    unique_num = x.shape[0]
+    if unique_num > budget:
+        rows = stratified_sample(x, budget, seed)
+        x, y = x[rows], y[rows]
+    return x, y, unique_num
+
+
+def deduplicate(x, y):
+    """Merge the identical feature rows into one row with the average of their labels
+
+    :param x: the input
+    :param y: the labels
+    :return: (the unique feature rows in sorted order, the float64 average labels of each unique row), or (x, y)
+             unchanged if there are no identical rows
+    """
+    unique_x, inverse, counts = np.unique(x, axis=0, return_inverse=True, return_counts=True)
+    if unique_x.shape[0] == x.shape[0]:
+        return x, y
+
+    # Sum the labels of each unique row with one pass over the rows grouped by their unique row
+    order = np.argsort(inverse.reshape(-1), kind='stable')
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    y_sum = np.add.reduceat(np.asarray(y, dtype=np.float64)[order], starts, axis=0)
+    return unique_x, y_sum / counts[:, np.newaxis]
+
+
+def stratified_sample(x, sample_num, seed=0):
+    """Sample the rows across the feature space
+
+    The rows are grouped into strata by binning each feature on the log2 scale (the features such as the number of
+    rows and the cardinality span many orders of magnitude), with the bins widened until there are at most half as many
+    strata as samples. Each stratum keeps at least one row so that the sparse regions of the feature space are
+    covered, and the rest of the samples are allocated to the strata in proportion to their sizes.
+
+    :param x: the input
+    :param sample_num: the number of rows to sample
+    :param seed: the random seed
+    :return: the sorted indexes of the sampled rows
+    """
+    row_num = x.shape[0]
+    if row_num <= sample_num:
+        return np.arange(row_num)
+
+    log_x = np.sign(x) * np.log2(np.abs(x.astype(np.float64)) + 1)
+    width = 1
+    while True:
+        strata, sizes = _get_strata(np.floor(log_x / width).astype(np.int64))
+        if len(sizes) <= sample_num // 2 or width >= _MAX_BIN_WIDTH:
+            break
+        width *= 2
+    stratum_num = len(sizes)
+    logging.debug("Sampling {} of {} rows from {} strata (bin width {})".format(sample_num, row_num, stratum_num,
+                                                                              width))
+
+    # One row for each stratum (if the strata are still too many, a random subset of them), and the remaining samples
+    # in proportion to the rows left in each stratum
+    rng = np.random.default_rng(seed)
+    if stratum_num >= sample_num:
+        allocation = np.zeros(stratum_num, dtype=np.int64)
+        allocation[rng.choice(stratum_num, sample_num, replace=False)] = 1
+    else:
+        allocation = 1 + ((sample_num - stratum_num) * (sizes - 1) // (row_num - stratum_num))
+
+    # Take the first allocation[s] rows of each stratum s in a random order
+    order = np.lexsort((rng.random(row_num), strata))
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    ranks = np.arange(row_num) - np.repeat(starts, sizes)
+    return np.sort(order[ranks < allocation[strata[order]]])
+
+
+def _get_strata(bins):
+    # The stratum of each row (numbered in sorted order) and the size of each stratum, from the bin of each feature.
+    # The bins are combined into one integer key per row, which is renumbered whenever it would overflow
+    keys = np.zeros(bins.shape[0], dtype=np.int64)
+    key_num = 1
+    for column in bins.T:
+        codes = column - column.min()
+        code_num = int(codes.max()) + 1
+        if key_num * code_num >= 1 << 62:
+            _, keys = np.unique(keys, return_inverse=True)
+            key_num = int(keys.max()) + 1
+        keys = keys * code_num + codes
+        key_num *= code_num
+    _, strata, sizes = np.unique(keys, return_inverse=True, return_counts=True)
+    return strata.reshape(-1), sizes
@@ -1,20 +1,21 @@
 import numpy as np
 
-from ..info import data_info
 from ..type import OpUnit, Target, ExecutionFeature
 
 _TRANSFORM_EPSILON = 1
 
+# The transformers locate the features and targets with the DataInfo of the model's data (the info argument)
 
-def _num_rows_linear_train_transform(x, y):
+
+def _num_rows_linear_train_transform(x, y, info):
     # Linearly transform down the target according to the num_rows value in the input
-    tuple_num = np.copy(x[:, data_info.instance.input_csv_index[ExecutionFeature.NUM_ROWS]])
+    tuple_num = x[:, info.input_csv_index[ExecutionFeature.NUM_ROWS]]
     return y / tuple_num[:, np.newaxis]
 
 
-def _num_rows_linear_predict_transform(x, y):
+def _num_rows_linear_predict_transform(x, y, info):
     # Linearly transform up the target according to the num_rows value in the input
-    tuple_num = np.copy(x[:, data_info.instance.input_csv_index[ExecutionFeature.NUM_ROWS]])
+    tuple_num = x[:, info.input_csv_index[ExecutionFeature.NUM_ROWS]]
     return y * tuple_num[:, np.newaxis]
 
 
@@ -22,26 +23,26 @@ def _num_rows_linear_predict_transform(x, y):
 _num_rows_linear_transformer = (_num_rows_linear_train_transform, _num_rows_linear_predict_transform)
 
 
-def _num_rows_memory_cardinality_linear_train_transform(x, y):
+def _num_rows_memory_cardinality_linear_train_transform(x, y, info):
     # Linearly transform down the target according to the num_rows value in the input
-    tuple_num = np.copy(x[:, data_info.instance.input_csv_index[ExecutionFeature.NUM_ROWS]]) + _TRANSFORM_EPSILON
+    tuple_num = x[:, info.input_csv_index[ExecutionFeature.NUM_ROWS]] + _TRANSFORM_EPSILON
     new_y = y / tuple_num[:, np.newaxis]
     # Transform the memory consumption based on the cardinality
-    cardinality = np.copy(x[:, data_info.instance.input_csv_index[ExecutionFeature.EST_CARDINALITIES]])
-    new_y[:, data_info.instance.target_csv_index[Target.MEMORY_B]] *= tuple_num
+    cardinality = x[:, info.input_csv_index[ExecutionFeature.EST_CARDINALITIES]]
+    new_y[:, info.target_csv_index[Target.MEMORY_B]] *= tuple_num
     # Having a 250 offset since below roughly that the memory consumption is constant (while fixing other features)
-    new_y[:, data_info.instance.target_csv_index[Target.MEMORY_B]] /= cardinality + 250
+    new_y[:, info.target_csv_index[Target.MEMORY_B]] /= cardinality + 250
     return new_y
 
 
-def _num_rows_memory_cardinality_linear_predict_transform(x, y):
+def _num_rows_memory_cardinality_linear_predict_transform(x, y, info):
     # Linearly transform up the target according to the num_rows value in the input
-    tuple_num = np.copy(x[:, data_info.instance.input_csv_index[ExecutionFeature.NUM_ROWS]]) + _TRANSFORM_EPSILON
+    tuple_num = x[:, info.input_csv_index[ExecutionFeature.NUM_ROWS]] + _TRANSFORM_EPSILON
     new_y = y * tuple_num[:, np.newaxis]
     # Transform the memory consumption based on the cardinality
-    cardinality = np.copy(x[:, data_info.instance.input_csv_index[ExecutionFeature.EST_CARDINALITIES]])
-    new_y[:, data_info.instance.target_csv_index[Target.MEMORY_B]] /= tuple_num
-    new_y[:, data_info.instance.target_csv_index[Target.MEMORY_B]] *= cardinality + 250
+    cardinality = x[:, info.input_csv_index[ExecutionFeature.EST_CARDINALITIES]]
+    new_y[:, info.target_csv_index[Target.MEMORY_B]] /= tuple_num
+    new_y[:, info.target_csv_index[Target.MEMORY_B]] *= cardinality + 250
     return new_y
 
 
@@ -50,21 +51,21 @@ _num_rows_memory_cardinality_linear_transformer = (_num_rows_memory_cardinality_
                                                    _num_rows_memory_cardinality_linear_predict_transform)
 
 
-def _num_rows_log_cardinality_linear_train_transform(x, y):
+def _num_rows_log_cardinality_linear_train_transform(x, y, info):
     # Transform down the target in log scale according to the num_rows value in the input
-    tuple_num = np.copy(x[:, data_info.instance.input_csv_index[ExecutionFeature.NUM_ROWS]])
+    tuple_num = x[:, info.input_csv_index[ExecutionFeature.NUM_ROWS]]
     new_y = y / (np.log2(tuple_num) + _TRANSFORM_EPSILON)[:, np.newaxis]
     # Transform linearly again based on the cardinality
-    cardinality = np.copy(x[:, data_info.instance.input_csv_index[ExecutionFeature.EST_CARDINALITIES]])
+    cardinality = x[:, info.input_csv_index[ExecutionFeature.EST_CARDINALITIES]]
     return new_y / cardinality[:, np.newaxis]
 
 
-def _num_rows_log_cardinality_linear_predict_transform(x, y):
+def _num_rows_log_cardinality_linear_predict_transform(x, y, info):
     # Transform up the target in log scale according to the num_rows value in the input
-    tuple_num = np.copy(x[:, data_info.instance.input_csv_index[ExecutionFeature.NUM_ROWS]])
+    tuple_num = x[:, info.input_csv_index[ExecutionFeature.NUM_ROWS]]
     new_y = y * (np.log2(tuple_num) + _TRANSFORM_EPSILON)[:, np.newaxis]
     # Transform linearly again based on the cardinality
-    cardinality = np.copy(x[:, data_info.instance.input_csv_index[ExecutionFeature.EST_CARDINALITIES]])
+    cardinality = x[:, info.input_csv_index[ExecutionFeature.EST_CARDINALITIES]]
     return new_y * cardinality[:, np.newaxis]
 
 
@@ -73,15 +74,15 @@ _num_rows_log_cardinality_linear_transformer = (_num_rows_log_cardinality_linear
                                                 _num_rows_log_cardinality_linear_predict_transform)
 
 
-def _num_rows_linear_log_train_transform(x, y):
+def _num_rows_linear_log_train_transform(x, y, info):
     # Transform down the target according to the linear-log (nlogn) num_rows value in the input
-    tuple_num = np.copy(x[:, data_info.instance.input_csv_index[ExecutionFeature.NUM_ROWS]])
+    tuple_num = x[:, info.input_csv_index[ExecutionFeature.NUM_ROWS]]
     return y / (tuple_num * np.log2(tuple_num) + _TRANSFORM_EPSILON)[:, np.newaxis]
 
 
-def _num_rows_linear_log_predict_transform(x, y):
+def _num_rows_linear_log_predict_transform(x, y, info):
     # Transform up the target according to the linear-log (nlogn) num_rows value in the input
-    tuple_num = np.copy(x[:, data_info.instance.input_csv_index[ExecutionFeature.NUM_ROWS]])
+    tuple_num = x[:, info.input_csv_index[ExecutionFeature.NUM_ROWS]]
     return y * (tuple_num * np.log2(tuple_num) + _TRANSFORM_EPSILON)[:, np.newaxis]
 
 
@@ -89,15 +90,15 @@ def _num_rows_linear_log_predict_transform(x, y):
 _num_rows_linear_log_transformer = (_num_rows_linear_log_train_transform, _num_rows_linear_log_predict_transform)
 
 
-def _num_rows_log_train_transform(x, y):
+def _num_rows_log_train_transform(x, y, info):
     # Transform down the target according to the log num_rows value in the input
-    tuple_num = np.copy(x[:, data_info.instance.input_csv_index[ExecutionFeature.NUM_ROWS]])
+    tuple_num = x[:, info.input_csv_index[ExecutionFeature.NUM_ROWS]]
     return y / (np.log2(tuple_num) + _TRANSFORM_EPSILON)[:, np.newaxis]
 
 
-def _num_rows_log_predict_transform(x, y):
+def _num_rows_log_predict_transform(x, y, info):
     # Transform up the target according to the log num_rows value in the input
-    tuple_num = np.copy(x[:, data_info.instance.input_csv_index[ExecutionFeature.NUM_ROWS]])
+    tuple_num = x[:, info.input_csv_index[ExecutionFeature.NUM_ROWS]]
     return y * (np.log2(tuple_num) + _TRANSFORM_EPSILON)[:, np.newaxis]
 
 
@@ -105,15 +106,15 @@ def _num_rows_log_predict_transform(x, y):
 _num_rows_log_transformer = (_num_rows_log_train_transform, _num_rows_log_predict_transform)
 
 
-def _cardinality_linear_train_transform(x, y):
+def _cardinality_linear_train_transform(x, y, info):
     # Transform down the target according to the cardinality in the input
-    cardinality = np.copy(x[:, data_info.instance.input_csv_index[ExecutionFeature.EST_CARDINALITIES]])
+    cardinality = x[:, info.input_csv_index[ExecutionFeature.EST_CARDINALITIES]]
     return y / (cardinality + _TRANSFORM_EPSILON)[:, np.newaxis]
 
 
-def _cardinality_linear_predict_transform(x, y):
+def _cardinality_linear_predict_transform(x, y, info):
     # Transform up the target according to the cardinality in the input
-    cardinality = np.copy(x[:, data_info.instance.input_csv_index[ExecutionFeature.EST_CARDINALITIES]])
+    cardinality = x[:, info.input_csv_index[ExecutionFeature.EST_CARDINALITIES]]
     return y * (cardinality + _TRANSFORM_EPSILON)[:, np.newaxis]
 
 
@@ -169,11 +170,11 @@ OPUNIT_Y_TRANSFORMER_MAP = {
 }
 
 
-def _num_rows_cardinality_linear_train_transform(x):
+def _num_rows_cardinality_linear_train_transform(x, info):
     # Linearly divide the cardinality by the num_rows
-    tuple_num = np.copy(x[:, data_info.instance.input_csv_index[ExecutionFeature.NUM_ROWS]])
+    tuple_num = x[:, info.input_csv_index[ExecutionFeature.NUM_ROWS]]
     new_x = x * 1.0
-    new_x[:, data_info.instance.input_csv_index[ExecutionFeature.EST_CARDINALITIES]] /= tuple_num + _TRANSFORM_EPSILON
+    new_x[:, info.input_csv_index[ExecutionFeature.EST_CARDINALITIES]] /= tuple_num + _TRANSFORM_EPSILON
     return new_x
 
 
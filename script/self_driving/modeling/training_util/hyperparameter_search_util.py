@@ -0,0 +1,133 @@
+import logging
+import math
+import time
+
+import numpy as np
+
+from .. import model
+from ..util import profiling_util
+
+# The hyperparameter choices of each ML method. The default configuration of each method (in model.py) is always
+# evaluated in addition to the sampled ones
+SEARCH_SPACE = {
+    'lr': {},
+    'huber': {'alpha': [1e-4, 1e-3, 1e-2], 'epsilon': [1.1, 1.35, 1.7], 'max_iter': [50, 200]},
+    'svr': {'C': [0.1, 1.0, 10.0], 'epsilon': [0.0, 0.1]},
+    'kr': {'alpha': [0.1, 1.0], 'gamma': [None, 0.01, 0.1]},
+    'rf': {'n_estimators': [20, 50, 100], 'max_depth': [None, 10, 20], 'min_samples_leaf': [1, 5]},
+    'gbm': {'num_leaves': [31, 127, 1000], 'n_estimators': [50, 100, 200], 'learning_rate': [0.05, 0.1],
+            'min_child_samples': [5, 20]},
+    'nn': {'hidden_layer_sizes': [(25, 25), (50, 50), (100,)], 'alpha': [0.1, 1.0, 5.0], 'max_iter': [200, 1000]},
+}
+
+# The reduction factor of successive halving: only the best 1/ETA candidates advance to ETA times more training data
+ETA = 3
+
+# The minimum number of training rows to evaluate a candidate with
+MIN_RESOURCE = 100
+
+
+def search(x_train, y_train, x_valid, y_valid, methods, get_error, cpu_budget, model_kwargs=None, seed=0):
+    """Search the ML method and its hyperparameters with Hyperband
+
+    The resource of a candidate is the number of training rows. Each Hyperband bracket runs successive halving: the
+    candidates are trained on a subset of the rows, and only the best 1/ETA of them are trained again with ETA times
+    more rows until the full training set is used. A candidate is also stopped early when its validation error is
+    already worse than the best error on the full training set, and the search stops when the CPU time (of all the
+    threads) exceeds the budget (at least one candidate is evaluated).
+
+    :param x_train: the training input
+    :param y_train: the training labels
+    :param x_valid: the validation input
+    :param y_valid: the validation labels
+    :param methods: the ML methods to search
+    :param get_error: the function (y, y_pred) -> the validation error to minimize
+    :param cpu_budget: the CPU time budget in seconds (None for no limit)
+    :param model_kwargs: the other arguments of model.Model (e.g., the data transformers)
+    :param seed: the random seed to sample the candidates and the training subsets
+    :return: (the best method, its hyperparameters, its validation error, the list of evaluations with (method,
+             hyperparameters, number of training rows, validation error))
+    """
+    model_kwargs = {} if model_kwargs is None else model_kwargs
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(x_train.shape[0])
+    max_resource = x_train.shape[0]
+    bracket_num = int(math.log(max(max_resource / MIN_RESOURCE, 1), ETA)) + 1
+
+    start_time = time.process_time()
+    history = []
+    # The best evaluation as (number of training rows, error, method, params). The errors are only comparable with
+    # the same number of training rows, so the evaluations with more rows are preferred
+    best = (0, math.inf, None, None)
+    seen = set()
+
+    for s in reversed(range(bracket_num)):
+        candidates = []
+        # Start the defaults in the most exploratory bracket
+        if s == bracket_num - 1:
+            for method in methods:
+                seen.add(_get_candidate_key(method, {}))
+                candidates.append((method, {}))
+        candidate_num = int(math.ceil(bracket_num / (s + 1) * ETA ** s))
+        candidates += _sample_candidates(methods, candidate_num, rng, seen)
+
+        for i in range(s + 1):
+            resource = max_resource if i == s else max(int(max_resource * ETA ** (i - s)), MIN_RESOURCE)
+            indices = order[:resource]
+            errors = []
+            for method, params in candidates:
+                if len(history) > 0 and cpu_budget is not None and time.process_time() - start_time > cpu_budget:
+                    logging.info("Hyperparameter search stopped by the CPU time budget ({}s)".format(cpu_budget))
+                    return best[2], best[3], best[1], history
+
+                error = _evaluate(method, params, model_kwargs, x_train[indices], y_train[indices], x_valid,
+                                  y_valid, get_error)
+                history.append((method, params, resource, error))
+                logging.debug("Candidate {} {} with {} rows: {}".format(method, params, resource, error))
+                errors.append(error)
+                if (resource, -error) > (best[0], -best[1]):
+                    best = (resource, error, method, params)
+
+            # Keep the best 1/ETA of the candidates that are not already worse than the best on the full data
+            keep_num = max(len(candidates) // ETA, 1)
+            ranking = np.argsort(errors, kind='stable')[:keep_num]
+            candidates = [candidates[j] for j in ranking
+                          if best[0] < max_resource or errors[j] <= best[1]]
+            if len(candidates) == 0:
+                break
+
+    return best[2], best[3], best[1], history
+
+
+def _sample_candidates(methods, candidate_num, rng, seen):
+    # Sample the (method, params) candidates that have not been evaluated in the previous brackets
+    candidates = []
+    for _ in range(candidate_num * 10):
+        if len(candidates) == candidate_num:
+            break
+        method = methods[rng.integers(len(methods))]
+        space = SEARCH_SPACE.get(method, {})
+        params = {name: choices[rng.integers(len(choices))] for name, choices in space.items()}
+        key = _get_candidate_key(method, params)
+        if key not in seen:
+            seen.add(key)
+            candidates.append((method, params))
+    return candidates
+
+
+def _get_candidate_key(method, params):
+    # The hashable identity of a candidate
+    return method, repr(sorted(params.items()))
+
+
+def _evaluate(method, params, model_kwargs, x, y, x_valid, y_valid, get_error):
+    # Train a candidate and get its validation error (infinity if the training fails)
+    try:
+        with profiling_util.label(method=method):
+            regressor = model.Model(method, params=params, **model_kwargs)
+            regressor.train(x, y)
+            with profiling_util.stage("evaluation"):
+                return float(get_error(y_valid, regressor.predict(x_valid)))
+    except Exception as e:
+        logging.warning("Failed to train the candidate {} {}: {}".format(method, params, e))
+        return math.inf
@@ -0,0 +1,161 @@
+import glob
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import time
+
+import numpy as np
+
+from ..util import io_util
+from ..info import data_info
+from ..data import grouped_op_unit_data, interference_model_data
+from ..type import OpUnit
+
+# Bump the version when the layout of the cached data changes so that the old entries are not used
+_CACHE_VERSION = 1
+
+# The maximum number of entries to keep in a cache directory. The least recently used entries are removed first.
+CACHE_MAX_ENTRIES = 4
+
+_META_FILE = "meta.pickle"
+
+
+def get_cache_key(input_path, ou_model_map, ou_model_file, parameters):
+    """Get the key of the cached data that depends on all the inputs of the data construction
+
+    The ou models are identified by the fingerprint of their saved file when it is known, since pickling the loaded
+    models is slow for large models and does not always give the same bytes after a reload. Otherwise the key depends
+    on the pickled models (with their data info).
+
+    :param input_path: input data file path
+    :param ou_model_map: ou models used for prediction
+    :param ou_model_file: the file that ou_model_map is loaded from (None if unknown)
+    :param parameters: the list of the parameters used to construct the data (e.g., warmup period, sample rates, and
+           the configurations that the construction depends on)
+    :return: the hex digest that identifies the cached data
+    """
+    digest = hashlib.sha256()
+    digest.update(repr(_CACHE_VERSION).encode())
+    for filename in sorted(glob.glob(os.path.join(input_path, '*.csv'))):
+        digest.update(repr(io_util.get_file_fingerprint(filename)).encode())
+    if ou_model_file is not None:
+        digest.update(repr((os.path.abspath(ou_model_file), io_util.get_file_fingerprint(ou_model_file))).encode())
+    else:
+        digest.update(pickle.dumps((ou_model_map, data_info.get_model_map_info(ou_model_map))))
+    digest.update(repr(list(parameters)).encode())
+    return digest.hexdigest()
+
+
+def load(cache_path, key, info):
+    """Load the interference model data from the cache
+
+    The arrays are memory-mapped (copy-on-write) instead of being read into memory.
+
+    :param cache_path: the cache directory
+    :param key: the key of the cached data
+    :param info: the DataInfo of the ou models that the data is constructed with
+    :return: (InterferenceResourceDataStore, InterferenceImpactDataStore), or None if there is no such entry
+    """
+    entry_path = os.path.join(cache_path, key)
+    meta_file = os.path.join(entry_path, _META_FILE)
+    if not os.path.exists(meta_file):
+        return None
+
+    with open(meta_file, 'rb') as pickle_file:
+        meta = pickle.load(pickle_file)
+
+    def load_array(name):
+        return np.load(os.path.join(entry_path, name + '.npy'), mmap_mode='c')
+
+    grouped_data = grouped_op_unit_data.GroupedOpUnitDataStore(
+        meta['name_list'], load_array('name_codes'), load_array('y'), load_array('start_time'), load_array('cpu_id'),
+        load_array('sample_rate'), load_array('concurrency'), load_array('opunit_offsets'), load_array('opunits'),
+        load_array('feature_rows'),
+        {OpUnit(opunit_id): load_array('opunit_x_{}'.format(opunit_id)) for opunit_id in meta['opunit_ids']}, info)
+    grouped_data.y_pred = load_array('y_pred')
+
+    resource_data = interference_model_data.InterferenceResourceDataStore(load_array('resource_start_time'),
+                                                                          load_array('resource_x_list'),
+                                                                          load_array('resource_x'),
+                                                                          load_array('resource_y'))
+    impact_data = interference_model_data.InterferenceImpactDataStore(grouped_data, resource_data,
+                                                                      load_array('resource_offsets'),
+                                                                      load_array('resource_indices'))
+
+    # Record the access for the LRU eviction
+    os.utime(meta_file)
+    logging.info("Loaded the interference model data from cache {}".format(entry_path))
+    return resource_data, impact_data
+
+
+def save(cache_path, key, resource_data, impact_data, max_entries=CACHE_MAX_ENTRIES):
+    """Save the interference model data into the cache and evict the least recently used entries
+
+    :param cache_path: the cache directory
+    :param key: the key of the cached data
+    :param resource_data: InterferenceResourceDataStore
+    :param impact_data: InterferenceImpactDataStore
+    :param max_entries: the maximum number of entries to keep in the cache directory
+    """
+    grouped_data = impact_data.grouped_op_unit_data
+    arrays = {
+        'name_codes': grouped_data.name_codes,
+        'y': grouped_data.y,
+        'y_pred': grouped_data.y_pred,
+        'start_time': grouped_data.start_time,
+        'cpu_id': grouped_data.cpu_id,
+        'sample_rate': grouped_data.sample_rate,
+        'concurrency': grouped_data.concurrency,
+        'opunit_offsets': grouped_data.opunit_offsets,
+        'opunits': grouped_data.opunits,
+        'feature_rows': grouped_data.feature_rows,
+        'resource_start_time': resource_data.start_time,
+        'resource_x_list': resource_data.x_list,
+        'resource_x': resource_data.x,
+        'resource_y': resource_data.y,
+        'resource_offsets': impact_data.resource_offsets,
+        'resource_indices': impact_data.resource_indices,
+    }
+    for opunit, x in grouped_data.opunit_x.items():
+        arrays['opunit_x_{}'.format(int(opunit))] = x
+    meta = {'name_list': grouped_data.name_list,
+            'opunit_ids': [int(opunit) for opunit in grouped_data.opunit_x]}
+
+    # Write into a temporary directory first so that a partially written entry is never loaded
+    os.makedirs(cache_path, exist_ok=True)
+    entry_path = os.path.join(cache_path, key)
+    tmp_path = "{}.tmp{}".format(entry_path, os.getpid())
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, name + '.npy'), np.asarray(array))
+    with open(os.path.join(tmp_path, _META_FILE), 'wb') as file:
+        pickle.dump(meta, file)
+
+    shutil.rmtree(entry_path, ignore_errors=True)
+    os.rename(tmp_path, entry_path)
+    logging.info("Saved the interference model data to cache {}".format(entry_path))
+
+    _evict(cache_path, max_entries)
+
+
+def _evict(cache_path, max_entries):
+    """Remove the least recently used entries so that at most max_entries remain
+
+    :param cache_path: the cache directory
+    :param max_entries: the maximum number of entries to keep
+    """
+    entries = []
+    for meta_file in glob.glob(os.path.join(cache_path, '*', _META_FILE)):
+        entries.append((os.path.getmtime(meta_file), os.path.dirname(meta_file)))
+    entries.sort(reverse=True)
+    for _, entry_path in entries[max_entries:]:
+        logging.info("Evicting the interference model data cache {}".format(entry_path))
+        shutil.rmtree(entry_path, ignore_errors=True)
+
+    # Clean up the temporary directories left by interrupted saves (older than an hour)
+    for tmp_path in glob.glob(os.path.join(cache_path, '*.tmp*')):
+        if time.time() - os.path.getmtime(tmp_path) > 3600:
+            shutil.rmtree(tmp_path, ignore_errors=True)
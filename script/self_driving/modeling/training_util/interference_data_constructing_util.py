@@ -1,24 +1,31 @@
+import concurrent.futures
 import logging
-import copy
 import glob
-import math
 import os
 import numpy as np
 import tqdm
-import pickle
 
-from ..util import io_util
-from ..info import hardware_info, data_info
+from ..util import io_util, profiling_util
+from ..info import data_info, hardware_info
 from ..data import interference_model_data, grouped_op_unit_data
+from . import ou_prediction_util, interference_data_cache_util
 from .. import interference_model_config
-from ..type import OpUnit, ConcurrentCountingMode, Target, ExecutionFeature
+from ..type import ConcurrentCountingMode, Target
+
+# The number of (opunit group, interval) overlaps to process at a time when constructing the interval data
+_OVERLAP_CHUNK_SIZE = 1000000
+
+# The approximate number of bytes of a pipeline data file to load in one task
+_LOADING_CHUNK_SIZE = 16 * 1024 * 1024
 
 
 def get_data(input_path, ou_model_map, model_results_path, warmup_period, use_query_predict_cache, add_noise,
-             predict_ou_only, ee_sample_rate, txn_sample_rate, network_sample_rate):
+             predict_ou_only, ee_sample_rate, txn_sample_rate, network_sample_rate, ou_model_file=None):
     """Get the data for the global models
 
-    Read from the cache if exists, otherwise save the constructed data to the cache.
+    Read from the cache if exists, otherwise save the constructed data to the cache. The cache entries are keyed by
+    the fingerprints of the input files, the ou models, the parameters, and the interval and hardware configurations,
+    so that the changed data are never read from a stale cache.
 
     :param input_path: input data file path
     :param ou_model_map: ou models used for prediction
@@ -30,43 +37,181 @@ def get_data(input_path, ou_model_map, model_results_path, warmup_period, use_qu
     :param ee_sample_rate: sampling rate for the EE OUs
     :param txn_sample_rate: sampling rate for the transaction OUs
     :param network_sample_rate: sampling rate for the network OUs
-    :return: (InterferenceResourceData list, InterferenceImpactData list)
+    :param ou_model_file: the file that ou_model_map is loaded from, which identifies the models in the cache key
+           faster than the models themselves (None if unknown)
+    :return: (InterferenceResourceDataStore, InterferenceImpactDataStore)
     """
-    cache_file = input_path + '/interference_model_data.pickle'
-    if os.path.exists(cache_file):
-        with open(cache_file, 'rb') as pickle_file:
-            resource_data_list, impact_data_list, = pickle.load(pickle_file)
-    else:
-        data_list = _get_grouped_opunit_data_with_prediction(input_path, ou_model_map, model_results_path,
-                                                             warmup_period, use_query_predict_cache, add_noise,
-                                                             ee_sample_rate, txn_sample_rate,
-                                                             network_sample_rate)
-
-        if not predict_ou_only:
-            resource_data_list, impact_data_list = _construct_interval_based_global_model_data(data_list,
-                                                                                               model_results_path)
-
-            with open(cache_file, 'wb') as file:
-                pickle.dump((resource_data_list, impact_data_list), file)
-        else:
-            return None, None
+    # The data is located with the data info of the ou models
+    info = data_info.get_model_map_info(ou_model_map)
+    cache_path = input_path + '/interference_model_data_cache'
+    cache_key = interference_data_cache_util.get_cache_key(
+        input_path, ou_model_map, ou_model_file,
+        [warmup_period, use_query_predict_cache, add_noise, ee_sample_rate, txn_sample_rate, network_sample_rate,
+         interference_model_config.INTERVAL_SIZE, interference_model_config.INTERVAL_START,
+         interference_model_config.INTERVAL_SEGMENT, hardware_info.PHYSICAL_CORE_NUM])
+    with profiling_util.stage("load"):
+        cached_data = interference_data_cache_util.load(cache_path, cache_key, info)
+    if cached_data is not None:
+        return cached_data
+
+    data_list = _get_grouped_opunit_data_with_prediction(input_path, ou_model_map, model_results_path,
+                                                         warmup_period, use_query_predict_cache, add_noise,
+                                                         ee_sample_rate, txn_sample_rate,
+                                                         network_sample_rate, info)
+    if predict_ou_only:
+        return None, None
+
+    resource_data_list, impact_data_list = _construct_interval_based_global_model_data(data_list,
+                                                                                       model_results_path)
+    with profiling_util.stage("result_writing"):
+        interference_data_cache_util.save(cache_path, cache_key, resource_data_list, impact_data_list)
 
     return resource_data_list, impact_data_list
 
 
+def iterate_window_data(input_path, ou_model_map, window_size, ee_sample_rate, txn_sample_rate,
+                        network_sample_rate, order_slack=interference_model_config.INTERVAL_SIZE):
+    """Get the data for the global models in time-ordered windows without materializing the whole input
+
+    The opunit groups are read incrementally (see grouped_op_unit_data.iterate_grouped_op_unit_data) and predicted with
+    the ou models chunk by chunk. A window is constructed once the groups that overlap with it (and with the intervals
+    that its groups run through) have been read, and the groups that cannot overlap with the later windows are
+    dropped afterwards. So the memory is bounded by the window size (plus INTERVAL_SIZE and the longest group) instead
+    of the length of the trace. The constructed data are the same as get_data as long as the lines of each input file
+    are ordered by the start time within order_slack.
+
+    :param input_path: input data file path
+    :param ou_model_map: ou models used for prediction
+    :param window_size: the time span (us) of the opunit groups to construct the data for in each window
+    :param ee_sample_rate: sampling rate for the EE OUs
+    :param txn_sample_rate: sampling rate for the transaction OUs
+    :param network_sample_rate: sampling rate for the network OUs
+    :param order_slack: the maximum time (us) that a line in an input file may start before the previous lines
+    :return: generator of (InterferenceResourceDataStore, InterferenceImpactDataStore, the mask of the resource data
+             that belong to this window, the earliest start time of the groups in the later windows) for each window.
+             The resource data outside the mask are only constructed for the groups that run past the window, and
+             belong to the later windows
+    """
+    info = data_info.get_model_map_info(ou_model_map)
+    sources = [grouped_op_unit_data.iterate_grouped_op_unit_data(filename, 0, ee_sample_rate, txn_sample_rate,
+                                                                 network_sample_rate, _LOADING_CHUNK_SIZE, info)
+               for filename in sorted(glob.glob(os.path.join(input_path, '*.csv')))]
+    # The latest start time read from each source (inf when the source is exhausted)
+    source_time = np.full(len(sources), -np.inf)
+    buffer = grouped_op_unit_data.concatenate([], info)
+    buffer.y_pred = np.zeros(buffer.y.shape)
+    # The groups starting before this time have been constructed in the previous windows
+    constructed_time = -np.inf
+    # The groups in a window should all have been read before the window is constructed
+    lookahead = max(interference_model_config.INTERVAL_SIZE, -interference_model_config.INTERVAL_START) + \
+        interference_model_config.INTERVAL_SEGMENT + order_slack
+
+    while True:
+        ready_time = np.min(source_time) - lookahead if len(sources) > 0 else np.inf
+        interval_start_time = _round_to_second(buffer.get_start_time(ConcurrentCountingMode.INTERVAL))
+        pending = interval_start_time >= constructed_time
+        window_ready = False
+        if pending.any():
+            window_start = np.min(interval_start_time[pending])
+            window_end = window_start + window_size
+            target_mask = pending & (interval_start_time < window_end)
+            # All the groups in this window, and all the intervals that these groups run through (and the groups
+            # overlapping with these intervals), need to be read
+            window_ready = (ready_time >= window_end - interference_model_config.INTERVAL_START and
+                            ready_time >= np.max(buffer.get_end_time(ConcurrentCountingMode.ESTIMATED)[target_mask]))
+
+        if not window_ready:
+            source_index = int(np.argmin(source_time))
+            if source_time[source_index] == np.inf:
+                break
+            with profiling_util.stage("load"):
+                chunk = next(sources[source_index], None)
+            if chunk is None:
+                source_time[source_index] = np.inf
+            elif len(chunk) > 0:
+                chunk.y_pred = ou_prediction_util.predict_grouped_opunits(ou_model_map, chunk.opunit_offsets,
+                                                                          chunk.opunits, chunk.feature_rows,
+                                                                          chunk.opunit_x)
+                source_time[source_index] = max(source_time[source_index], np.max(chunk.start_time))
+                buffer = grouped_op_unit_data.concatenate([buffer, chunk], info)
+            continue
+
+        with profiling_util.stage("interval_construction"):
+            targets = buffer.take(np.nonzero(target_mask)[0])
+            target_end_time = np.max(targets.get_end_time(ConcurrentCountingMode.ESTIMATED))
+            window_interval_start_time = np.unique(interval_start_time[pending &
+                                                                       (interval_start_time <= target_end_time)])
+            resource_data = _get_global_resource_data(window_interval_start_time, buffer, None)
+            impact_data = _get_global_impact_data(targets, resource_data)
+        yield (resource_data, impact_data, window_interval_start_time < window_end,
+               window_end - interference_model_config.INTERVAL_START)
+
+        # Only keep the groups in the later windows, or the groups overlapping with the intervals in the later windows
+        constructed_time = window_end
+        keep = ((interval_start_time >= window_end) |
+                (buffer.get_end_time(ConcurrentCountingMode.ESTIMATED) >= window_end))
+        buffer = buffer.take(np.nonzero(keep)[0])
+
+
+def construct_derived_data(impact_data_list, model_name, indices=None, include_same_core_x=False):
+    """Construct the input features and targets of the interference impact/direct model for all the groups at once
+
+    The input feature is (normalized ou model prediction, predicted interference resource util (excluding the OU
+    group itself), [the predicted resource util on the same core that the opunit group runs]).
+    The output target is the ratio between the actual resource util (including the elapsed time) and the ou model
+    prediction.
+
+    :param impact_data_list: InterferenceImpactDataStore (the resource y_pred should be set for the impact model)
+    :param model_name: "impact" to use the predicted interference resource util, or "direct" to use the resource
+                       util estimated by the ou models
+    :param indices: the indices of the groups to construct the data for (None for all the groups)
+    :param include_same_core_x: whether to include the resource util on the same core in the input feature
+    :return: (x, y, the ou model predictions, the actual labels)
+    """
+    with profiling_util.stage("interval_construction"):
+        grouped_data = impact_data_list.grouped_op_unit_data
+        if indices is None:
+            indices = np.arange(len(impact_data_list))
+
+        ou_model_y_pred = grouped_data.y_pred[indices]
+        raw_y = grouped_data.y[indices]
+        predicted_elapsed_us = ou_model_y_pred[:, grouped_data.info.target_csv_index[Target.ELAPSED_US]]
+        predicted_resource_util = None
+        if model_name == "impact":
+            predicted_resource_util = impact_data_list.get_y_pred()[indices]
+        if model_name == "direct":
+            predicted_resource_util = impact_data_list.x[indices]
+
+        # Remove the OU group itself from the total resource data
+        self_resource = (ou_model_y_pred * np.maximum(1, grouped_data.concurrency[indices])[:, np.newaxis] /
+                         impact_data_list.resource_num[indices][:, np.newaxis] /
+                         interference_model_config.INTERVAL_SIZE)
+        predicted_resource_util[:, :ou_model_y_pred.shape[1]] -= self_resource
+        predicted_resource_util[predicted_resource_util < 0] = 0
+
+        x_list = [ou_model_y_pred / predicted_elapsed_us[:, np.newaxis], predicted_resource_util]
+        if include_same_core_x:
+            x_list.append(impact_data_list.resource_util_same_core_x[indices])
+        x = np.concatenate(x_list, axis=1)
+        y = raw_y / (ou_model_y_pred + interference_model_config.RATIO_DIVISION_EPSILON)
+
+    return x, y, ou_model_y_pred, raw_y
+
+
 def _get_grouped_opunit_data_with_prediction(input_path, ou_model_map, model_results_path, warmup_period,
                                              use_query_predict_cache, add_noise, ee_sample_rate,
-                                             txn_sample_rate, network_sample_rate):
+                                             txn_sample_rate, network_sample_rate, info):
     """Get the grouped opunit data with the predicted metrics and elapsed time
 
     :param input_path: input data file path
     :param ou_model_map: ou models used for prediction
     :param model_results_path: directory path to log the result information
     :param warmup_period: warmup period for pipeline data
-    :return: The list of the GroupedOpUnitData objects
+    :param info: the DataInfo of the ou models
+    :return: The GroupedOpUnitDataStore with the predictions
     """
     data_list = _get_data_list(input_path, warmup_period, ee_sample_rate, txn_sample_rate,
-                               network_sample_rate)
+                               network_sample_rate, info)
     _predict_grouped_opunit_data(data_list, ou_model_map, model_results_path, use_query_predict_cache, add_noise)
     logging.info("Finished GroupedOpUnitData prediction with the ou models")
     return data_list
@@ -75,52 +220,24 @@ def _get_grouped_opunit_data_with_prediction(input_path, ou_model_map, model_res
 def _construct_interval_based_global_model_data(data_list, model_results_path):
     """Construct the InterferenceImpactData used for the global model training
 
-    :param data_list: The list of GroupedOpUnitData objects
+    :param data_list: The GroupedOpUnitDataStore with the predictions
     :param model_results_path: directory path to log the result information
-    :return: (InterferenceResourceData list, InterferenceImpactData list)
+    :return: (InterferenceResourceDataStore, InterferenceImpactDataStore)
     """
     prediction_path = "{}/global_resource_data.csv".format(model_results_path)
     io_util.create_csv_file(prediction_path, ["Elapsed us", "# Concurrent OpUnit Groups"])
 
-    start_time_list = sorted([d.get_start_time(ConcurrentCountingMode.INTERVAL) for d in data_list])
-    rounded_start_time_list = [_round_to_second(start_time_list[0])]
-    # Map from interval start time to the data in this interval
-    interval_data_map = {rounded_start_time_list[0]: []}
-    # Get all the interval start times and initialize the map
-    for t in start_time_list:
-        rounded_time = _round_to_second(t)
-        if rounded_time > rounded_start_time_list[-1]:
-            rounded_start_time_list.append(rounded_time)
-            interval_data_map[rounded_time] = []
-
-    for data in tqdm.tqdm(data_list, desc="Find Interval Data"):
-        # For each data, find the intervals that might overlap with it
-        interval_start_time = _round_to_second(data.get_start_time(ConcurrentCountingMode.EXACT) -
-                                               interference_model_config.INTERVAL_SIZE + interference_model_config.INTERVAL_SEGMENT)
-        while interval_start_time <= data.get_end_time(ConcurrentCountingMode.ESTIMATED):
-            if interval_start_time in interval_data_map:
-                interval_data_map[interval_start_time].append(data)
-            interval_start_time += interference_model_config.INTERVAL_SEGMENT
-
-    # Get the global resource data
-    resource_data_map = {}
-    for start_time in tqdm.tqdm(rounded_start_time_list, desc="Construct InterferenceResourceData"):
-        resource_data_map[start_time] = _get_global_resource_data(start_time, interval_data_map[start_time],
-                                                                  prediction_path)
-
-    # Now construct the global impact data
-    impact_data_list = []
-    for data in data_list:
-        interval_start_time = _round_to_second(data.get_start_time(ConcurrentCountingMode.INTERVAL))
-        resource_data_list = []
-        while interval_start_time <= data.get_end_time(ConcurrentCountingMode.ESTIMATED):
-            if interval_start_time in resource_data_map:
-                resource_data_list.append(resource_data_map[interval_start_time])
-            interval_start_time += interference_model_config.INTERVAL_SIZE
-
-        impact_data_list.append(interference_model_data.InterferenceImpactData(data, resource_data_list))
-
-    return list(resource_data_map.values()), impact_data_list
+    with profiling_util.stage("interval_construction"):
+        # Get all the interval start times
+        interval_start_time = np.unique(_round_to_second(data_list.get_start_time(ConcurrentCountingMode.INTERVAL)))
+
+        # Get the global resource data
+        resource_data = _get_global_resource_data(interval_start_time, data_list, prediction_path)
+
+        # Now construct the global impact data
+        impact_data = _get_global_impact_data(data_list, resource_data)
+
+    return resource_data, impact_data
 
 
 def _round_to_second(time):
@@ -131,119 +248,191 @@ def _round_to_second(time):
     return time - time % 1000000
 
 
-def _get_global_resource_data(start_time, concurrent_data_list, log_path):
-    """Get the input feature and the target output for the global resource utilization metrics during an interval
+def _get_global_resource_data(interval_start_time, data_list, log_path):
+    """Get the input feature and the target output for the global resource utilization metrics during the intervals
 
-    The calculation is adjusted by the overlapping ratio between the opunit groups and the time range.
+    The calculation is adjusted by the overlapping ratio between the opunit groups and the time range. The opunit
+    groups are swept against the sorted interval start times: each group overlaps with a contiguous range of intervals,
+    and the (group, interval) overlaps are expanded and accumulated into the intervals in chunks.
 
-    :param start_time: of the interval
-    :param concurrent_data_list: the concurrent running opunit groups
-    :param log_path: the file path to log the data construction results
-    :return: (the input feature, the resource utilization on the other logical core of the same physical core,
-    the output resource targets)
+    :param interval_start_time: the sorted start times of the intervals
+    :param data_list: the GroupedOpUnitDataStore with the predictions
+    :param log_path: the file path to log the data construction results (None to skip logging)
+    :return: InterferenceResourceDataStore with (the resource utilization per core, the input feature, the output
+             resource targets) of the intervals
     """
-    # Define a secondary_counting_mode corresponding to the concurrent_counting_mode to derive the concurrent operations
-    # in different scenarios
-    end_time = start_time + interference_model_config.INTERVAL_SIZE - 1
     elapsed_us = interference_model_config.INTERVAL_SIZE
+    num_intervals = len(interval_start_time)
+    target_num = data_list.y.shape[1]
 
     # The adjusted resource metrics per logical core.
     # TODO: Assuming each physical core has two logical cores via hyper threading for now. Can extend to other scenarios
     physical_core_num = hardware_info.PHYSICAL_CORE_NUM
-    adjusted_x_list = [0] * 2 * physical_core_num
-    adjusted_y = 0
-    logging.debug(concurrent_data_list)
-    logging.debug("{} {}".format(start_time, end_time))
-
-    for data in concurrent_data_list:
-        data_start_time = data.get_start_time(ConcurrentCountingMode.ESTIMATED)
-        data_end_time = data.get_end_time(ConcurrentCountingMode.ESTIMATED)
-        ratio = _calculate_range_overlap(start_time, end_time, data_start_time, data_end_time) / (data_end_time -
-                                                                                                  data_start_time + 2)
-        # print(start_time, end_time, data_start_time, data_end_time, data_end_time - data_start_time + 1)
-        sample_rate = data.sample_rate
-        logging.debug("{} {} {}".format(data_start_time, data_end_time, ratio))
-        logging.debug("{} {}".format(data.y, data.y_pred))
-        logging.debug("Sampling rate: {}".format(sample_rate))
-        scaling_factor = 100 / sample_rate if sample_rate > 0 else 1  # sampling rate is percentage based
+    adjusted_x_list = np.zeros((num_intervals, 2 * physical_core_num, target_num))
+    adjusted_y = np.zeros((num_intervals, target_num))
+    concurrent_data_num = np.zeros(num_intervals, dtype=np.int64)
+
+    data_start_time = data_list.get_start_time(ConcurrentCountingMode.ESTIMATED)
+    data_end_time = data_list.get_end_time(ConcurrentCountingMode.ESTIMATED)
+    # sampling rate is percentage based
+    sample_rate = data_list.sample_rate
+    scaling_factor = np.where(sample_rate > 0, 100 / np.where(sample_rate > 0, sample_rate, 1), 1)
+    cpu_id = data_list.cpu_id
+    cpu_id = np.where(cpu_id > physical_core_num, cpu_id - physical_core_num, cpu_id)
+
+    # For each data, find the intervals that might overlap with it
+    first_interval = np.searchsorted(interval_start_time, _round_to_second(
+        data_list.get_start_time(ConcurrentCountingMode.EXACT) - interference_model_config.INTERVAL_SIZE +
+        interference_model_config.INTERVAL_SEGMENT), side='left')
+    end_interval = np.searchsorted(interval_start_time, data_end_time, side='right')
+    overlap_num = np.maximum(end_interval - first_interval, 0)
+
+    for data_index, interval_index in tqdm.tqdm(_expand_overlaps(first_interval, overlap_num),
+                                                desc="Construct InterferenceResourceData"):
+        start_time = interval_start_time[interval_index]
+        end_time = start_time + interference_model_config.INTERVAL_SIZE - 1
+        ratio = (_calculate_range_overlap(start_time, end_time, data_start_time[data_index],
+                                          data_end_time[data_index]) /
+                 (data_end_time[data_index] - data_start_time[data_index] + 2))[:, np.newaxis]
+        scaling = scaling_factor[data_index][:, np.newaxis]
         # Multiply the resource metrics based on the sampling rate
-        adjusted_y += data.y * ratio * scaling_factor
-        cpu_id = data.cpu_id
-        if cpu_id > physical_core_num:
-            cpu_id -= physical_core_num
+        np.add.at(adjusted_y, interval_index, data_list.y[data_index] * ratio * scaling)
         # Multiply the ou-model predictions based on the sampling rate
-        adjusted_x_list[cpu_id] += data.y_pred * ratio * scaling_factor
+        np.add.at(adjusted_x_list, (interval_index, cpu_id[data_index]),
+                  data_list.y_pred[data_index] * ratio * scaling)
+        concurrent_data_num += np.bincount(interval_index, minlength=num_intervals)
 
     # change the number to per time unit (us) utilization
-    for x in adjusted_x_list:
-        x /= elapsed_us
+    adjusted_x_list /= elapsed_us
     adjusted_y /= elapsed_us
 
-    sum_adjusted_x = np.sum(adjusted_x_list, axis=0)
-    std_adjusted_x = np.std(adjusted_x_list, axis=0)
+    sum_adjusted_x = np.sum(adjusted_x_list, axis=1)
+    std_adjusted_x = np.std(adjusted_x_list, axis=1)
 
     ratio_error = abs(adjusted_y - sum_adjusted_x) / (adjusted_y + 1e-6)
 
-    logging.debug(sum_adjusted_x)
-    logging.debug(adjusted_y)
-    logging.debug("")
+    if log_path is not None:
+        io_util.write_csv_results(log_path, [elapsed_us] * num_intervals,
+                                  [[concurrent_data_num[i]] + list(sum_adjusted_x[i]) + [""] + list(adjusted_y[i]) +
+                                   [""] + list(ratio_error[i]) for i in range(num_intervals)])
 
-    io_util.write_csv_result(log_path, elapsed_us, [len(concurrent_data_list)] + list(sum_adjusted_x) + [""] +
-                             list(adjusted_y) + [""] + list(ratio_error))
+    adjusted_x = np.concatenate((sum_adjusted_x, std_adjusted_x), axis=1)
 
-    adjusted_x = np.concatenate((sum_adjusted_x, std_adjusted_x))
+    return interference_model_data.InterferenceResourceDataStore(interval_start_time, adjusted_x_list, adjusted_x,
+                                                                 adjusted_y)
 
-    return interference_model_data.InterferenceResourceData(start_time, adjusted_x_list, adjusted_x, adjusted_y)
+
+def _get_global_impact_data(data_list, resource_data):
+    """Get the InterferenceImpactData for all the opunit groups
+
+    Each group is associated with the intervals that start from its own interval start time, and every INTERVAL_SIZE
+    after that until the group ends.
+
+    :param data_list: the GroupedOpUnitDataStore with the predictions
+    :param resource_data: the InterferenceResourceDataStore of the intervals
+    :return: InterferenceImpactDataStore
+    """
+    interval_start_time = resource_data.start_time
+    first_start_time = _round_to_second(data_list.get_start_time(ConcurrentCountingMode.INTERVAL))
+    data_end_time = data_list.get_end_time(ConcurrentCountingMode.ESTIMATED)
+    candidate_num = np.where(data_end_time >= first_start_time,
+                             (data_end_time - first_start_time) // interference_model_config.INTERVAL_SIZE + 1,
+                             0).astype(np.int64)
+
+    resource_data_num = np.zeros(len(data_list), dtype=np.int64)
+    resource_indices = []
+    for data_index, step in _expand_overlaps(np.zeros(len(data_list), dtype=np.int64), candidate_num):
+        candidate_time = first_start_time[data_index] + step * interference_model_config.INTERVAL_SIZE
+        candidate_index = np.minimum(np.searchsorted(interval_start_time, candidate_time), len(interval_start_time) - 1)
+        found = interval_start_time[candidate_index] == candidate_time
+        resource_data_num += np.bincount(data_index[found], minlength=len(data_list))
+        resource_indices.append(candidate_index[found])
+
+    resource_offsets = np.concatenate(([0], np.cumsum(resource_data_num)))
+    resource_indices = np.concatenate(resource_indices) if resource_indices else np.zeros(0, dtype=np.int64)
+    return interference_model_data.InterferenceImpactDataStore(data_list, resource_data, resource_offsets,
+                                                               resource_indices)
+
+
+def _expand_overlaps(first_index, overlap_num, chunk_size=_OVERLAP_CHUNK_SIZE):
+    """Expand the ranges [first_index, first_index + overlap_num) of all the data into (data index, index) pairs
+
+    The pairs are generated in the order of the data in chunks of roughly chunk_size pairs to bound the memory.
+
+    :param first_index: the first index of the range for each data
+    :param overlap_num: the length of the range for each data
+    :param chunk_size: the number of pairs per chunk
+    :return: generator of (data index array, index array)
+    """
+    pair_end = np.cumsum(overlap_num)
+    begin = 0
+    while begin < len(overlap_num):
+        end = max(int(np.searchsorted(pair_end, pair_end[begin] - overlap_num[begin] + chunk_size, side='right')),
+                  begin + 1)
+        data_index = np.repeat(np.arange(begin, end), overlap_num[begin:end])
+        pair_begin = pair_end[data_index] - overlap_num[data_index]
+        offset = np.arange(len(data_index)) - (pair_begin - (pair_end[begin] - overlap_num[begin]))
+        yield data_index, first_index[data_index] + offset
+        begin = end
 
 
 def _calculate_range_overlap(start_timel, end_timel, start_timer, end_timer):
-    return min(end_timel, end_timer) - max(start_timel, start_timer) + 1
+    return np.minimum(end_timel, end_timer) - np.maximum(start_timel, start_timer) + 1
 
 
 def _get_data_list(input_path, warmup_period, ee_sample_rate, txn_sample_rate,
-                   network_sample_rate):
+                   network_sample_rate, info, num_workers=None):
     """Get the list of all the operating units (or groups of operating units) stored in InterferenceData objects
 
+    The files are loaded in parallel by a process pool. Each task loads a whole file, except that the pipeline data
+    files are split into byte-range chunks so that a single large file is also loaded in parallel.
+
     :param input_path: input data file path
     :param warmup_period: warmup period for pipeline data
-    :return: the list of all the operating units (or groups of operating units) stored in InterferenceData objects
+    :param info: the DataInfo to locate the data with
+    :param num_workers: the number of processes to load the data (None for the number of CPUs)
+    :return: the GroupedOpUnitDataStore of all the operating units (or groups of operating units)
     """
-    data_list = []
-
-    # First get the data for all ou runners
+    tasks = []
     for filename in glob.glob(os.path.join(input_path, '*.csv')):
-        data_list += grouped_op_unit_data.get_grouped_op_unit_data(filename, warmup_period,
-                                                                   ee_sample_rate, txn_sample_rate,
-                                                                   network_sample_rate)
-        logging.info("Loaded file: {}".format(filename))
+        if "txn" not in filename and "pipeline" in filename:
+            for byte_range in grouped_op_unit_data.get_pipeline_chunk_ranges(filename, _LOADING_CHUNK_SIZE):
+                tasks.append((filename, byte_range))
+        else:
+            tasks.append((filename, None))
 
-    return data_list
+    loading_args = (warmup_period, ee_sample_rate, txn_sample_rate, network_sample_rate)
+    if num_workers is None:
+        num_workers = os.cpu_count()
+    num_workers = min(num_workers, len(tasks))
 
+    # The stages inside the worker processes are not recorded (their CPU time is part of the loading)
+    with profiling_util.stage("load"):
+        if num_workers <= 1:
+            store_list = [_load_grouped_op_unit_data(task, loading_args, info) for task in tasks]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+                store_list = list(executor.map(_load_grouped_op_unit_data, tasks, [loading_args] * len(tasks),
+                                               [info] * len(tasks)))
 
-def _add_estimation_noise(opunit, x):
-    """Add estimation noise to the OUs that may use the cardinality estimation
-    """
-    if opunit not in data_info.instance.OUS_USING_CAR_EST:
-        return
-    tuple_num_index = data_info.instance.input_csv_index[ExecutionFeature.NUM_ROWS]
-    cardinality_index = data_info.instance.input_csv_index[ExecutionFeature.EST_CARDINALITIES]
-    tuple_num = x[tuple_num_index]
-    cardinality = x[cardinality_index]
-    if tuple_num > 1000:
-        logging.debug("Adding noise to tuple num (%)".format(tuple_num))
-        x[tuple_num_index] += np.random.normal(0, tuple_num * 0.3)
-        x[tuple_num_index] = max(1, x[tuple_num_index])
-    if cardinality > 1000:
-        logging.debug("Adding noise to cardinality (%)".format(x[cardinality_index]))
-        x[cardinality_index] += np.random.normal(0, cardinality * 0.3)
-        x[cardinality_index] = max(1, x[cardinality_index])
+        for filename in dict.fromkeys(task[0] for task in tasks):
+            logging.info("Loaded file: {}".format(filename))
+
+        return grouped_op_unit_data.concatenate(store_list, info)
+
+
+def _load_grouped_op_unit_data(task, loading_args, info):
+    filename, byte_range = task
+    return grouped_op_unit_data.get_grouped_op_unit_data(filename, *loading_args, byte_range=byte_range, info=info)
 
 
 def _predict_grouped_opunit_data(data_list, ou_model_map, model_results_path, use_query_predict_cache, add_noise):
     """Use the ou-runner to predict the resource consumptions for all the InterferenceData, and record the prediction
     result in place
 
-    :param data_list: The list of the GroupedOpUnitData objects
+    All the opunits with the same type are predicted together in one batch.
+
+    :param data_list: The GroupedOpUnitDataStore to predict
     :param ou_model_map: The trained ou models
     :param model_results_path: file path to log the prediction results
     :param use_query_predict_cache: whether cache the prediction result based on the query for acceleration
@@ -255,154 +444,71 @@ def _predict_grouped_opunit_data(data_list, ou_model_map, model_results_path, us
     io_util.create_csv_file(pipeline_path, ["Number", "Percentage", "Pipeline", "Actual Us", "Predicted Us",
                                             "Us Error", "Absolute Us", "Absolute Us %"])
 
-    # Track pipeline cumulative numbers
-    num_pipelines = 0
-    total_actual = None
-    total_predicted = []
-    actual_pipelines = {}
-    predicted_pipelines = {}
-    count_pipelines = {}
-
     query_prediction_path = "{}/grouped_query_prediction.csv".format(model_results_path)
     io_util.create_csv_file(query_prediction_path, ["Query", "", "Actual", "", "Predicted", "", "Ratio Error"])
-    current_query_id = None
-    query_y = None
-    query_y_pred = None
 
-    # Have to use a prediction cache when having lots of global data...
-    prediction_cache = {}
-
-    # use a prediction cache based on queries to accelerate
-    query_prediction_cache = {}
+    name_list = data_list.name_list
+    name_codes = data_list.name_codes
+    is_query = np.array([name[0] == 'q' for name in name_list], dtype=bool)
+
+    # use a prediction cache based on queries to accelerate: only the first group of a query pipeline is predicted,
+    # and the following groups with the same name reuse its prediction
+    group_mask = None
+    first_group = None
+    if use_query_predict_cache:
+        codes, first_index = np.unique(name_codes, return_index=True)
+        first_group_map = np.zeros(len(name_list), dtype=np.int64)
+        first_group_map[codes] = first_index
+        first_group = first_group_map[name_codes]
+        group_mask = ~is_query[name_codes] | (first_group == np.arange(len(name_codes)))
 
     # First run a prediction on the global running data with the ou model results
-    for i, data in enumerate(tqdm.tqdm(data_list, desc="Predict GroupedOpUnitData")):
-        y = data.y
-        if data.name[0] != 'q' or (data.name not in query_prediction_cache) or not use_query_predict_cache:
-            logging.debug("{} pipeline elapsed time: {}".format(data.name, y[-1]))
-
-            pipeline_y_pred = 0
-            for opunit_feature in data.opunit_features:
-                opunit = opunit_feature[0]
-                opunit_model = ou_model_map[opunit]
-                x = np.array(opunit_feature[1]).reshape(1, -1)
-
-                if add_noise:
-                    _add_estimation_noise(opunit, x[0])
-
-                key = (opunit, x.tobytes())
-                if key not in prediction_cache:
-                    y_pred = opunit_model.predict(x)
-                    y_pred = np.clip(y_pred, 0, None)
-                    prediction_cache[key] = y_pred
-                else:
-                    y_pred = prediction_cache[key]
-                logging.debug("Predicted {} elapsed time with feature {}: {}".format(opunit_feature[0].name,
-                                                                                     x[0], y_pred[0, -1]))
-
-                if opunit in data_info.instance.MEM_ADJUST_OPUNITS:
-                    # Compute the number of "slots" (based on row feature or cardinality feature
-                    num_tuple = opunit_feature[1][data_info.instance.input_csv_index[ExecutionFeature.NUM_ROWS]]
-                    if opunit == OpUnit.AGG_BUILD:
-                        num_tuple = opunit_feature[1][
-                            data_info.instance.input_csv_index[ExecutionFeature.EST_CARDINALITIES]]
-
-                    # SORT/AGG/HASHJOIN_BUILD all allocate a "pointer" buffer
-                    # that contains the first pow2 larger than num_tuple entries
-                    pow_high = 2 ** math.ceil(math.log(num_tuple, 2))
-                    buffer_size = pow_high * data_info.instance.POINTER_SIZE
-                    if opunit == OpUnit.AGG_BUILD and num_tuple <= 256:
-                        # For AGG_BUILD, if slots <= AggregationHashTable::K_DEFAULT_INITIAL_TABLE_SIZE
-                        # the buffer is not recorded as part of the pipeline
-                        buffer_size = 0
-
-                    pred_mem = y_pred[0][data_info.instance.target_csv_index[Target.MEMORY_B]]
-                    if pred_mem <= buffer_size:
-                        logging.debug("{} feature {} {} with prediction {} exceeds buffer {}"
-                                      .format(data.name, opunit_feature, opunit_feature[1], y_pred[0], buffer_size))
-
-                    # For hashjoin_build, there is still some inaccuracy due to the
-                    # fact that we do not know about the hash table's load factor.
-                    scale = data_info.instance.input_csv_index[ExecutionFeature.MEM_FACTOR]
-                    adj_mem = (pred_mem - buffer_size) * opunit_feature[1][scale] + buffer_size
-
-                    # Don't modify prediction cache
-                    y_pred = copy.deepcopy(y_pred)
-                    y_pred[0][data_info.instance.target_csv_index[Target.MEMORY_B]] = adj_mem
-
-                pipeline_y_pred += y_pred[0]
-
-            pipeline_y = copy.deepcopy(pipeline_y_pred)
-
-            query_prediction_cache[data.name] = pipeline_y
-        else:
-            pipeline_y_pred = query_prediction_cache[data.name]
-            pipeline_y = copy.deepcopy(pipeline_y_pred)
-
-        # Grouping when we're predicting queries
-        if data.name[0] == 'q':
-            query_id = data.name[1:data.name.rfind(" p")]
-            if query_id != current_query_id:
-                if current_query_id is not None:
-                    io_util.write_csv_result(query_prediction_path, current_query_id, [""] + list(query_y) + [""] +
-                                             list(query_y_pred) + [""] +
-                                             list(abs(query_y - query_y_pred) / (query_y + 1)))
-
-                current_query_id = query_id
-                query_y = copy.deepcopy(y)
-                query_y_pred = copy.deepcopy(pipeline_y_pred)
-            else:
-                query_y += y
-                query_y_pred += pipeline_y_pred
-
-        data.y_pred = pipeline_y
-        logging.debug("{} pipeline prediction: {}".format(data.name, pipeline_y))
-        logging.debug("{} pipeline predicted time: {}".format(data.name, pipeline_y[-1]))
-        ratio_error = abs(y - pipeline_y) / (y + 1)
-        logging.debug("|Actual - Predict| / Actual: {}".format(ratio_error[-1]))
-
-        io_util.write_csv_result(prediction_path, data.name, [""] + list(y) + [""] + list(pipeline_y) + [""] +
-                                 list(ratio_error))
-
-        logging.debug("")
-
-        # Record cumulative numbers
-        if data.name not in actual_pipelines:
-            actual_pipelines[data.name] = copy.deepcopy(y)
-            predicted_pipelines[data.name] = copy.deepcopy(pipeline_y)
-            count_pipelines[data.name] = 1
-        else:
-            actual_pipelines[data.name] += y
-            predicted_pipelines[data.name] += pipeline_y
-            count_pipelines[data.name] += 1
-
-        # Update totals
-        if total_actual is None:
-            total_actual = copy.deepcopy(y)
-            total_predicted = copy.deepcopy(pipeline_y)
-        else:
-            total_actual += y
-            total_predicted += pipeline_y
-
-        num_pipelines += 1
-
-    total_elapsed_err = 0
-    for pipeline in actual_pipelines:
-        actual = actual_pipelines[pipeline]
-        predicted = predicted_pipelines[pipeline]
-        total_elapsed_err = total_elapsed_err + (abs(actual - predicted))[-1]
-
-    for pipeline in actual_pipelines:
-        actual = actual_pipelines[pipeline]
-        predicted = predicted_pipelines[pipeline]
-        num = count_pipelines[pipeline]
-
-        ratio_error = abs(actual - predicted) / (actual + 1)
-        abs_error = abs(actual - predicted)[-1]
-        pabs_error = abs_error / total_elapsed_err
-        io_util.write_csv_result(pipeline_path, pipeline, [num, num * 1.0 / num_pipelines, actual[-1],
-                                                           predicted[-1], ratio_error[-1], abs_error, pabs_error] +
-                                 [""] + list(actual) + [""] + list(predicted) + [""] + list(ratio_error))
+    y_pred = ou_prediction_util.predict_grouped_opunits(ou_model_map, data_list.opunit_offsets, data_list.opunits,
+                                                        data_list.feature_rows, data_list.opunit_x, group_mask,
+                                                        add_noise)
+    if group_mask is not None:
+        y_pred = y_pred[np.where(group_mask, np.arange(len(name_codes)), first_group)]
+    data_list.y_pred = y_pred
+    y = data_list.y
+
+    ratio_error = abs(y - y_pred) / (y + 1)
+    io_util.write_csv_results(prediction_path, data_list.get_names(),
+                              [[""] + list(y[i]) + [""] + list(y_pred[i]) + [""] + list(ratio_error[i])
+                               for i in range(len(y))])
+
+    # Grouping the consecutive pipelines of the same query when we're predicting queries
+    query_groups = np.nonzero(is_query[name_codes])[0]
+    if len(query_groups) > 0:
+        name_query_ids = [name[1:name.rfind(" p")] for name in name_list]
+        query_ids = [name_query_ids[code] for code in name_codes[query_groups]]
+        run_starts = [i for i in range(len(query_ids)) if i == 0 or query_ids[i] != query_ids[i - 1]]
+        query_y = np.add.reduceat(y[query_groups], run_starts, axis=0)
+        query_y_pred = np.add.reduceat(y_pred[query_groups], run_starts, axis=0)
+        # The last query is still being accumulated when the data ends and is not recorded
+        io_util.write_csv_results(query_prediction_path, [query_ids[i] for i in run_starts[:-1]],
+                                  [[""] + list(query_y[i]) + [""] + list(query_y_pred[i]) + [""] +
+                                   list(abs(query_y[i] - query_y_pred[i]) / (query_y[i] + 1))
+                                   for i in range(len(run_starts) - 1)])
+
+    # Record cumulative numbers (in the order of the first appearance of the pipelines)
+    num_pipelines = len(y)
+    actual_pipelines = np.zeros((len(name_list), y.shape[1]))
+    predicted_pipelines = np.zeros((len(name_list), y.shape[1]))
+    np.add.at(actual_pipelines, name_codes, y)
+    np.add.at(predicted_pipelines, name_codes, y_pred)
+    count_pipelines = np.bincount(name_codes, minlength=len(name_list))
+    total_actual = np.sum(y, axis=0)
+    total_predicted = np.sum(y_pred, axis=0)
+
+    abs_error = abs(actual_pipelines - predicted_pipelines)[:, -1]
+    total_elapsed_err = np.sum(abs_error)
+    ratio_error = abs(actual_pipelines - predicted_pipelines) / (actual_pipelines + 1)
+    io_util.write_csv_results(pipeline_path, name_list,
+                              [[count_pipelines[i], count_pipelines[i] * 1.0 / num_pipelines,
+                                actual_pipelines[i][-1], predicted_pipelines[i][-1], ratio_error[i][-1],
+                                abs_error[i], abs_error[i] / total_elapsed_err] +
+                               [""] + list(actual_pipelines[i]) + [""] + list(predicted_pipelines[i]) + [""] +
+                               list(ratio_error[i]) for i in range(len(name_list))])
 
     ratio_error = abs(total_actual - total_predicted) / (total_actual + 1)
     io_util.write_csv_result(pipeline_path, "Total Pipeline", [num_pipelines, 1, total_actual[-1],
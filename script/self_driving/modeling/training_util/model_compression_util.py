@@ -0,0 +1,93 @@
+import logging
+import math
+import time
+
+from .. import model
+from ..util import profiling_util
+
+# The smaller configurations of each method to compress a model into (fewer and shallower trees, smaller networks).
+# The hyperparameters override the default configuration of the method (in model.py). The small forests are evaluated
+# in one thread since dispatching their trees to a thread pool takes longer than the trees for a batch of rows
+COMPRESSION_SPACE = {
+    'rf': [{'n_estimators': 20, 'max_depth': 12, 'n_jobs': 1}, {'n_estimators': 10, 'max_depth': 8, 'n_jobs': 1},
+           {'n_estimators': 5, 'max_depth': 6, 'n_jobs': 1}],
+    'gbm': [{'n_estimators': 50, 'num_leaves': 127, 'max_depth': 10}, {'n_estimators': 30, 'num_leaves': 31},
+            {'n_estimators': 10, 'num_leaves': 15}],
+    'nn': [{'hidden_layer_sizes': (10, 10)}, {'hidden_layer_sizes': (10,)}],
+}
+
+# The maximum number of rows to measure the prediction latency with
+LATENCY_ROWS = 1000
+
+# The number of timed predictions (the fastest one is the latency)
+LATENCY_REPEATS = 3
+
+
+def measure_latency(regressor, x):
+    """Measure the prediction latency of a trained model
+
+    The model predicts a batch of (up to LATENCY_ROWS) rows once to warm up (e.g., to compile the inference path) and
+    then LATENCY_REPEATS times.
+
+    :param regressor: the trained model
+    :param x: the input to predict
+    :return: the prediction time per row in microseconds
+    """
+    x = x[:LATENCY_ROWS]
+    if x.shape[0] == 0:
+        return 0
+    regressor.predict(x)
+    latency = math.inf
+    for _ in range(LATENCY_REPEATS):
+        start_time = time.perf_counter()
+        regressor.predict(x)
+        latency = min(latency, time.perf_counter() - start_time)
+    return latency / x.shape[0] * 1e6
+
+
+def compress(teacher, method, x_train, y_train, x_test, y_test, get_error, latency_budget, latency_penalty=0,
+             model_kwargs=None, students=()):
+    """Compress a trained model that predicts slower than the latency budget
+
+    The candidates are the smaller configurations of the model's method in COMPRESSION_SPACE, trained both on the labels
+    and on the predictions of the model (distillation, whose targets are smoother for the smaller models), and the
+    student methods (with their default configuration) trained on the predictions of the model. Among the candidates
+    within the latency budget, the one with the lowest test error plus the latency penalty is returned.
+
+    :param teacher: the trained model to compress
+    :param method: the ML method of the model
+    :param x_train: the training input
+    :param y_train: the training labels
+    :param x_test: the test input
+    :param y_test: the test labels
+    :param get_error: the function (y, y_pred) -> the test error to minimize
+    :param latency_budget: the maximum prediction time per row in microseconds
+    :param latency_penalty: the test error added per microsecond of the prediction time per row
+    :param model_kwargs: the other arguments of model.Model (e.g., the data transformers)
+    :param students: the ML methods to distill the model into
+    :return: (the compressed model, its method, its hyperparameters (None for the default configuration), whether it is
+             distilled, its test error, its latency), or None if no candidate is within the budget
+    """
+    model_kwargs = {} if model_kwargs is None else model_kwargs
+    candidates = [(method, params, distilled) for params in COMPRESSION_SPACE.get(method, [])
+                  for distilled in [False, True]]
+    candidates += [(student, None, True) for student in students]
+    with profiling_util.stage("evaluation"):
+        teacher_y = teacher.predict(x_train)
+
+    best = None
+    best_score = math.inf
+    for candidate_method, params, distilled in candidates:
+        with profiling_util.label(method=candidate_method):
+            regressor = model.Model(candidate_method, params=params, **model_kwargs)
+            regressor.train(x_train, teacher_y if distilled else y_train)
+            with profiling_util.stage("evaluation"):
+                error = get_error(y_test, regressor.predict(x_test))
+                latency = measure_latency(regressor, x_test)
+        logging.info("{} {} {}: test error {:.4f}, {:.2f} us per row".format(
+            "Distilled" if distilled else "Compressed", candidate_method, params, error, latency))
+        score = error + latency_penalty * latency
+        if latency <= latency_budget and score < best_score:
+            best_score = score
+            best = (regressor, candidate_method, params, distilled, error, latency)
+    return best
@@ -0,0 +1,117 @@
+import logging
+import numpy as np
+
+from ..info import data_info
+from ..util import profiling_util
+from ..type import OpUnit, Target, ExecutionFeature
+
+
+def predict_grouped_opunits(ou_model_map, opunit_offsets, opunits, feature_rows, opunit_x, group_mask=None,
+                            add_noise=False):
+    """Predict the resource consumptions of groups of opunits in batch
+
+    The opunits are stored in a CSR-style layout: the opunits of group i are the entries in
+    [opunit_offsets[i], opunit_offsets[i + 1]), and the input feature of entry j is the row feature_rows[j] in the
+    feature matrix opunit_x[opunits[j]]. All the entries of the same opunit are predicted with a single model call.
+
+    :param ou_model_map: The trained ou models
+    :param opunit_offsets: The offsets of the opunits of each group in opunits and feature_rows
+    :param opunits: The opunit of each entry
+    :param feature_rows: The row of each entry in the feature matrix of its opunit
+    :param opunit_x: The map from opunit to its input feature matrix
+    :param group_mask: Only predict the groups where the mask is True (None for all groups)
+    :param add_noise: whether to add noise to the cardinality estimations
+    :return: the sum of the opunit predictions for each group (groups not predicted are 0)
+    """
+    num_groups = len(opunit_offsets) - 1
+    info = data_info.get_model_map_info(ou_model_map)
+    group_y_pred = np.zeros((num_groups, info.MINI_MODEL_TARGET_NUM))
+    entry_groups = np.repeat(np.arange(num_groups), np.diff(opunit_offsets))
+    entry_mask = np.ones(len(opunits), dtype=bool) if group_mask is None else group_mask[entry_groups]
+
+    for opunit_id in np.unique(opunits[entry_mask]):
+        opunit = OpUnit(opunit_id)
+        entries = np.nonzero(entry_mask & (opunits == opunit_id))[0]
+        with profiling_util.stage("ou_prediction", opunit=opunit.name):
+            y_pred = predict_opunit_data(ou_model_map, opunit, opunit_x[opunit_id][feature_rows[entries]],
+                                         add_noise)
+            np.add.at(group_y_pred, entry_groups[entries], y_pred)
+
+    return group_y_pred
+
+
+def predict_opunit_data(ou_model_map, opunit, x, add_noise=False):
+    """Predict the resource consumptions of an opunit for a batch of input features
+
+    Identical feature rows are only predicted once. The memory prediction of the opunits in MEM_ADJUST_OPUNITS is
+    adjusted by the buffer size they allocate. The features are located with the data info of the opunit's model.
+
+    :param ou_model_map: The trained ou models
+    :param opunit: The opunit to predict
+    :param x: The input features (one row per opunit)
+    :param add_noise: whether to add noise to the cardinality estimations
+    :return: the predictions (one row per opunit)
+    """
+    model = ou_model_map[opunit]
+    info = model.get_data_info()
+    if info is None:
+        info = data_info.instance
+
+    model_x = x
+    if add_noise:
+        model_x = x.copy()
+        _add_estimation_noise(info, opunit, model_x)
+
+    unique_x, inverse = np.unique(model_x, axis=0, return_inverse=True)
+    logging.debug("Predicting {} {} OUs with {} distinct features".format(x.shape[0], opunit.name,
+                                                                          unique_x.shape[0]))
+    y_pred = model.predict(unique_x)
+    y_pred = np.clip(y_pred, 0, None)[inverse.reshape(-1)]
+
+    if opunit in info.MEM_ADJUST_OPUNITS:
+        _adjust_memory_prediction(info, opunit, x, y_pred)
+
+    return y_pred
+
+
+def _add_estimation_noise(info, opunit, x):
+    """Add estimation noise to the OUs that may use the cardinality estimation (in place)
+    """
+    if opunit not in info.OUS_USING_CAR_EST:
+        return
+    for feature in [ExecutionFeature.NUM_ROWS, ExecutionFeature.EST_CARDINALITIES]:
+        index = info.input_csv_index[feature]
+        value = x[:, index]
+        noise_mask = value > 1000
+        logging.debug("Adding noise to {} {}".format(np.count_nonzero(noise_mask), feature.name))
+        value[noise_mask] += np.random.normal(0, value[noise_mask] * 0.3)
+        value[noise_mask] = np.maximum(1, value[noise_mask])
+
+
+def _adjust_memory_prediction(info, opunit, x, y_pred):
+    """Adjust the memory prediction (in place) based on the buffer that the opunit allocates
+    """
+    # Compute the number of "slots" (based on row feature or cardinality feature
+    num_tuple = x[:, info.input_csv_index[ExecutionFeature.NUM_ROWS]]
+    if opunit == OpUnit.AGG_BUILD:
+        num_tuple = x[:, info.input_csv_index[ExecutionFeature.EST_CARDINALITIES]]
+
+    # SORT/AGG/HASHJOIN_BUILD all allocate a "pointer" buffer
+    # that contains the first pow2 larger than num_tuple entries
+    with np.errstate(divide='ignore'):
+        pow_high = 2 ** np.ceil(np.log2(num_tuple))
+    buffer_size = pow_high * info.POINTER_SIZE
+    if opunit == OpUnit.AGG_BUILD:
+        # For AGG_BUILD, if slots <= AggregationHashTable::K_DEFAULT_INITIAL_TABLE_SIZE
+        # the buffer is not recorded as part of the pipeline
+        buffer_size[num_tuple <= 256] = 0
+
+    memory_b_index = info.target_csv_index[Target.MEMORY_B]
+    pred_mem = y_pred[:, memory_b_index]
+    logging.debug("{} {} predictions within the buffer size".format(np.count_nonzero(pred_mem <= buffer_size),
+                                                                    opunit.name))
+
+    # For hashjoin_build, there is still some inaccuracy due to the
+    # fact that we do not know about the hash table's load factor.
+    scale = x[:, info.input_csv_index[ExecutionFeature.MEM_FACTOR]]
+    y_pred[:, memory_b_index] = (pred_mem - buffer_size) * scale + buffer_size
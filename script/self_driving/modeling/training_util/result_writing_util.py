@@ -1,4 +1,4 @@
-from ..util import io_util
+from ..util import io_util, profiling_util
 from ..info import data_info
 
 
@@ -22,11 +22,12 @@ def record_predictions(pred_results, prediction_path):
     :param prediction_path: the file path to score
     :return:
     """
-    num_data = pred_results[0].shape[0]
-    for i in range(num_data):
-        result_list = (list(pred_results[0][i]) + [""] + list(pred_results[1][i]) + [""]
-                       + list(pred_results[2][i]))
-        io_util.write_csv_result(prediction_path, "", result_list)
+    with profiling_util.stage("result_writing"):
+        num_data = pred_results[0].shape[0]
+        for i in range(num_data):
+            result_list = (list(pred_results[0][i]) + [""] + list(pred_results[1][i]) + [""]
+                           + list(pred_results[2][i]))
+            io_util.write_csv_result(prediction_path, "", result_list)
 
 
 def _get_result_labels(test_only):
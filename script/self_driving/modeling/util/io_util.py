@@ -1,4 +1,7 @@
 import csv
+import os
+
+from . import profiling_util
 
 
 def write_csv_result(path, label, data):
@@ -9,18 +12,42 @@ def write_csv_result(path, label, data):
     :param data: the rest columns
     :return:
     """
-    with open(path, "a") as csvfile:
+    with profiling_util.stage("result_writing"), open(path, "a") as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow([label] + list(data))
 
 
+def write_csv_results(path, labels, data):
+    """Write multiple rows of result data in csv format
+
+    :param path: write destination
+    :param labels: the label (first column) of each row to write
+    :param data: the rest columns of each row
+    :return:
+    """
+    with profiling_util.stage("result_writing"), open(path, "a") as csvfile:
+        writer = csv.writer(csvfile)
+        for label, row in zip(labels, data):
+            writer.writerow([label] + list(row))
+
+
 def create_csv_file(path, header):
     """Create a new csv file with header (replace any existing one)
 
     :param path: write destination
     :param header: the list for the headers in the file
     """
+    with profiling_util.stage("result_writing"):
+        open(path, 'w').close()
+        if header is not None:
+            write_csv_result(path, header[0], header[1:])
+
 
-    open(path, 'w').close()
-    if header is not None:
-        write_csv_result(path, header[0], header[1:])
+def get_file_fingerprint(path):
+    """Get the fingerprint of a file that changes when the file is modified (without reading the content)
+
+    :param path: the file path
+    :return: (file name, size in bytes, modification time in ns)
+    """
+    stat = os.stat(path)
+    return os.path.basename(path), stat.st_size, stat.st_mtime_ns
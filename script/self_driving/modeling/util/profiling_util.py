@@ -0,0 +1,195 @@
+import contextlib
+import cProfile
+import csv
+import json
+import os
+import resource
+import sys
+import time
+
+# The header of the CSV report (the times are in seconds and the memory is in MB)
+_REPORT_HEADER = ["Stage", "OpUnit", "Method", "Calls", "Wall Seconds", "Self Wall Seconds", "CPU Seconds",
+                  "Self CPU Seconds", "Peak RSS MB", "Peak RSS Increase MB"]
+
+# ru_maxrss is in KB on Linux and in bytes on macOS
+_MAXRSS_MB = 1 / 1024 / 1024 if sys.platform == 'darwin' else 1 / 1024
+
+_NO_PROFILING = contextlib.nullcontext()
+
+
+class Profiler:
+    """
+    Record the wall time, the CPU time and the peak RSS of the stages of the modeling pipelines (e.g., file loading,
+    OU prediction, fitting, result writing), per opunit and per method
+
+    The stages are nested in the code (e.g., the fitting inside the hyperparameter search), so each stage records both
+    its total time and its self time (excluding the stages inside it). The self times of all the stages add up to the
+    profiled time. A stage inside a stage of the same name is counted as part of the outer one.
+
+    The CPU time includes the child processes (e.g., the file loading workers) that finish within the stage. The peak
+    RSS is the high-water mark of the process at the end of the stage, and the increase is how much the stage raised
+    it (the stages that allocate the most). The work done inside the worker processes is not broken down into stages.
+    """
+
+    def __init__(self, cprofile_path=None):
+        """
+        :param cprofile_path: the directory to dump the cProfile statistics of each stage to (None to not run cProfile)
+        """
+        self.cprofile_path = cprofile_path
+        # Map from (stage, opunit, method) to [calls, wall, self wall, cpu, self cpu, peak rss, peak rss increase]
+        self.records = {}
+        # The (opunit, method) labels of the enclosing stages
+        self._labels = [(None, None)]
+        # The open stages as [name, child wall, child cpu]
+        self._stages = []
+        # Map from the stage name to its cProfile.Profile, and the stack of the running ones
+        self._cprofiles = {}
+        self._running_cprofiles = []
+
+    @contextlib.contextmanager
+    def label(self, opunit=None, method=None):
+        """Attribute the stages inside to an opunit and/or a method (the labels not given are inherited)
+
+        :param opunit: the opunit (or the model) name
+        :param method: the ML method
+        """
+        outer_opunit, outer_method = self._labels[-1]
+        self._labels.append((outer_opunit if opunit is None else opunit,
+                             outer_method if method is None else method))
+        try:
+            yield
+        finally:
+            self._labels.pop()
+
+    def stage(self, name, opunit=None, method=None):
+        """Record a stage
+
+        :param name: the stage name
+        :param opunit: the opunit (or the model) name (inherited from the enclosing labels if None)
+        :param method: the ML method (inherited from the enclosing labels if None)
+        :return: the context manager that records the code inside it as the stage
+        """
+        if len(self._stages) > 0 and self._stages[-1][0] == name:
+            return _NO_PROFILING
+        return self._record_stage(name, opunit, method)
+
+    @contextlib.contextmanager
+    def _record_stage(self, name, opunit, method):
+        # The labels of the stage also apply to the stages inside it
+        with self.label(opunit, method):
+            key = (name,) + self._labels[-1]
+            stage = [name, 0, 0]
+            self._stages.append(stage)
+            self._start_cprofile(name)
+            start_rss = _get_peak_rss()
+            start_wall = time.perf_counter()
+            start_cpu = _get_cpu_time()
+            try:
+                yield
+            finally:
+                self._finish_stage(key, stage, start_wall, start_cpu, start_rss)
+
+    def _finish_stage(self, key, stage, start_wall, start_cpu, start_rss):
+        wall = time.perf_counter() - start_wall
+        cpu = _get_cpu_time() - start_cpu
+        peak_rss = _get_peak_rss()
+        self._stop_cprofile()
+        self._stages.pop()
+        if len(self._stages) > 0:
+            self._stages[-1][1] += wall
+            self._stages[-1][2] += cpu
+
+        record = self.records.setdefault(key, [0, 0, 0, 0, 0, 0, 0])
+        record[0] += 1
+        record[1] += wall
+        record[2] += wall - stage[1]
+        record[3] += cpu
+        record[4] += cpu - stage[2]
+        record[5] = max(record[5], peak_rss)
+        record[6] += peak_rss - start_rss
+
+    def _start_cprofile(self, name):
+        if self.cprofile_path is None:
+            return
+        # Only one profiler can run at a time, so the one of the enclosing stage is paused
+        if len(self._running_cprofiles) > 0:
+            self._running_cprofiles[-1].disable()
+        profile = self._cprofiles.setdefault(name, cProfile.Profile())
+        self._running_cprofiles.append(profile)
+        profile.enable()
+
+    def _stop_cprofile(self):
+        if self.cprofile_path is None:
+            return
+        self._running_cprofiles.pop().disable()
+        if len(self._running_cprofiles) > 0:
+            self._running_cprofiles[-1].enable()
+
+    def get_report(self):
+        """Get the records of the stages (sorted by the self wall time)
+
+        :return: the list of the report rows, each a dict with the _REPORT_HEADER columns as the keys
+        """
+        rows = []
+        for (name, opunit, method), record in self.records.items():
+            calls, wall, self_wall, cpu, self_cpu, peak_rss, rss_increase = record
+            rows.append(dict(zip(_REPORT_HEADER, [name, opunit, method, calls, wall, self_wall, cpu, self_cpu,
+                                                  peak_rss * _MAXRSS_MB, rss_increase * _MAXRSS_MB])))
+        return sorted(rows, key=lambda row: row["Self Wall Seconds"], reverse=True)
+
+    def write_report(self, path):
+        """Write the report (see get_report), and dump the cProfile statistics of each stage to
+        <cprofile_path>/<stage>.prof if cProfile is enabled
+
+        :param path: the report file (JSON if it ends with .json, otherwise CSV)
+        """
+        rows = self.get_report()
+        if path.endswith('.json'):
+            with open(path, 'w') as file:
+                json.dump(rows, file, indent=2)
+        else:
+            # Not written with io_util since its writes are recorded as stages
+            with open(path, 'w') as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow(_REPORT_HEADER)
+                writer.writerows([row[column] for column in _REPORT_HEADER] for row in rows)
+
+        if self.cprofile_path is not None:
+            os.makedirs(self.cprofile_path, exist_ok=True)
+            for name, profile in self._cprofiles.items():
+                profile.dump_stats(os.path.join(self.cprofile_path, "{}.prof".format(name)))
+
+
+def _get_cpu_time():
+    # The CPU time of this process and its terminated child processes
+    times = os.times()
+    return time.process_time() + times.children_user + times.children_system
+
+
+def _get_peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def stage(name, opunit=None, method=None):
+    """Record a stage with the active profiler (see Profiler.stage)
+
+    :return: the context manager of the stage (which does nothing if there is no active profiler)
+    """
+    if instance is None:
+        return _NO_PROFILING
+    return instance.stage(name, opunit, method)
+
+
+def label(opunit=None, method=None):
+    """Attribute the stages inside to an opunit and/or a method with the active profiler (see Profiler.label)
+
+    :return: the context manager of the labels (which does nothing if there is no active profiler)
+    """
+    if instance is None:
+        return _NO_PROFILING
+    return instance.label(opunit, method)
+
+
+# The active profiler of the modeling pipelines (None to not profile). The pipelines enable it with their --profile_path
+# argument
+instance = None
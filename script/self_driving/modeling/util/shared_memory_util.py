@@ -0,0 +1,77 @@
+import mmap
+import os
+
+import numpy as np
+
+# The POSIX shared memory segments (shm_open) are the files of this directory on Linux
+SHARED_MEMORY_DIR = '/dev/shm'
+
+# The element types of the arrays in the shared memory
+_DTYPES = {'float64': np.float64, 'float32': np.float32}
+
+# The mapped segments by name: (the inode of the segment file, the mmap of the whole segment)
+_segments = {}
+
+
+def _get_segment(name):
+    """Get the mapping of a shared memory segment
+
+    The mapping is cached and reused while the segment is not recreated (e.g., by a restarted ModelServerManager).
+
+    :param name: the name of the segment (as passed to shm_open, with or without the leading "/")
+    :return: the mmap of the whole segment
+    """
+    name = name.lstrip('/')
+    if len(name) == 0 or '/' in name:
+        raise ValueError("Invalid shared memory segment name {}".format(name))
+    path = os.path.join(SHARED_MEMORY_DIR, name)
+    inode = os.stat(path).st_ino
+
+    segment = _segments.get(name)
+    if segment is not None and segment[0] == inode:
+        return segment[1]
+
+    # The old mapping is only dropped (not closed) since the arrays returned earlier may still be in use
+    fd = os.open(path, os.O_RDWR)
+    try:
+        memory = mmap.mmap(fd, 0)
+    finally:
+        os.close(fd)
+    _segments[name] = (inode, memory)
+    return memory
+
+
+def get_array(descriptor):
+    """Get the array that a descriptor points to in shared memory (without copying it)
+
+    :param descriptor: {segment: the segment name, offset: the byte offset in the segment, shape: the array shape,
+                        dtype: "float64" or "float32"}
+    :return: the C-ordered array backed by the shared memory
+    """
+    memory = _get_segment(descriptor["segment"])
+    dtype = np.dtype(_DTYPES[descriptor.get("dtype", "float64")])
+    shape = tuple(int(size) for size in descriptor["shape"])
+    offset = int(descriptor["offset"])
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    if offset < 0 or offset % dtype.itemsize != 0 or offset + nbytes > len(memory):
+        raise ValueError("Array of {} bytes at offset {} is out of the shared memory segment {} of {} bytes".format(
+            nbytes, offset, descriptor["segment"], len(memory)))
+    return np.ndarray(shape, dtype=dtype, buffer=memory, offset=offset)
+
+
+def write_array(slot, array):
+    """Write an array into a slot of shared memory
+
+    :param slot: {segment: the segment name, offset: the byte offset of the slot, capacity: the byte size of the slot}
+    :param array: the array to write (converted to float64)
+    :return: the descriptor of the written array {shape, dtype} (the segment and offset are the slot's), or None if
+             the array does not fit into the slot
+    """
+    array = np.asarray(array)
+    capacity = int(slot["capacity"])
+    if array.size * np.dtype(np.float64).itemsize > capacity:
+        return None
+    target = get_array({"segment": slot["segment"], "offset": slot["offset"], "shape": array.shape,
+                        "dtype": "float64"})
+    target[...] = array
+    return {"shape": list(array.shape), "dtype": "float64"}
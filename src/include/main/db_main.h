@@ -441,7 +441,9 @@ class DBMain {
       if (model_server_enable_) {
         NOISEPAGE_ASSERT(use_messenger_, "Pilot requires messenger layer.");
         model_server_manager =
-            std::make_unique<modelserver::ModelServerManager>(model_server_path_, messenger_layer->GetMessenger());
+            std::make_unique<modelserver::ModelServerManager>(model_server_path_, messenger_layer->GetMessenger(),
+                                                              model_server_shared_memory_size_ << 20,
+                                                              model_server_worker_num_);
       }
 
       std::unique_ptr<selfdriving::PilotThread> pilot_thread = DISABLED;
@@ -777,6 +779,24 @@ class DBMain {
       return *this;
     }
 
+    /**
+     * @param value size (in MB) of the shared memory ring to pass the inference features to the ModelServer through
+     * @return self reference for chaining
+     */
+    Builder &SetModelServerSharedMemorySize(const uint64_t value) {
+      model_server_shared_memory_size_ = value;
+      return *this;
+    }
+
+    /**
+     * @param value number of ModelServer worker processes
+     * @return self reference for chaining
+     */
+    Builder &SetModelServerWorkerNum(const uint32_t value) {
+      model_server_worker_num_ = value;
+      return *this;
+    }
+
     /**
      * @param value the new path to the bytecode handler bitcode file
      * @return self reference for chaining
@@ -849,6 +869,8 @@ class DBMain {
      * in use cases where such assumptions are no longer true.
      */
     std::string model_server_path_ = "../../script/model/model_server.py";
+    uint64_t model_server_shared_memory_size_ = 0;
+    uint32_t model_server_worker_num_ = 1;
 
     /**
      * Instantiates the SettingsManager and reads all of the settings to override the Builder's settings.
@@ -916,6 +938,10 @@ class DBMain {
       use_messenger_ = settings_manager->GetBool(settings::Param::messenger_enable);
       model_server_enable_ = settings_manager->GetBool(settings::Param::model_server_enable);
       model_server_path_ = settings_manager->GetString(settings::Param::model_server_path);
+      model_server_shared_memory_size_ =
+          static_cast<uint64_t>(settings_manager->GetInt(settings::Param::model_server_shared_memory_size));
+      model_server_worker_num_ =
+          static_cast<uint32_t>(settings_manager->GetInt(settings::Param::model_server_worker_num));
 
       return settings_manager;
     }
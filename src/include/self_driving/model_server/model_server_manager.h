@@ -3,17 +3,27 @@
  *  Currently, the operations supported are:
  *  - Training an Opunit model map from a sequence file directory.
  *  - Inferencing on one trained Opunit model with features.
+ *  - Inferencing on whole pipelines with a trained Opunit model map (aggregated per pipeline on the ModelServer).
  *  - Sending string message to the ModelServer
+ *  - Cancelling and querying the training jobs of the ModelServer
  *  - Quiting the ModelServer
  *
  *  The ModelServerManager will restart the ModelServer once the ModelServer goes down. Models trained will persist
  *  across a ModelServer's restart. So ModelServer failure handling will be transparent to users.
+ *
+ *  With more than one worker, the ModelServer runs as a broker that forwards the commands to several ModelServer
+ *  processes (routing the commands on a model to the same process), which is transparent to users as well.
+ *
+ *  Since the ModelServer runs on the same host, the feature matrices of the inference requests can be passed through
+ *  a POSIX shared memory ring (see SharedMemoryRing) instead of JSON when the ModelServerManager is constructed with a
+ *  shared memory size. The predictions are written back into the same slot of the ring.
  */
 
 #pragma once
 
 #include <atomic>
 #include <condition_variable>  // NOLINT
+#include <memory>
 #include <string>
 #include <thread>  // NOLINT
 #include <utility>
@@ -23,6 +33,7 @@
 #include "common/managed_pointer.h"
 #include "messenger/messenger_defs.h"
 #include "self_driving/forecasting/workload_forecast.h"
+#include "self_driving/model_server/shared_memory_ring.h"
 
 namespace noisepage::messenger {
 class ConnectionRouter;
@@ -199,8 +210,13 @@ class ModelServerManager {
    * Construct a ModelServerManager with the given executable script to the Python ModelServer
    * @param model_bin Python script path
    * @param messenger Messenger pointer
+   * @param shared_memory_size Size (in bytes) of the shared memory ring to pass the features of the inference
+   *    requests through (0 to pass them as JSON)
+   * @param worker_num Number of ModelServer worker processes (more than 1 runs the ModelServer as a broker that
+   *    spreads the commands over the workers)
    */
-  ModelServerManager(const std::string &model_bin, const common::ManagedPointer<messenger::Messenger> &messenger);
+  ModelServerManager(const std::string &model_bin, const common::ManagedPointer<messenger::Messenger> &messenger,
+                     uint64_t shared_memory_size = 0, uint32_t worker_num = 1);
 
   /**
    * Stop the Python ModelServer when exits
@@ -255,7 +271,9 @@ class ModelServerManager {
    * @param methods list of candidates methods that will be used for training
    * @param input_path Path to input files for training model (seq file directory for MiniRunnerModel)
    * @param save_path path to where the trained model will be stored at
-   * @param arguments Extra arguments to pass
+   * @param arguments Extra arguments to pass. The job arguments of the ModelServer are "job_id" (defaults to the
+   *    save_path), "priority" (a lower value starts first, defaults to 0) and "resume" (whether an OU model map
+   *    continues from the checkpoint of a cancelled or interrupted training, defaults to true)
    * @param future A future object which the caller waits for training to be done
    * @return True if sending train request suceeds
    */
@@ -335,6 +353,24 @@ class ModelServerManager {
                                                                  const std::string &model_path,
                                                                  const std::vector<std::vector<double>> &features);
 
+  /**
+   * Perform inference on whole pipelines using an OU model map
+   *
+   * The ModelServer predicts all the OUs of the same opunit (across the pipelines) in one batch, and only sends back
+   * the sum of the OU predictions of each pipeline (with the same adjustments as the offline interference model
+   * training, e.g., the memory buffer correction of the build OUs).
+   *
+   * This function is a blocking API call to the ModelServer, and only returns when result is sent back.
+   *
+   * @param model_path Path to a model map that has been trained. (In pickle format)
+   * @param pipelines For each pipeline, the (opunit name, feature vector) of each of its OUs
+   * @return a vector of the aggregated prediction of each pipeline returned by ModelServer and if API succeeds (True
+   *    when succeeds). When API fails, the return results will be an empty vector
+   */
+  std::pair<std::vector<std::vector<double>>, bool> InferPipelineOUModel(
+      const std::string &model_path,
+      const std::vector<std::vector<std::pair<std::string, std::vector<double>>>> &pipelines);
+
   /**
    * Perform inference on the given data file using the interference model
    *
@@ -348,6 +384,31 @@ class ModelServerManager {
   std::pair<std::vector<std::vector<double>>, bool> InferInterferenceModel(
       const std::string &model_path, const std::vector<std::vector<double>> &features);
 
+  /**
+   * Cancel a training job
+   *
+   * A queued job is dropped, and a running job stops at its next progress report (e.g., after the current opunit of
+   * an OU model map, which is checkpointed so that a later TrainModel with the same save_path resumes from it). The
+   * future of the cancelled TrainModel fails with "JOB_CANCELLED".
+   *
+   * This function is a blocking API call to the ModelServer, and only returns when result is sent back.
+   *
+   * @param job_id Id of the job (the "job_id" argument of TrainModel, which defaults to the save_path)
+   * @return the state of the job after the cancellation (e.g., "CANCELLED", or "RUNNING" until it stops) and if API
+   *    succeeds (False if the job is not found)
+   */
+  std::pair<std::string, bool> CancelJob(const std::string &job_id);
+
+  /**
+   * Get the status of the training jobs
+   *
+   * This function is a blocking API call to the ModelServer, and only returns when result is sent back.
+   *
+   * @param job_id Id of the job, or empty for all the jobs that the ModelServer knows of
+   * @return a json object that maps each job id to its status (state, model type, priority and progress) and if API succeeds (False if the job is not found)
+   */
+  std::pair<nlohmann::json, bool> GetJobStatus(const std::string &job_id = "");
+
  private:
   /**
    * Perform inference
@@ -357,10 +418,42 @@ class ModelServerManager {
    * @param model type of model to invoke (i.e., forecast or mini-runner)
    * @param model_path Path to a model that has been trained. (In pickle format)
    * @param payload Payload to pass as the "data" field to the ModelServer
+   * @param cmd Inference command of the ModelServer
    * @return pair comprising the result and a bool flag for success/failure
    */
   template <class Result>
-  std::pair<Result, bool> InferModel(ModelType::Type model, const std::string &model_path, nlohmann::json *payload);
+  std::pair<Result, bool> InferModel(ModelType::Type model, const std::string &model_path, nlohmann::json *payload,
+                                     const std::string &cmd = "INFER");
+
+  /**
+   * Send a command and wait for its result
+   *
+   * This function is a blocking API call to the ModelServer, and only returns when result is sent back.
+   *
+   * @param cmd Command of the ModelServer
+   * @param data Payload to pass as the "data" field to the ModelServer
+   * @return pair comprising the result and a bool flag for success/failure
+   */
+  template <class Result>
+  std::pair<Result, bool> SendSyncCommand(const std::string &cmd, const nlohmann::json &data);
+
+  /**
+   * Perform inference on a feature matrix
+   *
+   * The features are written into a slot of the shared memory ring if there is one (and they fit into a slot), and
+   * sent as JSON otherwise.
+   *
+   * This function is a blocking API call to the ModelServer, and only returns when result is sent back.
+   *
+   * @param model type of model to invoke (i.e., operating unit or interference)
+   * @param model_path Path to a model that has been trained. (In pickle format)
+   * @param features Feature vectors
+   * @param payload Payload with the other fields of the "data" field to the ModelServer
+   * @return a vector of results returned by ModelServer and if API succeeds (True when succeeds)
+   */
+  std::pair<std::vector<std::vector<double>>, bool> InferFeatures(ModelType::Type model, const std::string &model_path,
+                                                                  const std::vector<std::vector<double>> &features,
+                                                                  nlohmann::json *payload);
 
   /**
    * This should be run as a thread routine.
@@ -394,6 +487,9 @@ class ModelServerManager {
   /** Connection router */
   common::ManagedPointer<messenger::ConnectionRouter> router_;
 
+  /** Number of ModelServer worker processes (initialized before the thread that starts them) */
+  uint32_t worker_num_;
+
   /** Thread the ModelServerManager runs in */
   std::thread thd_;
 
@@ -405,6 +501,9 @@ class ModelServerManager {
 
   /** If ModelServer is connected */
   std::atomic<bool> connected_ = false;
+
+  /** Shared memory ring for the features of the inference requests (nullptr if they are sent as JSON) */
+  std::unique_ptr<SharedMemoryRing> shm_ring_;
 };
 
 }  // namespace noisepage::modelserver
@@ -0,0 +1,104 @@
+#pragma once
+
+#include <condition_variable>  // NOLINT
+#include <cstddef>
+#include <mutex>  // NOLINT
+#include <string>
+#include <vector>
+
+#include "common/macros.h"
+
+namespace noisepage::modelserver {
+
+/**
+ * SharedMemoryRing is a POSIX shared memory segment (shm_open, i.e., a file under /dev/shm on Linux) divided into
+ * fixed-size slots that are handed out in a round-robin order.
+ *
+ * It is used to pass the feature matrices of the inference requests to the ModelServer on the same host without
+ * serializing them to JSON: the caller writes the features into a slot and only sends the slot's descriptor (the
+ * segment name, offset and shape), and the ModelServer maps the segment, reads the features in place and writes the
+ * predictions back into the rest of the slot. A slot is owned by one request from AcquireSlot() until ReleaseSlot().
+ */
+class SharedMemoryRing {
+ public:
+  /** Alignment (in bytes) of the arrays in a slot */
+  static constexpr const size_t ALIGNMENT = 64;
+
+  /**
+   * Create (or replace) the shared memory segment and map it
+   * If the segment cannot be created, the ring is not valid (see IsValid()) and should not be used.
+   * @param name name of the segment (starting with "/", e.g., "/noisepage-model-server-<pid>")
+   * @param slot_num number of slots
+   * @param slot_size size (in bytes) of each slot, rounded up to ALIGNMENT
+   */
+  SharedMemoryRing(std::string name, size_t slot_num, size_t slot_size);
+
+  /**
+   * Unmap and remove the shared memory segment
+   */
+  ~SharedMemoryRing();
+
+  DISALLOW_COPY_AND_MOVE(SharedMemoryRing)
+
+  /** @return true if the segment is created and mapped */
+  bool IsValid() const { return base_ != nullptr; }
+
+  /** @return name of the segment */
+  const std::string &GetName() const { return name_; }
+
+  /** @return size (in bytes) of each slot */
+  size_t GetSlotSize() const { return slot_size_; }
+
+  /**
+   * Acquire the next free slot, blocking until one is released if all of them are in use
+   * @return index of the slot
+   */
+  size_t AcquireSlot();
+
+  /**
+   * Release a slot acquired by AcquireSlot()
+   * @param slot index of the slot
+   */
+  void ReleaseSlot(size_t slot);
+
+  /**
+   * @param slot index of the slot
+   * @return byte offset of the slot in the segment
+   */
+  size_t GetSlotOffset(size_t slot) const { return slot * slot_size_; }
+
+  /**
+   * @param slot index of the slot
+   * @return address of the slot in this process
+   */
+  std::byte *GetSlotAddress(size_t slot) const { return base_ + GetSlotOffset(slot); }
+
+  /**
+   * @param size size (in bytes) of an array
+   * @return the size rounded up to ALIGNMENT, i.e., the offset of the next array in a slot
+   */
+  static size_t Align(size_t size) { return (size + ALIGNMENT - 1) / ALIGNMENT * ALIGNMENT; }
+
+ private:
+  /** Name of the segment */
+  std::string name_;
+  /** Size (in bytes) of each slot */
+  size_t slot_size_;
+  /** Size (in bytes) of the mapped segment */
+  size_t mapped_size_ = 0;
+  /** Address of the mapped segment (nullptr if the segment cannot be created) */
+  std::byte *base_ = nullptr;
+
+  /** Whether each slot is in use */
+  std::vector<bool> in_use_;
+  /** The slot to try first on the next AcquireSlot() */
+  size_t next_slot_ = 0;
+  /** Number of the slots not in use */
+  size_t free_slot_num_;
+  /** Mutex that protects the slot states */
+  std::mutex mtx_;
+  /** Condition variable to wait for a released slot */
+  std::condition_variable cvar_;
+};
+
+}  // namespace noisepage::modelserver
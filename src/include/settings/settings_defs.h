@@ -396,6 +396,26 @@ SETTING_string(
     noisepage::settings::Callbacks::NoOp
 )
 
+SETTING_int(
+    model_server_worker_num,
+    "The number of ModelServer processes (default: 1, more than 1 runs the ModelServer as a broker over the processes)",
+    1,
+    1,
+    256,
+    false,
+    noisepage::settings::Callbacks::NoOp
+)
+
+SETTING_int(
+    model_server_shared_memory_size,
+    "The size (in MB) of the shared memory ring to pass the inference features to the ModelServer through (default: 0, i.e., the features are sent as JSON)",
+    0,
+    0,
+    65536,
+    false,
+    noisepage::settings::Callbacks::NoOp
+)
+
 // Save path of the model relative to the build path (model saved at ${BUILD_ABS_PATH} + SAVE_PATH)
 SETTING_string(
     model_save_path,
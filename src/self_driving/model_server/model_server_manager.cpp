@@ -7,6 +7,8 @@
 #include <sys/prctl.h>
 #endif
 #include <sys/wait.h>
+#include <algorithm>
+#include <chrono>  // NOLINT
 #include <thread>  // NOLINT
 
 #include "common/json.h"
@@ -26,6 +28,15 @@ static constexpr const char *MODEL_IPC_PATH = "model-server-ipc";
  */
 static constexpr const unsigned char MODEL_SERVER_SUBPROCESS_ERROR = 128;
 
+/**
+ * Interval to poll for the connection router to be added by the messenger. The Python ModelServer connects within a
+ * fraction of a second since it imports its heavy dependencies lazily, so polling once a second dominated the startup.
+ */
+static constexpr const std::chrono::milliseconds CONNECTION_ROUTER_POLL_INTERVAL{10};
+
+/** Number of slots in the shared memory ring, i.e., the number of inference requests that use it concurrently */
+static constexpr const size_t SHARED_MEMORY_SLOT_NUM = 8;
+
 common::ManagedPointer<messenger::ConnectionRouter> ListenAndMakeConnection(
     const common::ManagedPointer<messenger::Messenger> &messenger, const std::string &ipc_path,
     messenger::CallbackFn model_server_logic) {
@@ -40,7 +51,7 @@ common::ManagedPointer<messenger::ConnectionRouter> ListenAndMakeConnection(
     try {
       return messenger->GetConnectionRouter(MODEL_CONN_ID_NAME);
     } catch (std::exception &e) {
-      ::sleep(1);
+      std::this_thread::sleep_for(CONNECTION_ROUTER_POLL_INTERVAL);
     }
   }
 }
@@ -50,8 +61,9 @@ common::ManagedPointer<messenger::ConnectionRouter> ListenAndMakeConnection(
 namespace noisepage::modelserver {
 
 ModelServerManager::ModelServerManager(const std::string &model_bin,
-                                       const common::ManagedPointer<messenger::Messenger> &messenger)
-    : messenger_(messenger), thd_(std::thread([this, &model_bin] {
+                                       const common::ManagedPointer<messenger::Messenger> &messenger,
+                                       uint64_t shared_memory_size, uint32_t worker_num)
+    : messenger_(messenger), worker_num_(worker_num), thd_(std::thread([this, &model_bin] {
         while (!shut_down_) {
           this->StartModelServer(model_bin);
         }
@@ -84,6 +96,15 @@ ModelServerManager::ModelServerManager(const std::string &model_bin,
     }
   };
   router_ = ListenAndMakeConnection(messenger, MODEL_IPC_PATH, msm_handler);
+
+  if (shared_memory_size > 0) {
+    shm_ring_ = std::make_unique<SharedMemoryRing>("/noisepage-model-server-" + std::to_string(::getpid()),
+                                                   SHARED_MEMORY_SLOT_NUM, shared_memory_size / SHARED_MEMORY_SLOT_NUM);
+    if (!shm_ring_->IsValid()) {
+      MODEL_SERVER_LOG_WARN("Sending the features to the ModelServer as JSON instead of through shared memory");
+      shm_ring_ = nullptr;
+    }
+  }
 }
 
 void ModelServerManager::StartModelServer(const std::string &model_path) {
@@ -148,7 +169,9 @@ void ModelServerManager::StartModelServer(const std::string &model_path) {
     std::string ipc_path = MODEL_IPC_PATH;
     char exec_name[model_path.size() + 1];
     ::strncpy(exec_name, model_path.data(), sizeof(exec_name));
-    char *args[] = {exec_name, ipc_path.data(), nullptr};
+    std::string workers_flag = "--workers";
+    std::string worker_num = std::to_string(worker_num_);
+    char *args[] = {exec_name, ipc_path.data(), workers_flag.data(), worker_num.data(), nullptr};
     MODEL_SERVER_LOG_TRACE("Inovking ModelServer at :{}", std::string(exec_name));
     if (execvp(args[0], args) < 0) {
       MODEL_SERVER_LOG_ERROR("Failed to execute model binary: {}, {}", strerror(errno), errno);
@@ -237,16 +260,23 @@ bool ModelServerManager::TrainInterferenceModel(const std::vector<std::string> &
 
 template <class Result>
 std::pair<Result, bool> ModelServerManager::InferModel(ModelType::Type model, const std::string &model_path,
-                                                       nlohmann::json *payload) {
-  nlohmann::json j;
-  j["cmd"] = "INFER";
+                                                       nlohmann::json *payload, const std::string &cmd) {
+  nlohmann::json data;
   if (payload) {
-    j["data"] = *payload;
+    data = *payload;
   } else {
-    j["data"] = {};
+    data = {};
   }
-  j["data"]["type"] = ModelType::TypeToString(model);
-  j["data"]["model_path"] = model_path;
+  data["type"] = ModelType::TypeToString(model);
+  data["model_path"] = model_path;
+  return SendSyncCommand<Result>(cmd, data);
+}
+
+template <class Result>
+std::pair<Result, bool> ModelServerManager::SendSyncCommand(const std::string &cmd, const nlohmann::json &data) {
+  nlohmann::json j;
+  j["cmd"] = cmd;
+  j["data"] = data;
 
   // Sync communication
   ModelServerFuture<Result> future;
@@ -266,12 +296,92 @@ std::pair<Result, bool> ModelServerManager::InferModel(ModelType::Type model, co
   return future.Wait();
 }
 
+std::pair<std::string, bool> ModelServerManager::CancelJob(const std::string &job_id) {
+  nlohmann::json j;
+  j["job_id"] = job_id;
+  return SendSyncCommand<std::string>("CANCEL", j);
+}
+
+std::pair<nlohmann::json, bool> ModelServerManager::GetJobStatus(const std::string &job_id) {
+  nlohmann::json j;
+  if (!job_id.empty()) {
+    j["job_id"] = job_id;
+  }
+  return SendSyncCommand<nlohmann::json>("STATUS", j);
+}
+
+std::pair<std::vector<std::vector<double>>, bool> ModelServerManager::InferFeatures(
+    ModelType::Type model, const std::string &model_path, const std::vector<std::vector<double>> &features,
+    nlohmann::json *payload) {
+  size_t row_num = features.size();
+  size_t col_num = row_num > 0 ? features[0].size() : 0;
+  bool rectangular = std::all_of(features.begin(), features.end(),
+                                 [col_num](const std::vector<double> &row) { return row.size() == col_num; });
+
+  // The predictions are written after the features in the same slot (at least one value per row has to fit)
+  size_t result_offset = SharedMemoryRing::Align(row_num * col_num * sizeof(double));
+  if (shm_ring_ == nullptr || row_num == 0 || !rectangular ||
+      result_offset + row_num * sizeof(double) > shm_ring_->GetSlotSize()) {
+    (*payload)["features"] = features;
+    return InferModel<std::vector<std::vector<double>>>(model, model_path, payload);
+  }
+
+  size_t slot = shm_ring_->AcquireSlot();
+  auto *data = reinterpret_cast<double *>(shm_ring_->GetSlotAddress(slot));
+  for (const auto &row : features) {
+    std::copy(row.begin(), row.end(), data);
+    data += col_num;
+  }
+  size_t slot_offset = shm_ring_->GetSlotOffset(slot);
+  (*payload)["features_shm"] = {{"segment", shm_ring_->GetName()},
+                                {"offset", slot_offset},
+                                {"shape", {row_num, col_num}},
+                                {"dtype", "float64"}};
+  (*payload)["result_shm"] = {{"segment", shm_ring_->GetName()},
+                              {"offset", slot_offset + result_offset},
+                              {"capacity", shm_ring_->GetSlotSize() - result_offset}};
+  auto reply = InferModel<nlohmann::json>(model, model_path, payload);
+
+  std::pair<std::vector<std::vector<double>>, bool> result{{}, reply.second};
+  if (reply.second) {
+    try {
+      if (reply.first.is_array()) {
+        // The predictions did not fit into the slot, so they are sent back as JSON
+        result.first = reply.first.get<std::vector<std::vector<double>>>();
+      } else {
+        auto shape = reply.first.at("shape").get<std::vector<size_t>>();
+        size_t result_col_num = shape.size() > 1 ? shape[1] : 1;
+        const auto *predictions =
+            reinterpret_cast<const double *>(shm_ring_->GetSlotAddress(slot) + result_offset);
+        result.first.reserve(shape.at(0));
+        for (size_t i = 0; i < shape[0]; i++) {
+          result.first.emplace_back(predictions, predictions + result_col_num);
+          predictions += result_col_num;
+        }
+      }
+    } catch (std::exception &e) {
+      MODEL_SERVER_LOG_WARN("Wrong inference result format: {}, {}", reply.first.dump(), e.what());
+      result = {{}, false};
+    }
+  }
+  shm_ring_->ReleaseSlot(slot);
+  return result;
+}
+
 std::pair<std::vector<std::vector<double>>, bool> ModelServerManager::InferOUModel(
     const std::string &opunit, const std::string &model_path, const std::vector<std::vector<double>> &features) {
   nlohmann::json j;
   j["opunit"] = opunit;
-  j["features"] = features;
-  return InferModel<std::vector<std::vector<double>>>(ModelType::Type::OperatingUnit, model_path, &j);
+  return InferFeatures(ModelType::Type::OperatingUnit, model_path, features, &j);
+}
+
+std::pair<std::vector<std::vector<double>>, bool> ModelServerManager::InferPipelineOUModel(
+    const std::string &model_path,
+    const std::vector<std::vector<std::pair<std::string, std::vector<double>>>> &pipelines) {
+  nlohmann::json j;
+  j["pipelines"] = pipelines;
+  return InferModel<std::vector<std::vector<double>>>(ModelType::Type::OperatingUnit, model_path, &j,
+                                                      "PIPELINE_INFER");
 }
 
 std::pair<selfdriving::WorkloadForecastPrediction, bool> ModelServerManager::InferForecastModel(
@@ -301,8 +411,7 @@ std::pair<selfdriving::WorkloadForecastPrediction, bool> ModelServerManager::Inf
 std::pair<std::vector<std::vector<double>>, bool> ModelServerManager::InferInterferenceModel(
     const std::string &model_path, const std::vector<std::vector<double>> &features) {
   nlohmann::json j;
-  j["features"] = features;
-  return InferModel<std::vector<std::vector<double>>>(ModelType::Type::Interference, model_path, &j);
+  return InferFeatures(ModelType::Type::Interference, model_path, features, &j);
 }
 
 }  // namespace noisepage::modelserver
@@ -0,0 +1,79 @@
+#include "self_driving/model_server/shared_memory_ring.h"
+
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <unistd.h>
+
+#include <cerrno>
+#include <cstring>
+#include <utility>
+
+#include "loggers/model_server_logger.h"
+
+namespace noisepage::modelserver {
+
+SharedMemoryRing::SharedMemoryRing(std::string name, size_t slot_num, size_t slot_size)
+    : name_(std::move(name)), slot_size_(Align(slot_size)), in_use_(slot_num, false), free_slot_num_(slot_num) {
+  NOISEPAGE_ASSERT(slot_num > 0 && slot_size > 0, "SharedMemoryRing needs at least one non-empty slot");
+
+  // Replace the segment left over by a previous process with the same name
+  ::shm_unlink(name_.c_str());
+  int fd = ::shm_open(name_.c_str(), O_CREAT | O_EXCL | O_RDWR, 0600);
+  if (fd < 0) {
+    MODEL_SERVER_LOG_WARN("Failed to create the shared memory segment {}: {}", name_, strerror(errno));
+    return;
+  }
+
+  size_t size = slot_num * slot_size_;
+  if (::ftruncate(fd, static_cast<off_t>(size)) != 0) {
+    MODEL_SERVER_LOG_WARN("Failed to allocate {} bytes of the shared memory segment {}: {}", size, name_,
+                          strerror(errno));
+    ::close(fd);
+    ::shm_unlink(name_.c_str());
+    return;
+  }
+
+  void *base = ::mmap(nullptr, size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+  ::close(fd);
+  if (base == MAP_FAILED) {
+    MODEL_SERVER_LOG_WARN("Failed to map the shared memory segment {}: {}", name_, strerror(errno));
+    ::shm_unlink(name_.c_str());
+    return;
+  }
+  base_ = static_cast<std::byte *>(base);
+  mapped_size_ = size;
+  MODEL_SERVER_LOG_INFO("Created the shared memory segment {} with {} slots of {} bytes", name_, slot_num,
+                        slot_size_);
+}
+
+SharedMemoryRing::~SharedMemoryRing() {
+  if (base_ != nullptr) {
+    ::munmap(base_, mapped_size_);
+    ::shm_unlink(name_.c_str());
+  }
+}
+
+size_t SharedMemoryRing::AcquireSlot() {
+  std::unique_lock<std::mutex> lock(mtx_);
+  cvar_.wait(lock, [&] { return free_slot_num_ > 0; });
+  while (in_use_[next_slot_]) {
+    next_slot_ = (next_slot_ + 1) % in_use_.size();
+  }
+  size_t slot = next_slot_;
+  in_use_[slot] = true;
+  free_slot_num_--;
+  next_slot_ = (next_slot_ + 1) % in_use_.size();
+  return slot;
+}
+
+void SharedMemoryRing::ReleaseSlot(size_t slot) {
+  {
+    std::lock_guard<std::mutex> lock(mtx_);
+    NOISEPAGE_ASSERT(in_use_[slot], "Releasing a slot that is not acquired");
+    in_use_[slot] = false;
+    free_slot_num_++;
+  }
+  cvar_.notify_one();
+}
+
+}  // namespace noisepage::modelserver
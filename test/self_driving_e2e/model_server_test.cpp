@@ -24,8 +24,12 @@ class ModelServerTest : public TerrierTest {
  protected:
   static constexpr const char *BUILD_ABS_PATH = "BUILD_ABS_PATH";
 
-  /** @return Unique pointer to built DBMain that has the relevant parameters configured. */
-  static std::unique_ptr<DBMain> BuildDBMain() {
+  /**
+   * @param shared_memory_size size (in MB) of the shared memory ring to pass the inference features through
+   * @param worker_num number of ModelServer worker processes
+   * @return Unique pointer to built DBMain that has the relevant parameters configured.
+   */
+  static std::unique_ptr<DBMain> BuildDBMain(uint64_t shared_memory_size = 0, uint32_t worker_num = 1) {
     const char *env = ::getenv(BUILD_ABS_PATH);
     std::string project_build_path = (env != nullptr ? env : ".");
     auto model_server_path = project_build_path + "/../script/self_driving/model_server.py";
@@ -41,6 +45,8 @@ class ModelServerTest : public TerrierTest {
                        .SetUseStatsStorage(true)
                        .SetUseTrafficCop(true)
                        .SetModelServerPath(model_server_path)
+                       .SetModelServerSharedMemorySize(shared_memory_size)
+                       .SetModelServerWorkerNum(worker_num)
                        .Build();
 
     return db_main;
@@ -121,6 +127,22 @@ TEST_F(ModelServerTest, OUAndInterferenceModelTest) {
   result = ms_manager->InferOUModel("OP_SUPER_MAGICAL_DIVIDE", ou_model_save_path, features);
   ASSERT_FALSE(result.second);
 
+  // Perform inference on whole pipelines, which returns one aggregated prediction per pipeline
+  std::vector<std::vector<std::pair<std::string, std::vector<double>>>> pipelines;
+  for (const auto &feature : features) {
+    pipelines.push_back(
+        {{OpUnitToString(selfdriving::ExecutionOperatingUnitType::OP_INTEGER_PLUS_OR_MINUS), feature},
+         {OpUnitToString(selfdriving::ExecutionOperatingUnitType::OP_REAL_COMPARE), feature}});
+  }
+  result = ms_manager->InferPipelineOUModel(ou_model_save_path, pipelines);
+  ASSERT_TRUE(result.second);
+  ASSERT_EQ(result.first.size(), pipelines.size());
+
+  // Pipeline inference with invalid opunit name will fail
+  pipelines.push_back({{"OP_SUPER_MAGICAL_DIVIDE", features[0]}});
+  result = ms_manager->InferPipelineOUModel(ou_model_save_path, pipelines);
+  ASSERT_FALSE(result.second);
+
   // -------------------------------------------------------
   // Start the interference model test
   // (the interference model test cannot be a separate test because it needs the OU models during training)
@@ -166,6 +188,115 @@ TEST_F(ModelServerTest, OUAndInterferenceModelTest) {
   ms_manager->StopModelServer();
 }
 
+// NOLINTNEXTLINE
+TEST_F(ModelServerTest, SharedMemoryInferenceTest) {
+  messenger::messenger_logger->set_level(spdlog::level::info);
+  model_server_logger->set_level(spdlog::level::info);
+
+  // 1MB ring, i.e., slots of 128KB
+  auto primary = BuildDBMain(1);
+  primary->GetNetworkLayer()->GetServer()->RunServer();
+
+  auto ms_manager = primary->GetModelServerManager();
+
+  // Wait for the model server process to start
+  while (!ms_manager->ModelServerStarted()) {
+  }
+
+  std::vector<std::string> methods{"lr"};
+  std::string ou_model_save_path = "ou_model_map_shm.pickle";
+
+  ModelServerFuture<std::string> future;
+  const char *env = ::getenv(BUILD_ABS_PATH);
+  std::string project_build_path = (env != nullptr ? env : ".");
+  ms_manager->TrainModel(ModelType::Type::OperatingUnit, methods, project_build_path + "/bin", ou_model_save_path,
+                         nullptr, common::ManagedPointer<ModelServerFuture<std::string>>(&future));
+  auto res = future.Wait();
+  ASSERT_EQ(res.second, true);  // Training succeeds
+
+  // The features fit into a slot, so they are passed through shared memory
+  std::vector<std::vector<double>> features(4, std::vector<double>{0, 0, 10000, 4, 1, 10000, 1, 0, 0});
+  auto opunit = OpUnitToString(selfdriving::ExecutionOperatingUnitType::OP_INTEGER_PLUS_OR_MINUS);
+  auto result = ms_manager->InferOUModel(opunit, ou_model_save_path, features);
+  ASSERT_TRUE(result.second);
+  ASSERT_EQ(result.first.size(), features.size());
+  for (const auto &prediction : result.first) {
+    ASSERT_FALSE(prediction.empty());
+    ASSERT_EQ(prediction, result.first[0]);  // Same features, same prediction
+  }
+
+  // The features do not fit into a slot, so they are sent as JSON with the same predictions
+  std::vector<std::vector<double>> large_features(2000, features[0]);
+  auto large_result = ms_manager->InferOUModel(opunit, ou_model_save_path, large_features);
+  ASSERT_TRUE(large_result.second);
+  ASSERT_EQ(large_result.first.size(), large_features.size());
+  ASSERT_EQ(large_result.first[0].size(), result.first[0].size());
+  for (size_t i = 0; i < result.first[0].size(); i++) {
+    ASSERT_DOUBLE_EQ(large_result.first[0][i], result.first[0][i]);
+  }
+
+  // Inference with invalid opunit name will fail (and release the slot)
+  result = ms_manager->InferOUModel("OP_SUPER_MAGICAL_DIVIDE", ou_model_save_path, features);
+  ASSERT_FALSE(result.second);
+  for (size_t i = 0; i < 16; i++) {
+    result = ms_manager->InferOUModel(opunit, ou_model_save_path, features);
+    ASSERT_TRUE(result.second);
+  }
+
+  // Quit
+  ms_manager->StopModelServer();
+}
+
+// NOLINTNEXTLINE
+TEST_F(ModelServerTest, BrokerTest) {
+  messenger::messenger_logger->set_level(spdlog::level::info);
+  model_server_logger->set_level(spdlog::level::info);
+
+  // The commands are spread over two ModelServer processes by a broker
+  auto primary = BuildDBMain(0, 2);
+  primary->GetNetworkLayer()->GetServer()->RunServer();
+
+  auto ms_manager = primary->GetModelServerManager();
+
+  // Wait for the model server process to start
+  while (!ms_manager->ModelServerStarted()) {
+  }
+
+  ms_manager->PrintMessage("ModelServer Broker Test");
+
+  std::vector<std::string> methods{"lr"};
+  std::string ou_model_save_path = "ou_model_map_broker.pickle";
+
+  ModelServerFuture<std::string> future;
+  const char *env = ::getenv(BUILD_ABS_PATH);
+  std::string project_build_path = (env != nullptr ? env : ".");
+  ms_manager->TrainModel(ModelType::Type::OperatingUnit, methods, project_build_path + "/bin", ou_model_save_path,
+                         nullptr, common::ManagedPointer<ModelServerFuture<std::string>>(&future));
+  auto res = future.Wait();
+  ASSERT_EQ(res.second, true);  // Training succeeds
+
+  // The job is known to the worker that ran it
+  auto status = ms_manager->GetJobStatus(ou_model_save_path);
+  ASSERT_TRUE(status.second);
+  ASSERT_EQ(status.first[ou_model_save_path]["state"], "SUCCEEDED");
+  status = ms_manager->GetJobStatus();
+  ASSERT_TRUE(status.second);
+  ASSERT_TRUE(status.first.contains(ou_model_save_path));
+  ASSERT_FALSE(ms_manager->CancelJob("model_server_test_non_exist_job").second);
+
+  std::vector<std::vector<double>> features(4, std::vector<double>{0, 0, 10000, 4, 1, 10000, 1, 0, 0});
+  for (size_t i = 0; i < 8; i++) {
+    auto result = ms_manager->InferOUModel(
+        OpUnitToString(selfdriving::ExecutionOperatingUnitType::OP_INTEGER_PLUS_OR_MINUS), ou_model_save_path,
+        features);
+    ASSERT_TRUE(result.second);
+    ASSERT_EQ(result.first.size(), features.size());
+  }
+
+  // Quit
+  ms_manager->StopModelServer();
+}
+
 // NOLINTNEXTLINE
 TEST_F(ModelServerTest, ForecastModelTest) {
   messenger::messenger_logger->set_level(spdlog::level::info);